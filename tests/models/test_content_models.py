@@ -1,7 +1,10 @@
 from django.test import TestCase, TransactionTestCase
+from django.utils.module_loading import import_string
 from unittest import skip
-from .helper_models import SimpleModelTests, SiteContent, Location, Resource, Student, ClassOffer
-# , UserHC, Session, Subject
+from datetime import date, time, timedelta
+from .helper_models import SimpleModelTests, SiteContent, Location, Resource, Student, ClassOffer, Session, Subject
+# , UserHC
+ResourcePublication = import_string('classwork.models.ResourcePublication')
 # Create your tests here.
 
 
@@ -41,9 +44,65 @@ class ResourceModelTests(SimpleModelTests, TransactionTestCase):
     # classoffer = ClassOffer.objects.get(id=1) is connected to resource and a Session, Subject, Location.
     # there is a student with id=1, and they have a registration for this classoffer.
 
-    def test_manager_live_not_implemented(self):
-        with self.assertRaises(NotImplementedError):
-            Resource.objects.live()
+    def make_current_classes(self, cur_week=3):
+        """Creates ClassOffers, where today is the cur_week class, with Resources for many avail and expire values. """
+        start = date.today() - timedelta(days=7*(cur_week - 1))
+        sess = Session.objects.create(name="Sess Cur", key_day_date=start, publish_date=start - timedelta(days=14))
+        for num, skips in enumerate((0, 1)):
+            subj = Subject.objects.create(name=f"live_{num}", level='Spec', version='A')
+            co = ClassOffer.objects.create(subject=subj, session=sess, start_time=time(17, 0),
+                                           class_day=start.weekday(), skip_weeks=skips)
+            for avail in list(range(sess.num_weeks + 1)) + [200]:
+                for expire in range(3):
+                    name = '_'.join((str(num), str(avail), str(expire)))
+                    res = Resource.objects.create(content_type='text', name=name, avail=avail, expire=expire)
+                    (co if expire == 1 else subj).resources.add(res)
+        return sess
+
+    def test_manager_live_matches_get_resources(self):
+        self.make_current_classes()
+        ResourcePublication.objects.refresh()
+        expected = set(ClassOffer.objects.resources().values_list('name', flat=True))
+        with self.assertNumQueries(1):
+            actual = set(Resource.objects.live().values_list('name', flat=True))
+
+        self.assertGreater(len(expected), 0)
+        self.assertLess(len(expected), Resource.objects.count())
+        self.assertSetEqual(expected, actual)
+
+    def test_manager_live_type_user_and_date_range(self):
+        sess = self.make_current_classes()
+        teacher_res = Resource.objects.filter(avail=0, expire=0).first()
+        teacher_res.user_type = 2
+        teacher_res.save()
+        live_student = set(Resource.objects.live(type_user='student'))
+        live_teacher = set(Resource.objects.live(type_user=2))
+        before_start = Resource.objects.live(start=sess.key_day_date - timedelta(days=30))
+        whole_session = Resource.objects.live(start=sess.start_date, end=sess.end_date)
+
+        self.assertNotIn(teacher_res, live_student)
+        self.assertIn(teacher_res, live_teacher)
+        self.assertSetEqual(set(before_start), set(Resource.objects.filter(avail=0)))
+        self.assertGreater(whole_session.count(), Resource.objects.live().count())
+
+    def test_publications_refresh_on_changes(self):
+        sess = self.make_current_classes()
+        res = Resource.objects.filter(avail=2, expire=1).first()
+        co = res.classoffers.first()
+        window = res.publications.get()
+        initial_publish = co.start_date + timedelta(days=7)
+        res.avail = 1
+        res.save()
+        changed_window = res.publications.get()
+        sess.key_day_date = sess.key_day_date + timedelta(days=7)
+        sess.save(update_fields=['key_day_date'])
+        moved_window = res.publications.get()
+        co.resources.remove(res)
+
+        self.assertEqual(window.publish_date, initial_publish)
+        self.assertEqual(changed_window.publish_date, co.start_date)
+        self.assertEqual(moved_window.publish_date, co.start_date + timedelta(days=7))
+        self.assertEqual(res.publications.count(), 0)
 
     @skip("Not Implemented")
     def test_publish_not_view_if_not_joined(self):
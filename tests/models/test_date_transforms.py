@@ -0,0 +1,69 @@
+from django.test import TestCase
+from django.db.models import F, Value, IntegerField
+from django.utils.module_loading import import_string
+from datetime import date, timedelta
+from .helper_models import Session
+AddDate = import_string('classwork.transforms.AddDate')
+DateDiff = import_string('classwork.transforms.DateDiff')
+DateToday = import_string('classwork.transforms.DateToday')
+DayYear = import_string('classwork.transforms.DayYear')
+NumDay = import_string('classwork.transforms.NumDay')
+DateFromNum = import_string('classwork.transforms.DateFromNum')
+MakeDate = import_string('classwork.transforms.MakeDate')
+
+
+class DateFunctionsTests(TestCase):
+    """The date functions give the same results as Python, whichever database backend is used. """
+    key_day = date(2020, 2, 27)
+
+    def setUp(self):
+        self.session = Session.objects.create(name='date_funcs', key_day_date=self.key_day, max_day_shift=0)
+
+    def get_annotated(self, **annotations):
+        return Session.objects.filter(pk=self.session.pk).annotate(**annotations).values(*annotations).get()
+
+    def test_add_date(self):
+        result = self.get_annotated(
+            later=AddDate(F('key_day_date'), 3),
+            earlier=AddDate(F('key_day_date'), -30),
+            weeks=AddDate(F('key_day_date'), 7 * F('num_weeks')),
+        )
+
+        self.assertEqual(result['later'], self.key_day + timedelta(days=3))
+        self.assertEqual(result['earlier'], self.key_day - timedelta(days=30))
+        self.assertEqual(result['weeks'], self.key_day + timedelta(days=7 * self.session.num_weeks))
+
+    def test_date_diff(self):
+        other = date(2019, 12, 25)
+        result = self.get_annotated(after=DateDiff(F('key_day_date'), Value(other)),
+                                    before=DateDiff(Value(other), F('key_day_date')))
+
+        self.assertEqual(result['after'], (self.key_day - other).days)
+        self.assertEqual(result['before'], (other - self.key_day).days)
+
+    def test_date_today(self):
+        result = self.get_annotated(today=DateToday(), days_since=DateDiff(DateToday(), F('key_day_date')))
+
+        self.assertEqual(result['today'], date.today())
+        self.assertEqual(result['days_since'], (date.today() - self.key_day).days)
+
+    def test_day_of_year_and_make_date(self):
+        day_of_year = self.key_day.timetuple().tm_yday
+        result = self.get_annotated(
+            day=DayYear('key_day_date'),
+            made=MakeDate(Value(2020, output_field=IntegerField()), DayYear('key_day_date')),
+        )
+        found = Session.objects.filter(key_day_date__dayyear=day_of_year)
+
+        self.assertEqual(result['day'], day_of_year)
+        self.assertEqual(result['made'], self.key_day)
+        self.assertIn(self.session, found)
+
+    def test_num_day_and_date_from_num(self):
+        expected_num = self.key_day.toordinal() + 365  # Matches the MySQL TO_DAYS count.
+        result = self.get_annotated(num=NumDay('key_day_date'), back=DateFromNum(NumDay('key_day_date')))
+        found = Session.objects.filter(key_day_date__numday=expected_num)
+
+        self.assertEqual(result['num'], expected_num)
+        self.assertEqual(result['back'], self.key_day)
+        self.assertIn(self.session, found)
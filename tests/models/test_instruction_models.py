@@ -1,7 +1,11 @@
-from django.test import TestCase, TransactionTestCase
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.conf import settings
+from django.core.management import call_command
+from django.db import transaction
 from django.db.models import Q, Max, Subquery
+from django.test.utils import CaptureQueriesContext
 from unittest import skip
+from io import StringIO
 from .helper_models import SimpleModelTests, Resource, UserHC, Student, Session, Subject, ClassOffer
 from datetime import date, time, timedelta, datetime as dt
 
@@ -224,6 +228,24 @@ class ClassOfferModelTests(SimpleModelTests, TransactionTestCase):
         self.assertEqual(len(res_by_classoffer), len(res_by_taken))
         self.assertTrue(all(ea in res_by_taken for ea in res_by_classoffer))
 
+    def test_manager_resources_num_queries_independent_of_classoffers(self):
+        sess = Session.objects.first()
+        subj = Subject.objects.first()
+        for num in range(5):
+            co = ClassOffer.objects.create(subject=subj, session=sess, start_time=time(17 + num, 0))
+            co.resources.add(Resource.objects.create(content_type='text', name=f"co_{num}", avail=0, expire=0))
+        classoffers = ClassOffer.objects.all()
+        expected_names = set()
+        for co in classoffers:
+            expected_names.update(ClassOffer.objects.get_resources(model=co, live=True).values_list('name', flat=True))
+        with self.assertNumQueries(2):
+            actual = list(classoffers.resources())
+        actual_names = [ea['name'] for ea in actual]
+
+        self.assertGreater(len(expected_names), 5)
+        self.assertEqual(len(actual_names), len(expected_names))
+        self.assertSetEqual(set(actual_names), expected_names)
+
     def test_manager_resources_params_start_and_end(self):
         with self.assertRaises(TypeError):
             ClassOffer.objects.get_resources(start='bad', end='bad', skips=0, type_user=0, max_weeks=0)
@@ -268,62 +290,32 @@ class ClassOfferModelTests(SimpleModelTests, TransactionTestCase):
         self.assertEqual(len(all_res_by_classoffer), len(expected_all_res))
         self.assertSetEqual(set([repr(ea) for ea in expected_all_res]), set([repr(ea) for ea in all_res_by_classoffer]))
 
-    def test_not_implemented_manager_most_recent_resource_per_classoffer(self):
-        with self.assertRaises(NotImplementedError):
-            ClassOffer.objects.most_recent_resource_per_classoffer()
-
-    @skip("Not Implemented Feature")
     def test_manager_most_recent_resource_per_classoffer(self):
-        from pprint import pprint
         sess = Session.objects.first()
-        res_count = Resource.objects.count()
-        expected_res = list(Resource.objects.all())
-        expire = 0
+        expected = {}
+        for co in ClassOffer.objects.all():
+            res = ClassOffer.objects.get_resources(model=co, live=True).order_by('-publish', '-avail', '-pk').first()
+            expected[co.pk] = res.name if res else None
         for lvl, display in Subject.LEVEL_CHOICES[:2]:
             for ver, _ in Subject.VERSION_CHOICES[:3]:
-                avail = 0
                 subj = Subject.objects.create(name='_'.join((lvl, ver)), level=lvl, version=ver)
-                subj.save()
-                res = Resource.objects.create(
-                    content_type='text',
-                    name='_'.join((lvl, ver, str(avail), str(expire))),
-                    user_type=1,
-                    avail=avail,
-                    expire=expire,
-                )
-                res.save()
-                res_count += 1
-                subj.resources.add(res)
                 co = ClassOffer.objects.create(subject=subj, session=sess, start_time=(time(17, 0)))
-                co.save()
-                while avail < sess.num_weeks:
-                    avail += 1
-                    res = Resource.objects.create(
-                        content_type='text',
-                        name='_'.join((lvl, ver, str(avail), str(expire))),
-                        user_type=1,
-                        avail=avail,
-                        expire=expire,
-                    )
-                    res.save()
-                    res_count += 1
+                for avail in range(sess.num_weeks + 1):
+                    res = Resource.objects.create(content_type='text', name='_'.join((lvl, ver, str(avail), '0')),
+                                                  user_type=1, avail=avail, expire=0)
                     subj.resources.add(res)
-                expected_res.append(res)
-        resource_count = Resource.objects.all().count()
-        actual_res = ClassOffer.objects.most_recent_resource_per_classoffer().values('recent_resource')
-        print("===================== most recent resource per classoffer ===============================")
-        expected_names = [getattr(ea, 'name', '') for ea in expected_res]
-        pprint(expected_names)
-        print("------------------------------------------------------------------------")
-        actual_names = [ea.get('recent_resource', '') for ea in actual_res]
-        pprint(actual_names)
-        # pprint([getattr(ea, 'recent_resource', '') for ea in actual_res.all()])
+                expected[co.pk] = res.name  # Published after the final class, the most recent of this ClassOffer.
+        unpublished = Resource.objects.create(content_type='text', name='unpublished', avail=0, expire=1)
+        co.resources.add(unpublished)  # The Session has ended, so this has already expired.
+        with self.assertNumQueries(1):
+            actual = list(ClassOffer.objects.most_recent_resource_per_classoffer())
+        actual_names = {ea.pk: ea.recent_resource for ea in actual}
+        last = [ea for ea in actual if ea.pk == co.pk][0]
+
         self.assertLessEqual(sess.end_date, date.today())
-        self.assertLessEqual(sess.end_date, dt.utcnow().date())
-        self.assertEqual(res_count, resource_count)
-        self.assertEqual(len(expected_res), len(actual_res))
-        self.assertTrue(all(ea in expected_res for ea in actual_res))
-        # self.assertSetEqual(set(expected_names), set(actual_names))
+        self.assertDictEqual(expected, actual_names)
+        self.assertEqual(last.recent_resource_id, res.pk)
+        self.assertEqual(last.recent_resource_publish, co.end_date)
 
     def test_not_implemented_model_resources(self):
         first = ClassOffer.objects.first()
@@ -677,6 +669,40 @@ class ClassOfferModelTests(SimpleModelTests, TransactionTestCase):
         self.assertGreater(model.skip_weeks, 0)
         self.assertEqual(model.end_date, expected)
 
+    def test_session_save_updates_stored_dates(self):
+        model = ClassOffer.objects.first()
+        session = model.session
+        initial_start, initial_end = model.start_date, model.end_date
+        session.key_day_date = session.key_day_date + timedelta(days=7)
+        session.save(update_fields=['key_day_date'])
+        model.refresh_from_db()
+
+        self.assertEqual(model.start_date, initial_start + timedelta(days=7))
+        self.assertEqual(model.end_date, initial_end + timedelta(days=7))
+        self.assertEqual((model.start_date, model.end_date), model.compute_dates())
+
+    def test_backfill_command_stored_dates(self):
+        ClassOffer.objects.update(start_date=None, end_date=None)
+        out = StringIO()
+        call_command('classoffer_dates', stdout=out)
+        expected_count = ClassOffer.objects.count()
+
+        self.assertIn(f"Updated the stored dates for {expected_count} ClassOffer(s).", out.getvalue())
+        for model in ClassOffer.objects.all():
+            self.assertIsNotNone(model.start_date)
+            self.assertEqual((model.start_date, model.end_date), model.compute_dates())
+
+    def test_verify_command_matches_database_computed_dates(self):
+        out = StringIO()
+        call_command('classoffer_dates', verify=True, stdout=out)
+        self.assertIn("Found 0 ClassOffer(s) with incorrect stored dates.", out.getvalue())
+        ClassOffer.objects.update(start_date=None)
+        out = StringIO()
+        call_command('classoffer_dates', verify=True, stdout=out)
+        expected_count = ClassOffer.objects.count()
+
+        self.assertIn(f"Found {expected_count} ClassOffer(s) with incorrect stored dates.", out.getvalue())
+
     def test_num_level(self):
         model = ClassOffer.objects.first()
         expected = model._num_level
@@ -775,6 +801,51 @@ class SessionCoverageTests(TransactionTestCase):
         self.assertEqual(third.publish_date, first.expire_date)
         self.assertEqual(expected_key_day, third.key_day_date)
 
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_timeline_lookups_do_not_query_database(self):
+        first = Session.objects.first()
+        second = self.create_session(name="second_test")
+        third = self.create_session(name="third_test")
+        Session.timeline()  # Builds the timeline, which is then used until a Session is saved or deleted.
+
+        with self.assertNumQueries(0):
+            self.assertEqual(Session.last_session(), third)
+            self.assertEqual(Session.last_session(since=third.key_day_date), second)
+            self.assertEqual(second.prev_session, first)
+            self.assertEqual(second.next_session, third)
+            self.assertIsNone(third.next_session)
+            self.assertIsNone(first.prev_session)
+            self.assertEqual(Session._default_date('publish_date'), third.expire_date)
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_timeline_not_kept_without_cache(self):
+        """Without a shared cache to clear, a timeline kept in-process could be stale for other processes. """
+        Session.timeline()
+        with self.assertNumQueries(1):
+            Session.last_session()
+
+    def test_timeline_built_once_for_clean_in_transaction(self):
+        first = Session.objects.first()
+        self.create_session(name="second_test")
+        collide_key_day = first.key_day_date + timedelta(days=7*(first.num_weeks - 1))
+        third = Session(name="third_test", key_day_date=collide_key_day)
+        with transaction.atomic(), CaptureQueriesContext(transaction.get_connection()) as queries:
+            third.clean()
+        builds = [ea for ea in queries.captured_queries if 'ORDER BY' in ea['sql'] and 'key_day_date' in ea['sql']]
+        self.assertEqual(1, len(builds))
+        self.assertNotEqual(collide_key_day, third.key_day_date)
+
+    def test_timeline_rebuilt_after_session_save_and_delete(self):
+        first = Session.objects.first()
+        self.assertEqual(Session.last_session(), first)
+        later = self.create_session(name="later_test")
+        self.assertEqual(Session.last_session(), later)
+        self.assertEqual(first.next_session, later)
+        later.delete()
+
+        self.assertEqual(Session.last_session(), first)
+        self.assertIsNone(first.next_session)
+
     def test_compute_expire_day_with_key_day_none(self):
         session = Session.objects.get(id=1)
         computed_expire = session.computed_expire_day()
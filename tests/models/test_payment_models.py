@@ -1,6 +1,22 @@
-from django.test import TestCase  # , TransactionTestCase
+from django.test import TestCase, override_settings  # , TransactionTestCase
+from django.core import mail
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
 from unittest import skip  # @skip("Not Implemented")
-from .helper_models import SimpleModelTests, Student, ClassOffer, Payment, Registration, Notify
+from .helper_models import SimpleModelTests, Student, ClassOffer, Payment, Registration, Notify, UserHC
+from .helper_models import Session, Subject
+from datetime import date, time, timedelta
+from decimal import Decimal
+from io import StringIO
+import logging
+log_event = import_string('classwork.logs.log_event')
+EmailOutbox = import_string('classwork.models.EmailOutbox')
+RegisterForm = import_string('classwork.forms.RegisterForm')
+multimodelformset_factory = import_string('users.multiform.multimodelformset_factory')
 # from .helper_models import Resource, UserHC, Session, Subject
 
 
@@ -81,3 +97,357 @@ class NotifyModelTests(TestCase):
     repr_dict = {'Notify': 'name'}
     str_list = {}
     # TODO: Figure out values for SimpleModelTests and/or write other tests.
+
+    def test_register_logs_event_with_timing(self):
+        kwargs = {'email': 'notify@fakesite.com', 'password': '1234', 'first_name': 'fa', 'last_name': 'fake'}
+        student = UserHC.objects.create_user(is_student=True, **kwargs).student
+        with self.assertLogs('classwork.models', logging.INFO) as logs:
+            queued = Notify.register(selected=['class_one', 'class_two'], student=student)
+        record = logs.records[-1]
+
+        self.assertEqual(0, len(mail.outbox))
+        self.assertEqual(['notify@fakesite.com'], queued.recipients)
+        self.assertEqual(EmailOutbox.PENDING, queued.status)
+        self.assertIn('class_one, class_two', queued.body)
+        self.assertEqual('notify_register', record.event)
+        self.assertEqual((student.pk, 2, queued.pk), (record.student, record.classes, record.outbox))
+        self.assertEqual(1, record.queries)
+        self.assertIsInstance(record.elapsed_ms, float)
+
+    def test_register_form_save_queues_email_with_payment(self):
+        kwargs = {'email': 'form@fakesite.com', 'password': '1234', 'first_name': 'fa', 'last_name': 'fake'}
+        student = UserHC.objects.create_user(is_student=True, **kwargs).student
+        session = Session.objects.create(name='notify_sess', key_day_date=date(2020, 1, 9))
+        subjects = [Subject.objects.create(name=f"notify_{num}", version='A') for num in range(2)]
+        for subj in subjects:
+            ClassOffer.objects.create(subject=subj, session=session, start_time=time(19, 0))
+        selected = ClassOffer.objects.filter(session=session)
+        form = RegisterForm(class_choices=selected)
+        form.cleaned_data = {'class_selected': selected, 'student': student, 'paid_by': None}
+        form.cleaned_data.update({name: '' for name in RegisterForm.Meta.fields})
+        payment = form.save()
+
+        self.assertEqual(2, Registration.objects.filter(payment=payment, student=student).count())
+        self.assertEqual(1, EmailOutbox.objects.filter(to='form@fakesite.com', status=EmailOutbox.PENDING).count())
+        self.assertEqual(0, len(mail.outbox))
+
+    def test_register_form_save_repeated_submission_is_not_registered_again(self):
+        kwargs = {'email': 'twice@fakesite.com', 'password': '1234', 'first_name': 'fa', 'last_name': 'fake'}
+        student = UserHC.objects.create_user(is_student=True, **kwargs).student
+        session = Session.objects.create(name='twice_sess', key_day_date=date(2020, 1, 9))
+        subjects = [Subject.objects.create(name=f"twice_{num}", version='A') for num in range(3)]
+        for subj in subjects:
+            ClassOffer.objects.create(subject=subj, session=session, start_time=time(19, 0))
+        selected = ClassOffer.objects.filter(session=session).order_by('pk')
+        unpaid = Registration.objects.create(student=student, classoffer=selected[2])
+        form = RegisterForm(class_choices=selected)
+        form.cleaned_data = {'class_selected': selected, 'student': student, 'paid_by': None}
+        form.cleaned_data.update({name: '' for name in RegisterForm.Meta.fields})
+        payment = form.save()
+        repeated = form.save()
+        unpaid.refresh_from_db()
+
+        self.assertEqual(payment, repeated)
+        self.assertEqual(payment, unpaid.payment)
+        self.assertEqual(3, Registration.objects.filter(student=student).count())
+        self.assertEqual(3, Registration.objects.filter(payment=payment).count())
+        self.assertEqual(1, Payment.objects.filter(student=student).count())
+        self.assertEqual(1, EmailOutbox.objects.filter(to='twice@fakesite.com').count())
+
+    def test_registration_unique_for_student_and_classoffer(self):
+        kwargs = {'email': 'unique@fakesite.com', 'password': '1234', 'first_name': 'fa', 'last_name': 'fake'}
+        student = UserHC.objects.create_user(is_student=True, **kwargs).student
+        session = Session.objects.create(name='unique_sess', key_day_date=date(2020, 1, 9))
+        subject = Subject.objects.create(name="unique_subj", version='A')
+        classoffer = ClassOffer.objects.create(subject=subject, session=session, start_time=time(19, 0))
+        Registration.objects.create(student=student, classoffer=classoffer)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Registration.objects.create(student=student, classoffer=classoffer)
+        Registration.objects.create(student=None, classoffer=classoffer)
+        Registration.objects.create(student=None, classoffer=classoffer)
+
+    def make_session_students(self, count):
+        """Returns a Session with two ClassOffers, and count Students in the first class, one also in the second. """
+        session = Session.objects.create(name='announce_sess', key_day_date=date(2020, 1, 9))
+        subjects = [Subject.objects.create(name=f"announce_{num}", version='A') for num in range(2)]
+        classoffers = [ClassOffer.objects.create(subject=subj, session=session, start_time=time(18 + num, 0))
+                       for num, subj in enumerate(subjects)]
+        students = []
+        for num in range(count):
+            kwargs = {'email': f"announce_{num}@fakesite.com", 'password': '1234', 'first_name': f"n{num}"}
+            student = UserHC.objects.create_user(is_student=True, last_name='fake', **kwargs).student
+            Registration.objects.create(student=student, classoffer=classoffers[0])
+            students.append(student)
+        Registration.objects.create(student=students[0], classoffer=classoffers[1])
+        return session, classoffers, students
+
+    def test_announce_renders_for_each_student(self):
+        session, classoffers, students = self.make_session_students(3)
+        with self.assertNumQueries(2):
+            queued = Notify.announce("Announcement", message="No class next week. ", session=session)
+        by_email = {ea.to: ea for ea in queued}
+        only_second = Notify.announce("Second Class", message="Room change. ", classoffer=classoffers[1])
+
+        self.assertEqual(0, len(mail.outbox))
+        self.assertEqual(3, EmailOutbox.objects.filter(subject="Announcement", status=EmailOutbox.PENDING).count())
+        self.assertEqual({f"announce_{num}@fakesite.com" for num in range(3)}, set(by_email))
+        self.assertIn("Hello n0,", by_email['announce_0@fakesite.com'].body)
+        self.assertIn("No class next week.", by_email['announce_1@fakesite.com'].body)
+        self.assertIn(str(classoffers[1]), by_email['announce_0@fakesite.com'].body)
+        self.assertNotIn(str(classoffers[1]), by_email['announce_1@fakesite.com'].body)
+        self.assertEqual(['announce_0@fakesite.com'], [ea.to for ea in only_second])
+
+    @override_settings(EMAIL_OUTBOX_BATCH_SIZE=2, EMAIL_OUTBOX_RATE=0,
+                       EMAIL_BACKEND='tests.models.test_payment_models.CountingEmailBackend')
+    def test_announce_send_uses_one_connection_per_batch(self):
+        session, classoffers, students = self.make_session_students(5)
+        waiting = EmailOutbox.objects.enqueue("Waiting", "Body", 'waiting@fakesite.com')
+        CountingEmailBackend.opened = 0
+        with self.assertLogs('classwork.models', logging.INFO) as logs:
+            Notify.announce("Announcement", session=session, send=True)
+        record = logs.records[-1]
+        waiting.refresh_from_db()
+
+        self.assertEqual(EmailOutbox.PENDING, waiting.status)
+        self.assertEqual(5, len(mail.outbox))
+        self.assertEqual(3, CountingEmailBackend.opened)
+        self.assertEqual(5, EmailOutbox.objects.filter(status=EmailOutbox.SENT).count())
+        self.assertEqual(('notify_announce', 5, 5, 0), (record.event, record.recipients, record.sent, record.unsent))
+
+    def test_announce_needs_session_or_classoffer(self):
+        with self.assertRaises(ValueError):
+            Notify.announce("Announcement")
+
+
+class PriceQuoteTests(TestCase):
+
+    def setUp(self):
+        session = Session.objects.create(name='quote_sess', key_day_date=date(2020, 1, 9))
+        prices = [('40.00', '5.00', '10.00', True), ('60.00', '10.00', '15.00', True), ('25.00', '0', '20.00', False)]
+        self.classoffers = []
+        for num, (full, pre, multi, qualifies) in enumerate(prices):
+            amounts = {'full_price': full, 'pre_pay_discount': pre, 'multiple_purchase_discount': multi}
+            subject = Subject.objects.create(name=f"quote_{num}", version='A', **amounts,
+                                             qualifies_as_multi_class_discount=qualifies)
+            self.classoffers.append(ClassOffer.objects.create(subject=subject, session=session, start_time=time(19, 0)))
+        kwargs = {'email': 'quote@fakesite.com', 'password': '1234', 'first_name': 'fa', 'last_name': 'fake'}
+        self.student = UserHC.objects.create_user(is_student=True, **kwargs).student
+        self.student.credit = Decimal('7.50')
+        self.student.save()
+
+    def test_quote_fetches_prices_in_one_query(self):
+        ids = [ea.pk for ea in self.classoffers]
+        with self.assertNumQueries(1):
+            quote = ClassOffer.objects.quote(ids, student=self.student)
+            description = quote.description
+
+        self.assertEqual(Decimal('125.00'), quote.full_price)
+        self.assertEqual(Decimal('15.00'), quote.pre_pay_discount)
+        self.assertEqual(Decimal('10.00'), quote.multiple_purchase_discount)
+        self.assertEqual(Decimal('7.50'), quote.credit_applied)
+        self.assertEqual(Decimal('107.50'), quote.full_total)
+        self.assertEqual(Decimal('92.50'), quote.pre_total)
+        self.assertEqual(''.join(str(ea) + ', ' for ea in self.classoffers), description)
+
+    def test_select_matches_new_quote_without_queries(self):
+        quote = ClassOffer.objects.quote(self.classoffers)
+        selected = [str(self.classoffers[1].pk), str(self.classoffers[2].pk)]
+        with self.assertNumQueries(0):
+            preview = quote.select(selected)
+            data = preview.as_dict()
+        expected = ClassOffer.objects.quote(self.classoffers[1:])
+
+        self.assertEqual(expected.payment_fields(), preview.payment_fields())
+        self.assertEqual(Decimal('0'), preview.multiple_purchase_discount)
+        self.assertEqual('75.00', data['pre_total'])
+        self.assertEqual('15.00', data['classes'][self.classoffers[1].pk]['multi_discount'])
+
+    def test_class_register_uses_quote(self):
+        quote = ClassOffer.objects.quote(self.classoffers[:2], student=self.student)
+        payment = Payment.objects.classRegister(register=quote, student=self.student)
+        from_list = Payment.objects.classRegister(register=self.classoffers[:2], student=self.student)
+
+        for key, value in quote.payment_fields().items():
+            self.assertEqual(value, getattr(payment, key))
+            self.assertEqual(value, getattr(from_list, key))
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ConnectionRefusedError("No mail server")
+
+
+class StoppedEmailBackend(LocmemEmailBackend):
+    """Sends the first message, then stops as a killed worker would. """
+
+    def send_messages(self, email_messages):
+        if mail.outbox:
+            raise KeyboardInterrupt
+        return super().send_messages(email_messages)
+
+
+class CountingEmailBackend(LocmemEmailBackend):
+    opened = 0
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return super().open()
+
+
+@override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=3, EMAIL_OUTBOX_RETRY_DELAY=60, EMAIL_OUTBOX_RATE=0)
+class EmailOutboxTests(TestCase):
+    failing_backend = 'tests.models.test_payment_models.FailingEmailBackend'
+
+    def setUp(self):
+        self.outbox = EmailOutbox.objects.enqueue("Subject", "Body", ['one@fakesite.com', 'two@fakesite.com'])
+
+    def test_send_records_success(self):
+        sent = self.outbox.send()
+        self.outbox.refresh_from_db()
+
+        self.assertTrue(sent)
+        self.assertEqual(1, len(mail.outbox))
+        self.assertEqual(['one@fakesite.com', 'two@fakesite.com'], mail.outbox[0].to)
+        self.assertEqual((EmailOutbox.SENT, 1, ''), (self.outbox.status, self.outbox.attempts, self.outbox.last_error))
+        self.assertIsNotNone(self.outbox.sent_at)
+        self.assertNotIn(self.outbox, EmailOutbox.objects.due())
+
+    def test_failed_send_retries_with_doubling_delay(self):
+        delays = []
+        with self.settings(EMAIL_BACKEND=self.failing_backend), self.assertLogs('classwork.models', logging.WARNING):
+            for attempt in range(3):
+                before = timezone.now()
+                self.assertFalse(self.outbox.send())
+                delays.append(self.outbox.send_after - before)
+        self.outbox.refresh_from_db()
+
+        self.assertEqual(EmailOutbox.FAILED, self.outbox.status)
+        self.assertEqual(3, self.outbox.attempts)
+        self.assertIn('No mail server', self.outbox.last_error)
+        self.assertAlmostEqual(60, delays[0].total_seconds(), delta=5)
+        self.assertAlmostEqual(120, delays[1].total_seconds(), delta=5)
+        self.assertNotIn(self.outbox, EmailOutbox.objects.due(now=timezone.now() + timedelta(days=1)))
+
+    def test_send_outbox_command_sends_due_emails_in_batches(self):
+        later = EmailOutbox.objects.enqueue("Later", "Body", 'later@fakesite.com',
+                                            send_after=timezone.now() + timedelta(hours=1))
+        for num in range(4):
+            EmailOutbox.objects.enqueue(f"Subject {num}", "Body", f"{num}@fakesite.com")
+        out = StringIO()
+        call_command('send_outbox', batch_size=2, stdout=out)
+
+        self.assertIn("Sent 5 email(s), with 0 failed attempt(s).", out.getvalue())
+        self.assertEqual(5, len(mail.outbox))
+        self.assertEqual(5, EmailOutbox.objects.filter(status=EmailOutbox.SENT).count())
+        self.assertEqual([later], list(EmailOutbox.objects.filter(status=EmailOutbox.PENDING)))
+
+    def test_send_outbox_command_keeps_failed_for_retry(self):
+        out = StringIO()
+        with self.settings(EMAIL_BACKEND=self.failing_backend), self.assertLogs('classwork.models', logging.WARNING):
+            call_command('send_outbox', stdout=out)
+        self.outbox.refresh_from_db()
+
+        self.assertIn("Sent 0 email(s), with 1 failed attempt(s).", out.getvalue())
+        self.assertEqual((EmailOutbox.PENDING, 1), (self.outbox.status, self.outbox.attempts))
+        self.assertGreater(self.outbox.send_after, timezone.now())
+
+    @override_settings(EMAIL_OUTBOX_CLAIM_SECONDS=600)
+    def test_stopped_worker_keeps_sent_results_and_unsent_claims(self):
+        EmailOutbox.objects.enqueue("Second", "Body", 'second@fakesite.com')
+        with self.settings(EMAIL_BACKEND='tests.models.test_payment_models.StoppedEmailBackend'):
+            with self.assertRaises(KeyboardInterrupt):
+                EmailOutbox.objects.send_due()
+        first, second = EmailOutbox.objects.order_by('pk')
+
+        self.assertEqual((EmailOutbox.SENT, 1), (first.status, first.attempts))
+        self.assertEqual((EmailOutbox.PENDING, 0), (second.status, second.attempts))
+        self.assertNotIn(second, EmailOutbox.objects.due())
+        self.assertIn(second, EmailOutbox.objects.due(now=timezone.now() + timedelta(seconds=601)))
+
+
+class LogEventTests(TestCase):
+    logger = logging.getLogger('classwork.tests')
+
+    def test_counts_queries_and_elapsed_time(self):
+        with self.assertLogs(self.logger, logging.INFO) as logs:
+            with log_event(self.logger, 'count_students', source='test') as fields:
+                fields['found'] = Student.objects.count()
+        record = logs.records[0]
+
+        self.assertEqual(('count_students', 'test', 0, 1), (record.event, record.source, record.found, record.queries))
+        self.assertGreaterEqual(record.elapsed_ms, 0)
+        self.assertIn('count_students', record.getMessage())
+
+    def test_error_is_logged_and_raised(self):
+        with self.assertLogs(self.logger, logging.INFO) as logs:
+            with self.assertRaises(ValueError):
+                with log_event(self.logger, 'failing'):
+                    raise ValueError("failed")
+
+        self.assertEqual('ValueError', logs.records[0].error)
+
+    def test_nothing_measured_below_logger_level(self):
+        self.logger.setLevel(logging.WARNING)
+        self.addCleanup(self.logger.setLevel, logging.NOTSET)
+        with log_event(self.logger, 'ignored', level=logging.INFO) as fields:
+            Student.objects.count()
+
+        self.assertDictEqual({}, fields)
+
+
+class MultiModelFormSetTests(TestCase):
+    FormSet = multimodelformset_factory([Registration] * 3, fields=('student', 'classoffer', 'paid'))
+
+    def setUp(self):
+        session = Session.objects.create(name='multi_sess', key_day_date=date(2020, 1, 9))
+        subject = Subject.objects.create(name='multi_subj', version='A')
+        self.classoffers = [ClassOffer.objects.create(subject=subject, session=session, start_time=time(18 + num, 0))
+                            for num in range(2)]
+        kwargs = {'password': '1234', 'first_name': 'fa', 'last_name': 'fake'}
+        self.students = [UserHC.objects.create_user(is_student=True, email=f"multi{num}@fakesite.com", **kwargs).student
+                         for num in range(2)]
+        self.registrations = [Registration.objects.create(student=student, classoffer=self.classoffers[0])
+                              for student in self.students]
+
+    def get_data(self, *rows):
+        data = {'form-TOTAL_FORMS': len(rows), 'form-INITIAL_FORMS': 1, 'form-MIN_NUM_FORMS': 0}
+        for num, (registration, student, classoffer) in enumerate(rows):
+            data.update({f"form-{num}-id": getattr(registration, 'pk', ''), f"form-{num}-student": student.pk,
+                         f"form-{num}-classoffer": classoffer.pk, f"form-{num}-paid": 'on'})
+        return data
+
+    def test_unique_checks_saved_values(self):
+        first, second = self.students
+        rows = ((self.registrations[0], first, self.classoffers[1]), (None, second, self.classoffers[0]),
+                (None, first, self.classoffers[0]))
+        formset = self.FormSet(self.get_data(*rows))
+
+        self.assertFalse(formset.is_valid())
+        self.assertEqual([set(), {'__all__'}, {'__all__'}], [set(form.errors) for form in formset.forms])
+        self.assertEqual([], formset.non_form_errors())
+
+    def test_unique_checks_repeated_values(self):
+        first, second = self.students
+        rows = ((self.registrations[0], first, self.classoffers[0]), (None, second, self.classoffers[1]),
+                (None, second, self.classoffers[1]))
+        formset = self.FormSet(self.get_data(*rows))
+
+        self.assertFalse(formset.is_valid())
+        self.assertEqual(1, len(formset.non_form_errors()))
+        self.assertIn('__all__', formset.forms[2].errors)
+
+    def test_save_updates_in_bulk(self):
+        first, second = self.students
+        rows = ((self.registrations[0], first, self.classoffers[1]), (None, second, self.classoffers[1]))
+        formset = self.FormSet(self.get_data(*rows))
+        formset.bulk_save = True
+        self.assertTrue(formset.is_valid())
+        with self.assertNumQueries(1):
+            formset.save_existing_objects()
+        saved = formset.save_new_objects()
+
+        self.registrations[0].refresh_from_db()
+        self.assertEqual((self.classoffers[1], True), (self.registrations[0].classoffer, self.registrations[0].paid))
+        self.assertEqual(1, len(saved))
+        self.assertEqual(2, Registration.objects.filter(classoffer=self.classoffers[1]).count())
@@ -1,5 +1,15 @@
 from django.test import TestCase
+from django.contrib.auth.models import AnonymousUser
+from django.test.utils import CaptureQueriesContext
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core import serializers
+from django.db import connection
+from django.http import QueryDict
+from django.utils.module_loading import import_string
 from unittest import skip
+from urllib.parse import urlencode
+from io import StringIO
 from .helper_models import SimpleModelTests, AbstractProfileModelTests, UserHC
 from .helper_models import Location, Session, Subject, ClassOffer, Staff, Student
 from datetime import date, time  # , timedelta, datetime as dt
@@ -411,6 +421,78 @@ class StudentModelTests(AbstractProfileModelTests, TestCase):
     def test_subject_data_goal_map_as_dict(self):
         pass
 
+    def make_students_with_history(self):
+        """Returns a list of Students, each with a different class history from nothing up to past level three. """
+        versions = [key for key, string in Subject.VERSION_CHOICES]
+        subjs = {}
+        for level, string in Subject.LEVEL_CHOICES[:3]:
+            subjs[level] = [Subject.objects.create(level=level, version=ver, name=f"{level}_{ver}") for ver in versions]
+        session = Session.objects.create(name='test_sess', key_day_date=date(2020, 1, 9))
+        location = Location.objects.create(name='test_location', code='tl', address='12 main st', zipcode=98112, )
+        kwargs = {'session': session, 'location': location, 'start_time': time(19, 0), }
+        def _classes(**kwargs): return {lvl: [ClassOffer.objects.create(subject=subj, **kwargs) for subj in arr]
+                                        for lvl, arr in subjs.items()}
+        first = _classes(**kwargs)
+        kwargs['session'] = Session.objects.create(name='test_sess2')  # Determines key_day_date based on previous
+        second = _classes(**kwargs)
+        beg, l2, l3 = (level for level, string in Subject.LEVEL_CHOICES[:3])
+        histories = [
+            first[beg][:1],
+            first[beg],
+            first[beg] + first[l2][:2],
+            first[beg] + first[l2],
+            first[beg] + first[l2] + second[l2],
+            first[beg] + first[l2] + first[l3],
+            first[beg] + first[l2] + first[l3] + second[l3],
+            ]
+        students = [self.instance]  # The first Student has not taken any classes.
+        for num, attended in enumerate(histories):
+            kwargs = {'email': f"student_{num}@fakesite.com", 'password': '1234', 'first_name': 'fa', 'last_name': 'f'}
+            user = UserHC.objects.create_user(is_student=True, **kwargs)
+            user.student.taken.add(*attended)
+            students.append(user.student)
+        return students
+
+    def test_compute_levels_matches_each_student(self):
+        students = self.make_students_with_history()
+        expected = {student.pk: student.compute_level() for student in students}
+        expected_progress = {st.pk: {'beg': st.beg, 'l2': st.l2, 'l3': st.l3} for st in students}
+        levels = Student.objects.compute_levels()
+        data = {student.pk: student for student in Student.objects.with_level_data()}
+
+        self.assertEqual([0, 1, 2, 2, 2.5, 3, 3.5, 4], [expected[student.pk] for student in students])
+        self.assertDictEqual(expected, levels)
+        for pk, progress in expected_progress.items():
+            self.assertEqual(students[0].level_from_data(data[pk]), expected[pk])
+            self.assertEqual(data[pk].highest_level_num, Student.objects.get(pk=pk).highest_subject['level_num__max'])
+            for stage, extra in progress.items():
+                computed = Student.progress_from_data(stage, vars(data[pk]))
+                self.assertEqual(computed['done'], extra['done'])
+                if extra['done']:
+                    self.assertDictEqual(computed, extra)
+
+    def test_compute_levels_uses_one_query(self):
+        self.make_students_with_history()
+        with self.assertNumQueries(1):
+            levels = Student.objects.compute_levels()
+        with self.assertNumQueries(1):
+            self.instance.compute_level()
+        self.assertEqual(len(levels), Student.objects.count())
+
+    def test_recompute_student_levels_command(self):
+        students = self.make_students_with_history()
+        Student.objects.update(level=0)
+        expected = {student.pk: int(student.compute_level()) for student in students}
+        out = StringIO()
+        call_command('recompute_student_levels', verify=True, stdout=out)
+        self.assertIn(f"Found {sum(1 for level in expected.values() if level)} Student(s)", out.getvalue())
+        call_command('recompute_student_levels', batch_size=3, stdout=StringIO())
+        out = StringIO()
+        call_command('recompute_student_levels', verify=True, stdout=out)
+
+        self.assertDictEqual(expected, dict(Student.objects.values_list('pk', 'level')))
+        self.assertIn("Found 0 Student(s)", out.getvalue())
+
 
 USER_DEFAULTS = {'email': 'user_fake@fakesite.com', 'password': 'test12', 'first_name': 'f_user', 'last_name': 'fake_y'}
 
@@ -613,6 +695,75 @@ class UserManagerTests(TestCase):
         self.assertIsInstance(result, UserHC)
         self.assertNotIn(result, initial_users)
 
+    def test_match_identity_one_query(self):
+        kwargs = {'email': 'match@site.com', 'password': 'test12', 'first_name': "Match", 'last_name': "Person"}
+        exact = UserHC.objects.create_user(**kwargs)
+        same_email = UserHC.objects.create_user(**dict(kwargs, first_name="Other", username_not_email=True))
+        same_name = UserHC.objects.create_user(**dict(kwargs, email='elsewhere@site.com'))
+        UserHC.objects.create_user(**dict(kwargs, email='unrelated@site.com', last_name="Unrelated"))
+        with self.assertNumQueries(1):
+            match = UserHC.objects.match_identity(email='MATCH@site.com', first_name='match', last_name='PERSON')
+
+        self.assertEqual([exact], match.exact)
+        self.assertEqual([exact, same_email], match.same_email)
+        self.assertEqual([exact, same_name], match.same_name)
+        self.assertEqual(3, len(match.users))
+        self.assertEqual(same_email, match.find([same_email]))
+        self.assertIsNone(match.find())
+
+    def test_match_identity_no_lookup_values(self):
+        with self.assertNumQueries(0):
+            match = UserHC.objects.match_identity(first_name='only_first')
+
+        self.assertEqual([], match.users)
+        self.assertIsNone(match.find())
+
+    def test_save_sets_folded_fields(self):
+        kwargs = {'email': 'Folded@Site.com', 'password': 'test12', 'first_name': "Straße", 'last_name': "ÉCOLE"}
+        user = UserHC.objects.create_user(**kwargs)
+        values = (user.email_folded, user.username_folded, user.first_name_folded, user.last_name_folded)
+        user.last_name = "Other"
+        user.save(update_fields=['last_name'])
+        user.refresh_from_db()
+
+        self.assertEqual(('folded@site.com', 'folded@site.com', 'strasse', 'école'), values)
+        self.assertEqual('other', user.last_name_folded)
+
+    def test_loaded_fixture_sets_folded_fields(self):
+        """Fixtures are saved raw, without the UserHC save method. """
+        user = UserHC(pk=900, username='Loaded', email='Loaded@Site.com', first_name="Straße", last_name="ÉCOLE")
+        for obj in serializers.deserialize('json', serializers.serialize('json', [user])):
+            obj.save()
+        user = UserHC.objects.get(username='Loaded')
+        values = (user.email_folded, user.username_folded, user.first_name_folded, user.last_name_folded)
+
+        self.assertEqual(('loaded@site.com', 'loaded', 'strasse', 'école'), values)
+
+    def test_case_insensitive_unique_uses_folded_field(self):
+        validators = import_string('users.validators')
+        UserHC.objects.create_user(email='unique@site.com', password='test12', first_name="Uni", last_name="Que")
+        validate = validators.CaseInsensitiveUnique(UserHC, 'email', validators.DUPLICATE_EMAIL)
+        with CaptureQueriesContext(connection) as context:
+            with self.assertRaises(ValidationError):
+                validate('UNIQUE@Site.com')
+        validate('other@site.com')
+
+        self.assertIn('email_folded', context.captured_queries[0]['sql'])
+
+    def test_unique_values_one_query(self):
+        validators = import_string('users.validators')
+        user = UserHC.objects.create_user(email='own@site.com', password='test12', first_name="Own", last_name="User")
+        UserHC.objects.create_user(email='used@site.com', password='test12', first_name="Us", last_name="Ed")
+        unique = validators.UniqueValues(UserHC, user)
+        unique.add('username', 'USED@site.com', 'free_name', 'own@site.com')
+        with self.assertNumQueries(1):
+            results = [unique.is_used('username', value) for value in ('used@site.com', 'Free_Name', 'OWN@site.com')]
+        with self.assertNumQueries(1):
+            other = unique.is_used('username', 'other@site.com')
+
+        self.assertEqual([True, False, False], results)
+        self.assertFalse(other)
+
     def test_make_username_use_email(self):
         """Notice that switching to False for 'username_not_email' is not enough to modify the 'username'. """
         kwargs = USER_DEFAULTS.copy()
@@ -673,3 +824,119 @@ class UserManagerTests(TestCase):
         self.assertEqual(username_from_email, final_username)
 
 # end class UserExtendedModelTests
+
+
+class SignupValidatorTests(TestCase):
+    validators = import_string('users.validators')
+
+    def test_is_dangerous_memoized(self):
+        is_dangerous = self.validators.is_dangerous
+        is_dangerous.cache_clear()
+        results = [is_dangerous(value) for value in ('chris', 'josé', 'chrіs', 'chrіs')]
+
+        self.assertEqual([False, False, True, True], results)
+        self.assertEqual(1, is_dangerous.cache_info().hits)
+
+    def test_reserved_names(self):
+        validate = self.validators.ReservedNameValidator()
+        for name in ('webmaster', 'keybase.txt', 'index.html', '.well-known'):
+            with self.assertRaises(ValidationError):
+                validate(name)
+        validate('chris')
+
+        self.assertIsInstance(self.validators.RESERVED_NAMES, frozenset)
+        self.assertEqual(validate, self.validators.ReservedNameValidator(list(self.validators.DEFAULT_RESERVED_NAMES)))
+        self.assertNotEqual(validate, self.validators.validate_confusables)
+
+    def test_validate_critical_reports_each_field(self):
+        with self.assertRaises(ValidationError) as cm:
+            self.validators.validate_critical(username='webmaster', email='chrіs@site.com')
+        self.validators.validate_critical(username='chris', email='chris@site.com')
+        self.validators.validate_critical(username='webmaster', reserved_names=['other'])
+
+        self.assertEqual({'username', 'email'}, set(cm.exception.message_dict))
+        self.assertIn(str(self.validators.CONFUSABLE_EMAIL), cm.exception.message_dict['email'])
+
+
+class FieldsetLayoutTests(TestCase):
+    Form = import_string('users.forms.CustomRegistrationForm')
+    mixins = import_string('users.mixins')
+
+    def test_cached_layout_renders_same(self):
+        self.mixins.clear_layout_cache()
+        expected = {name: str(getattr(self.Form(), name)()) for name in ('as_table', 'as_ul', 'as_fieldset')}
+        cached = {name: str(getattr(self.Form(), name)()) for name in expected}
+
+        self.assertTrue(self.mixins._layout_cache)
+        self.assertEqual(expected, cached)
+
+    def test_render_does_not_modify_fieldsets(self):
+        initial = [(label, {**opts}) for label, opts in self.Form.fieldsets]
+        for i in range(2):
+            self.Form().as_test()
+
+        self.assertEqual(initial, [(label, {**opts}) for label, opts in self.Form.fieldsets])
+
+    def test_overrides_shared_by_instances(self):
+        first, second = self.Form(), self.Form()
+
+        self.assertIs(first.get_overrides(), second.get_overrides())
+        self.assertEqual(first.make_overrides(), first.get_overrides())
+
+    def test_hidden_fields_in_last_row(self):
+        form = import_string('classwork.forms.RegisterForm')(class_choices=ClassOffer.objects.none())
+        html = {'as_table': '</td></tr>', 'as_ul': '</li>', 'as_p': '</p>'}
+        html = {ender: str(getattr(form, name)()) for name, ender in html.items()}
+        hidden = str(form['country_display'])
+
+        for ender, output in html.items():
+            self.assertTrue(output.endswith(hidden + ender))
+            self.assertEqual(1, output.count(hidden))
+
+
+class UniqueLookupFormTests(TestCase):
+    Form = import_string('users.forms.CustomRegistrationForm')
+    RegisterForm = import_string('classwork.forms.RegisterForm')
+    signup = {'first_name': 'New', 'last_name': 'Person', 'email': 'new@site.com',
+              'password1': 'Xy7!pass-word', 'password2': 'Xy7!pass-word'}
+    register = {'new_user': 'F', 'first_name': 'Taken', 'last_name': 'User', 'email': 'taken@site.com',
+                'billing_address_1': '1 Main St', 'billing_city': 'Seattle', 'billing_country_area': 'WA',
+                'billing_postcode': '98101', 'billing_country_code': 'US'}
+
+    def setUp(self):
+        kwargs = {'email': 'taken@site.com', 'password': 'test12', 'first_name': 'Taken', 'last_name': 'User'}
+        self.user = UserHC.objects.create_user(**kwargs)
+
+    def test_signup_checks_in_one_query(self):
+        form = self.Form(data=QueryDict(urlencode(self.signup)))
+        with self.assertNumQueries(1):
+            valid = form.is_valid()
+
+        self.assertTrue(valid)
+        self.assertEqual('new@site.com', form.cleaned_data['username'])
+
+    def test_signup_shared_email_one_query(self):
+        form = self.Form(data=QueryDict(urlencode(dict(self.signup, email='TAKEN@site.com'))))
+        with self.assertNumQueries(1):
+            valid = form.is_valid()
+
+        self.assertFalse(valid)
+        self.assertIn('email', form.errors)
+
+    def test_register_checks_in_one_query(self):
+        form = self.RegisterForm(data=QueryDict(urlencode(self.register)), initial={'user': AnonymousUser()},
+                                 class_choices=ClassOffer.objects.none())
+        with self.assertNumQueries(1):
+            valid = form.is_valid()
+
+        self.assertFalse(valid)
+        self.assertIn('email', form.errors)
+
+    def test_register_skips_checks_for_bound_user(self):
+        form = self.RegisterForm(data=QueryDict(urlencode(self.register)), initial={'user': self.user},
+                                 class_choices=ClassOffer.objects.none())
+        with CaptureQueriesContext(connection) as context:
+            form.is_valid()
+
+        self.assertNotIn('email', form.errors)
+        self.assertFalse(any('username_folded" IN' in ea['sql'] for ea in context.captured_queries))
@@ -1,14 +1,17 @@
-from django.test import TestCase, Client
+from django.test import TestCase, Client, RequestFactory
 from unittest import skip
 from django.apps import apps
 from django.conf import settings
 from os import environ
 from django.contrib.admin.sites import AdminSite
+from django.contrib.admin.templatetags.admin_list import results
 from django.contrib.admin.models import LogEntry
 from django.contrib.auth.models import Permission
 from django.contrib.auth.forms import UserChangeForm  # , UserCreationForm
 from django.contrib.sessions.models import Session as Session_contrib
 from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 # from django.forms import ValidationError
 from datetime import date, time, timedelta
 from copy import deepcopy
@@ -20,6 +23,7 @@ ClassOfferAdmin = import_string('classwork.admin.ClassOfferAdmin')
 SessiontAdmin = import_string('classwork.admin.SessiontAdmin')
 ClassDayListFilter = import_string('classwork.admin.ClassDayListFilter')
 RegistrationAdmin = import_string('classwork.admin.RegistrationAdmin')
+StudentAdmin = import_string('classwork.admin.StudentAdmin')
 main_admin = import_string('classwork.admin.admin')
 CustomUserAdmin = import_string('users.admin.CustomUserAdmin')
 StaffUserAdmin = import_string('users.admin.StaffUserAdmin')
@@ -30,6 +34,7 @@ Session = import_string('classwork.models.Session')
 Subject = import_string('classwork.models.Subject')
 ClassOffer = import_string('classwork.models.ClassOffer')
 Registration = import_string('classwork.models.Registration')
+Student = import_string('classwork.models.Student')
 User = import_string('users.models.UserHC')
 StaffUser = import_string('users.models.StaffUser')
 StudentUser = import_string('users.models.StudentUser')
@@ -260,6 +265,77 @@ class AdminSessionModelManagement(TestCase):
         pass
 
 
+class AdminStudentTests(TestCase):
+    """The Student changelist computes the level progress columns in a fixed number of queries. """
+
+    def setUp(self):
+        versions = [key for key, string in Subject.VERSION_CHOICES if key != 'N']
+        session = Session.objects.create(name='sess1', key_day_date=date(2020, 1, 9))
+        kwargs = {'session': session, 'start_time': time(19, 0)}
+        self.classoffers = {}
+        for level, string in Subject.LEVEL_CHOICES[:3]:
+            subjs = [Subject.objects.create(level=level, version=ver, name=f"{level}_{ver}") for ver in versions]
+            self.classoffers[level] = [ClassOffer.objects.create(subject=subj, **kwargs) for subj in subjs]
+        self.count = 0
+
+    def make_students(self, count):
+        beg, l2, l3 = (level for level, string in Subject.LEVEL_CHOICES[:3])
+        histories = ([], self.classoffers[beg][:1], self.classoffers[beg] + self.classoffers[l2][:2],
+                     self.classoffers[beg] + self.classoffers[l2] + self.classoffers[l3], )
+        for num in range(self.count, self.count + count):
+            kwargs = {'email': f"student_{num}@fakesite.com", 'password': '1234', 'first_name': 'fa', 'last_name': 'f'}
+            user = User.objects.create_user(is_student=True, **kwargs)
+            user.student.taken.add(*histories[num % len(histories)])
+        self.count += count
+
+    def render_changelist(self):
+        """Returns the number of queries and the rendered rows for the first page of the Student changelist. """
+        current_admin = StudentAdmin(model=Student, admin_site=AdminSite())
+        changelist_request = RequestFactory().get('/')
+        changelist_request.user = request.user
+        with CaptureQueriesContext(connection) as context:
+            cl = current_admin.get_changelist_instance(changelist_request)
+            cl.formset = None
+            rows = [list(row) for row in results(cl)]
+        return len(context.captured_queries), rows
+
+    def test_changelist_columns_match_student_properties(self):
+        self.make_students(4)
+        current_admin = StudentAdmin(model=Student, admin_site=AdminSite())
+        qs = current_admin.get_queryset(request)
+
+        for obj in qs:
+            student = Student.objects.get(pk=obj.pk)
+            expected_subjects = list(student.highest_subject['subjects'].order_by('pk')) or ['Unknown']
+            self.assertEqual(current_admin.max_subject(obj), expected_subjects)
+            self.assertEqual(current_admin.max_level(obj), student.highest_subject['level_num__max'])
+            self.assertEqual(current_admin.beg_done(obj), student.beg['done'])
+            self.assertEqual(current_admin.l2_done(obj), student.l2['done'])
+            self.assertEqual(current_admin.l3_done(obj), student.l3['done'])
+
+    def test_changelist_query_count_does_not_grow_with_rows(self):
+        self.make_students(4)
+        few_queries, few_rows = self.render_changelist()
+        self.make_students(16)
+        many_queries, many_rows = self.render_changelist()
+
+        self.assertEqual(len(few_rows), 4)
+        self.assertEqual(len(many_rows), 20)
+        self.assertEqual(few_queries, many_queries)
+        self.assertEqual(many_queries, 5)
+
+    def test_progress_columns_are_sortable(self):
+        self.make_students(4)
+        current_admin = StudentAdmin(model=Student, admin_site=AdminSite())
+        qs = current_admin.get_queryset(request)
+        columns = ('max_subject', 'max_level', 'beg_done', 'l2_done', 'l3_done', )
+
+        for name in columns:
+            order_field = getattr(getattr(current_admin, name), 'admin_order_field', None)
+            self.assertIsNotNone(order_field)
+            self.assertEqual(len(qs.order_by(order_field)), 4)
+
+
 class AdminClassOfferTests(TestCase):
 
     def test_admin_uses_correct_admin(self):
@@ -12,7 +12,8 @@ Session = import_string('classwork.models.Session')
 Subject = import_string('classwork.models.Subject')
 ClassOffer = import_string('classwork.models.ClassOffer')
 Resource = import_string('classwork.models.Resource')
-# , Location, SiteContent, Profile, Payment, Registration, Notify
+Location = import_string('classwork.models.Location')
+# , SiteContent, Profile, Payment, Registration, Notify
 UserHC = import_string('users.models.UserHC')
 AnonymousUser = import_string('django.contrib.auth.models.AnonymousUser')
 USER_DEFAULTS = {'email': 'user_fake@fake.com', 'password': 'test1234', 'first_name': 'f_user', 'last_name': 'fake_y'}
@@ -1,10 +1,15 @@
-from django.test import Client, TestCase  # , TransactionTestCase, RequestFactory,
+from django.test import Client, TestCase, override_settings  # , TransactionTestCase, RequestFactory,
 from django.urls import reverse
+from django.core.cache import cache
+from django.utils.http import http_date
+from calendar import timegm
+from datetime import date, timedelta
 from unittest import skip
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils.module_loading import import_string
-from .helper_views import MimicAsView, Staff, Student, SiteContent, Resource  # , decide_session,
+from .helper_views import MimicAsView, Staff, Student, SiteContent, Resource, Location  # , decide_session,
 from .helper_views import UserHC, AnonymousUser, USER_DEFAULTS, OTHER_USER  # , ClassOffer, Session, Subject,
+schedule_version = import_string('classwork.models.schedule_version')
 # @skip("Not Implemented")
 
 
@@ -142,6 +147,77 @@ class AboutUsListTests(TestCase):
         self.assertEqual(test_text, about.text)
 
 
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SchedulePageCacheTests(TestCase):
+    """Anonymous visits to the public pages are cached until a change to the models shown on them. """
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_page_cached_until_content_change(self):
+        url = reverse('aboutus')
+        initial = self.client.get(url)
+        with self.assertNumQueries(0):
+            cached = self.client.get(url)
+        about = SiteContent.objects.create(name='business_about', text='This is the about text we added. ')
+        later = self.client.get(url)
+
+        self.assertEqual(initial.content, cached.content)
+        self.assertNotContains(initial, about.text)
+        self.assertContains(later, about.text)
+
+    def test_conditional_get_not_modified(self):
+        url = reverse('location_list')
+        initial = self.client.get(url)
+        etag = initial['ETag']
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        Location.objects.create(name='test_location', code='tl', address='12 main st', zipcode=98112, )
+        modified = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(modified.status_code, 200)
+        self.assertNotEqual(modified['ETag'], etag)
+        self.assertContains(modified, 'test_location')
+
+    def test_last_modified_only_for_earlier_days(self):
+        url = reverse('location_list')
+        location = Location.objects.create(name='test_location', code='tl', address='12 main st', zipcode=98112, )
+        today_response = self.client.get(url)
+        earlier = date.today() - timedelta(days=3)
+        Location.objects.filter(pk=location.pk).update(date_modified=earlier)
+        location.save(update_fields=['name'])  # Signals the change, but 'date_modified' is only set when included.
+        earlier_response = self.client.get(url)
+
+        self.assertFalse(today_response.has_header('Last-Modified'))
+        self.assertEqual(earlier_response['Last-Modified'], http_date(timegm(earlier.timetuple())))
+
+    def test_staff_login_keeps_schedule_version(self):
+        """Staff are saved on each login, but only a change to what is shown needs a new schedule version. """
+        kwargs = USER_DEFAULTS.copy()
+        kwargs['is_teacher'] = True
+        user = UserHC.objects.create_user(**kwargs)
+        version = schedule_version()
+        self.client.force_login(user)
+        after_login = schedule_version()
+        user = UserHC.objects.get(pk=user.pk)
+        user.first_name = 'renamed'
+        user.save()
+
+        self.assertEqual(version, after_login)
+        self.assertNotEqual(after_login, schedule_version())
+
+    def test_logged_in_user_page_not_cached(self):
+        user = UserHC.objects.create_user(**OTHER_USER)
+        self.client.force_login(user)
+        url = reverse('location_list')
+        initial = self.client.get(url)
+        later = self.client.get(url)
+
+        self.assertContains(initial, str(user))
+        self.assertContains(later, str(user))
+        self.assertNotEqual(initial['ETag'], self.client_class().get(url)['ETag'])
+
+
 class ProfileViewTests(MimicAsView, TestCase):
     url_name = 'profile_page'
     viewClass = ProfileView = import_string('classwork.views.ProfileView')
@@ -1,6 +1,7 @@
-from django.test import TransactionTestCase, TestCase
-from .helper_views import decide_session, Session
-from datetime import date, timedelta
+from django.test import TransactionTestCase, TestCase, override_settings
+from django.core.cache import cache
+from .helper_views import decide_session, Session, Subject, ClassOffer
+from datetime import date, time, timedelta
 
 
 class NewSiteDecideSession(TestCase):
@@ -18,6 +19,51 @@ class NewSiteDecideSession(TestCase):
             decide_session(**kwargs)
 
 
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DecideSessionCacheTests(TestCase):
+    """The cached Sessions are used until a change to the schedule models. """
+
+    def setUp(self):
+        cache.clear()
+        now = date.today()
+        publish_date, expire_date = now - timedelta(days=7*3), now + timedelta(days=7*1)
+        self.sess = Session.objects.create(name='test', key_day_date=now, publish_date=publish_date,
+                                           expire_date=expire_date)
+
+    def test_cache_hit_has_no_queries(self):
+        expected = list(decide_session())
+        decide_session(sess='test')
+        with self.assertNumQueries(0):
+            result = decide_session()
+        with self.assertNumQueries(0):
+            named = decide_session(sess='test')
+
+        self.assertEqual(expected, list(result))
+        self.assertEqual(expected, list(named))
+
+    def test_session_save_updates_cached_sessions(self):
+        initial = decide_session(sess='test')[0]
+        self.sess.expire_date = self.sess.expire_date + timedelta(days=7)
+        self.sess.save()
+        result = decide_session(sess='test')[0]
+
+        self.assertNotEqual(initial.expire_date, result.expire_date)
+        self.assertEqual(self.sess.expire_date, result.expire_date)
+
+    def test_related_model_changes_update_cached_sessions(self):
+        subj = Subject.objects.create(version='N', name='test_subj')
+        changes = (
+            lambda: ClassOffer.objects.create(subject=subj, session=self.sess, start_time=time(19, 0)),
+            lambda: subj.save(),
+            lambda: ClassOffer.objects.filter(subject=subj).delete(),
+            )
+        for change in changes:
+            decide_session()
+            change()
+            with self.assertNumQueries(1):
+                decide_session()
+
+
 class CurrentSessionSelection(TransactionTestCase):
     """Critical views of current classes and content depend on the decide_session function. """
     fixtures = ['tests/fixtures/db_basic.json', 'tests/fixtures/db_hidden.json']
@@ -1,8 +1,16 @@
-from django.test import TestCase  # , Client, TransactionTestCase, RequestFactory,
-# from django.urls import reverse
-from unittest import skip
+from django.test import TestCase, TransactionTestCase, override_settings  # , Client, RequestFactory,
+from django.core.cache import cache
+from django.urls import reverse
+from django.forms import CheckboxInput
+from django.db import connection
+from django.db.models.query import QuerySet
+from unittest import skip, mock
 from django.utils.module_loading import import_string
-from .helper_views import MimicAsView, decide_session, ClassOffer
+from .helper_views import MimicAsView, decide_session, ClassOffer, UserHC, Session, Location
+from datetime import date, time, timedelta
+from decimal import Decimal
+Payment = import_string('classwork.models.Payment')
+Registration = import_string('classwork.models.Registration')
 # , Session, Subject, Staff, Student, Resource, UserHC, AnonymousUser, USER_DEFAULTS, OTHER_USER,
 # @skip("Not Implemented")
 
@@ -57,6 +65,69 @@ class ClassOfferListViewTests(MimicAsView, TestCase):
         self.assertDictContainsSubset(display_date_subset, actual)
 
 
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ClassOfferListViewCacheTests(MimicAsView, TestCase):
+    url_name = 'classoffer_list'
+    viewClass = ClassOfferListView = import_string('classwork.views.ClassOfferListView')
+
+    def setUp(self):
+        cache.clear()
+        self.classoffers = self.setup_three_sessions()
+
+    def get_classoffers(self):
+        view = self.setup_view('get')
+        return list(view.get_queryset())
+
+    def test_warm_cache_hit_has_no_queries(self):
+        url = reverse(self.url_name)
+        expected = self.classoffers['curr_sess']
+        initial = self.client.get(url)
+        with self.assertNumQueries(0):
+            view_queryset = list(self.setup_view('get').get_queryset())
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+
+        self.assertEqual(initial.content, response.content)
+        self.assertSetEqual(set(expected), set(view_queryset))
+        self.assertIsInstance(self.setup_view('get').get_queryset(), list)
+        for classoffer in expected:
+            self.assertContains(response, classoffer.subject.name)
+
+    def test_conditional_get_and_page_cache_updated_by_changes(self):
+        url = reverse(self.url_name)
+        initial = self.client.get(url)
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=initial['ETag'])
+        classoffer = self.classoffers['curr_sess'][0]
+        classoffer.subject.name = 'renamed_subject'
+        classoffer.subject.save()
+        modified = self.client.get(url, HTTP_IF_NONE_MATCH=initial['ETag'])
+
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(modified.status_code, 200)
+        self.assertNotContains(initial, 'renamed_subject')
+        self.assertContains(modified, 'renamed_subject')
+
+    def test_classoffer_change_updates_cached_list(self):
+        initial = self.get_classoffers()
+        classoffer = self.classoffers['curr_sess'][0]
+        classoffer.start_time = time(20, 0)
+        classoffer.save()
+        result = self.get_classoffers()
+        changed = next(ea for ea in result if ea.pk == classoffer.pk)
+
+        self.assertEqual(len(initial), len(result))
+        self.assertEqual(changed.start_time, time(20, 0))
+
+    def test_new_classoffer_included_in_cached_list(self):
+        initial = self.get_classoffers()
+        co_kwargs = {'session': self.classoffers['curr_sess'][0].session, 'start_time': time(19, 0), 'class_day': 1}
+        added = ClassOffer.objects.create(subject=self.classoffers['curr_sess'][0].subject, **co_kwargs)
+        result = self.get_classoffers()
+
+        self.assertNotIn(added, initial)
+        self.assertIn(added, result)
+
+
 class CheckinListViewTests(MimicAsView, TestCase):
     """Using MimicAsView, with three sessions and the viewClass created with a GET request. """
     url_name = 'checkin'
@@ -121,6 +192,77 @@ class CheckinListViewTests(MimicAsView, TestCase):
         self.test_get_context_data(display_session=display_session, display_date=display_date)
 
 
+class CheckinRosterTests(MimicAsView, TestCase):
+    """The Checkin roster and class totals are computed in two queries, and match the Registration properties. """
+    url_name = 'checkin'
+    viewClass = import_string('classwork.views.Checkin')
+
+    def setUp(self):
+        self.classoffers = self.setup_three_sessions()
+        self.view = self.setup_view('get')
+
+    def make_registrations(self, classoffer, count=4):
+        """Registers students with no payment, a partial payment, a full payment, and each with some credit. """
+        registrations = []
+        for num in range(count):
+            email = f"roster_{classoffer.pk}_{num}@fakesite.com"
+            kwargs = {'email': email, 'password': '1234', 'first_name': f"r{num}", 'last_name': 'f'}
+            student = UserHC.objects.create_user(is_student=True, **kwargs).student
+            student.credit = Decimal(num)
+            student.save()
+            payment = None
+            if num:
+                paid = Decimal(0) if num == 1 else Decimal(55)
+                payment = Payment.objects.create(variant='paypal', currency='USD', student=student, paid_by=student,
+                                                 total=Decimal(55), captured_amount=paid, full_price=Decimal(60),
+                                                 multiple_purchase_discount=Decimal(5), credit_applied=Decimal(num))
+            reg = Registration.objects.create(student=student, classoffer=classoffer, payment=payment, paid=num > 2)
+            registrations.append(reg)
+        return registrations
+
+    def test_roster_totals_match_registration_properties(self):
+        classoffer = self.classoffers['curr_sess'][0]
+        registrations = self.make_registrations(classoffer)
+        with self.assertNumQueries(2):
+            classes = list(ClassOffer.objects.filter(session=classoffer.session).order_by('pk').with_roster())
+        found = classes[0]
+        expected_owed = {reg.pk: reg.owed for reg in registrations}
+
+        self.assertEqual(found, classoffer)
+        self.assertEqual(len(registrations), found.headcount)
+        self.assertEqual(sum(reg.paid for reg in registrations), found.paid_count)
+        self.assertEqual(sum(reg.payment.captured_amount for reg in registrations if reg.payment), found.paid_total)
+        self.assertEqual(sum(expected_owed.values()), found.owed_total)
+        self.assertEqual(sum(reg.credit for reg in registrations), found.credit_total)
+        self.assertEqual(registrations, found.roster)
+        self.assertDictEqual(expected_owed, {reg.pk: reg.amount_owed for reg in found.roster})
+        for empty in classes[1:]:
+            self.assertEqual((0, 0, 0, []), (empty.headcount, empty.paid_count, empty.owed_total, empty.roster))
+
+    def test_shared_payment_split_between_classes(self):
+        """A Payment for Registrations in two classes has its paid and owed amounts shared by both totals. """
+        first, second = self.classoffers['curr_sess'][:2]
+        registration = self.make_registrations(first, count=2)[1]
+        Registration.objects.create(student=registration.student, classoffer=second, payment=registration.payment)
+        registration.payment.captured_amount = Decimal(50)
+        registration.payment.save()
+        found = ClassOffer.objects.filter(pk__in=[first.pk, second.pk]).order_by('pk').with_roster()
+
+        self.assertEqual([Decimal(25), Decimal(25)], [co.paid_total for co in found])
+        self.assertEqual(registration.owed / 2, found[0].owed_total)
+        self.assertEqual([found[0].owed_total] * 2, [co.owed_total for co in found])
+
+    def test_roster_queries_do_not_grow_with_students(self):
+        for classoffer in self.classoffers['curr_sess'][:2]:
+            self.make_registrations(classoffer, count=5)
+        self.view.object_list = self.view.get_queryset()
+        with self.assertNumQueries(2):
+            roster = [(co, list(co.roster)) for co in self.view.object_list]
+
+        self.assertEqual([5, 5], [len(regs) for co, regs in roster if regs])
+        self.assertEqual(len(self.classoffers['curr_sess']), len(roster))
+
+
 @skip("Not Implemented Feature")
 class SubjectProgressListViewTests(MimicAsView, TestCase):
     url_name = ''  # None created yet in classwork.urls
@@ -133,4 +275,127 @@ class ClassOfferDetailViewTests(MimicAsView, TestCase):
     viewClass = ClassOfferDetailView = import_string('classwork.views.ClassOfferDetailView')
 
 
+def formset_post_data(formset):
+    """The data submitted for the formset as rendered, with no changes made to any of its rows. """
+    management = formset.management_form
+    data = {management.add_prefix(name): value for name, value in management.initial.items()}
+    for form in formset:
+        for name, field in form.fields.items():
+            value = form[name].value()
+            if field.show_hidden_initial:
+                data[form.add_initial_prefix(name)] = value
+            if value is None or (isinstance(field.widget, CheckboxInput) and not value):
+                continue
+            data[form.add_prefix(name)] = value
+    return data
+
+
+class ClassOfferCreateManyTests(MimicAsView, TransactionTestCase):
+    viewClass = ClassOfferCreateMany = import_string('classwork.bulk_views.ClassOfferCreateMany')
+
+    def setUp(self):
+        self.classoffers = self.setup_three_sessions()
+        location = Location.objects.create(name='test_location', code='tl', address='12 main st', zipcode=98112, )
+        ClassOffer.objects.update(location=location)
+        last = Session.objects.get(name='new_sess')
+        self.session = Session.objects.create(name='next_sess', key_day_date=last.key_day_date + timedelta(weeks=7))
+
+    def test_clone_session(self):
+        """Cloning a Session makes a row for each of its ClassOffers, saved with their dates in the new Session. """
+        source = self.classoffers['curr_sess']
+        view = self.setup_view('get', {'data': {'clone': 'curr_sess'}}, display_session=self.session.name)
+        formset = view.get_form()
+        self.assertEqual(0, formset.initial_form_count())
+        self.assertEqual(len(source), formset.total_form_count())
+        view = self.setup_view('post', {'data': formset_post_data(formset)}, display_session=self.session.name)
+        response = view.post(view.request)
+        self.assertEqual(302, response.status_code)
+        cloned = ClassOffer.objects.filter(session=self.session).select_related('session', 'subject')
+        self.assertEqual(sorted(ea.subject_id for ea in source), sorted(ea.subject_id for ea in cloned))
+        for classoffer in cloned:
+            self.assertEqual(classoffer.compute_dates(), (classoffer.start_date, classoffer.end_date))
+            self.assertEqual(classoffer.set_num_level(), classoffer._num_level)
+
+    def test_clone_page_queries(self):
+        """The rows share the related choices loaded for the page, so it takes the same queries for any number. """
+        view = self.setup_view('get', {'data': {'clone': 'curr_sess'}}, display_session=self.session.name)
+        with self.assertNumQueries(7):
+            response = view.get(view.request)
+            response.render()
+        self.assertEqual(len(self.classoffers['curr_sess']), response.context_data['form'].total_form_count())
+
+    def test_clone_saved_with_bulk_create(self):
+        """Where the database sets the primary keys from bulk_create, the new rows are saved with it. """
+        source = self.classoffers['curr_sess'][0]
+        ClassOffer.objects.filter(session=source.session).exclude(pk=source.pk).delete()
+        view = self.setup_view('get', {'data': {'clone': 'curr_sess'}}, display_session=self.session.name)
+        data = formset_post_data(view.get_form())
+        view = self.setup_view('post', {'data': data}, display_session=self.session.name)
+        with mock.patch.object(connection.features, 'can_return_rows_from_bulk_insert', True), \
+                mock.patch.object(QuerySet, 'bulk_create', autospec=True, side_effect=QuerySet.bulk_create) as bulk:
+            with self.assertNumQueries(10):
+                response = view.post(view.request)
+        self.assertEqual(302, response.status_code)
+        self.assertIn(ClassOffer, [args[0].model for args, kwargs in bulk.call_args_list])
+        classoffer = ClassOffer.objects.get(session=self.session)
+        self.assertEqual(source.subject_id, classoffer.subject_id)
+        self.assertEqual(classoffer.compute_dates(), (classoffer.start_date, classoffer.end_date))
+        self.assertEqual(classoffer.set_num_level(), classoffer._num_level)
+
+    def test_unchanged_rows_not_saved(self):
+        """Submitting a Session's existing ClassOffers unchanged adds nothing and leaves them as they were. """
+        session = Session.objects.get(name='curr_sess')
+        before = list(ClassOffer.objects.filter(session=session).order_by('id').values())
+        view = self.setup_view('get', display_session=session.name)
+        data = formset_post_data(view.get_form())
+        view = self.setup_view('post', {'data': data}, display_session=session.name)
+        response = view.post(view.request)
+        self.assertEqual(302, response.status_code)
+        self.assertEqual(before, list(ClassOffer.objects.filter(session=session).order_by('id').values()))
+
+
+class SessionCreateManyTests(MimicAsView, TransactionTestCase):
+    viewClass = SessionCreateMany = import_string('classwork.bulk_views.SessionCreateMany')
+
+    def test_changed_key_day_updates_classoffers(self):
+        """Changing a Session sets its expire date, its ClassOffer dates, and the following Session publish date. """
+        classoffers = self.setup_three_sessions()
+        session, following = Session.objects.get(name='curr_sess'), Session.objects.get(name='new_sess')
+        view = self.setup_view('get')
+        formset = view.get_form()
+        data = formset_post_data(formset)
+        form = next(form for form in formset if form.instance.pk == session.pk)
+        new_shift = session.max_day_shift + 1
+        data[form.add_prefix('max_day_shift')] = new_shift
+        data[form.add_prefix('expire_date')] = ''
+        view = self.setup_view('post', {'data': data})
+        response = view.post(view.request)
+        self.assertEqual(302, response.status_code)
+        session.refresh_from_db()
+        following.refresh_from_db()
+        self.assertEqual(new_shift, session.max_day_shift)
+        self.assertEqual(session.computed_expire_day(), session.expire_date)
+        self.assertEqual(session.expire_date, following.publish_date)
+        for classoffer in ClassOffer.objects.filter(id__in=[ea.id for ea in classoffers['curr_sess']]):
+            self.assertEqual(classoffer.compute_dates(), (classoffer.start_date, classoffer.end_date))
+
+    def test_clean_changes_saved(self):
+        """Values the Session clean changes are saved, along with the date_modified, not only the changed data. """
+        self.setup_three_sessions()
+        changes = {'skip_weeks': 1, 'flip_last_day': True, 'date_modified': date(2020, 1, 1)}
+        Session.objects.filter(name='curr_sess').update(**changes)
+        session = Session.objects.get(name='curr_sess')
+        view = self.setup_view('get')
+        formset = view.get_form()
+        data = formset_post_data(formset)
+        form = next(form for form in formset if form.instance.pk == session.pk)
+        data[form.add_prefix('skip_weeks')] = 0
+        view = self.setup_view('post', {'data': data})
+        response = view.post(view.request)
+        self.assertEqual(302, response.status_code)
+        session.refresh_from_db()
+        self.assertEqual((0, False), (session.skip_weeks, session.flip_last_day))
+        self.assertEqual(date.today(), session.date_modified)
+
+
 # end test_instruction_views.py
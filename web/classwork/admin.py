@@ -3,8 +3,8 @@ from django.forms import ModelForm, Textarea, ValidationError  # , TextInput,
 from django.utils.translation import gettext_lazy as _
 from django.db import models
 from django.conf import settings
-from .models import (SiteContent, Resource, Subject, Session, ClassOffer,
-                     Staff, Student, Payment, Registration, Location)
+from .models import (SiteContent, Resource, ResourcePublication, Subject, Session, ClassOffer,
+                     Staff, Student, Payment, Registration, Location, EmailOutbox)
 from datetime import timedelta, time, datetime as dt
 from django.contrib.auth import get_user_model
 User = get_user_model()
@@ -194,6 +194,8 @@ class ClassOfferAdmin(admin.ModelAdmin):
     def end_day(self, obj): return date_with_day(obj, field='end_date', short=True, year=True)
     start_day.short_description = 'start'
     end_day.short_description = 'end'
+    start_day.admin_order_field = 'start_date'
+    end_day.admin_order_field = 'end_date'
     # TODO: What if we want to attach an already existing Resource?
 
 
@@ -282,11 +284,24 @@ class StudentAdmin(admin.ModelAdmin):
     inlines = (StudentClassInline, )
     fields = (('user', 'level', 'credit'), 'bio', )
 
-    def max_subject(self, obj): return list(obj.highest_subject.get('subjects', ['Unknown']))
-    def max_level(self, obj): return obj.highest_subject.get('level_num__max', 0)
-    def beg_done(self, obj): return obj.beg.get('done')
-    def l2_done(self, obj): return obj.l2.get('done')
-    def l3_done(self, obj): return obj.l3.get('done')
+    def get_queryset(self, request):
+        """Annotate the level progress in the same query, and prefetch the subjects for the highest level. """
+        taken = models.Prefetch('taken', queryset=ClassOffer.objects.select_related('subject'))
+        return super().get_queryset(request).with_level_data().prefetch_related(taken)
+
+    def max_subject(self, obj):
+        subjects = {ea.subject for ea in obj.taken.all() if ea.subject.level_num == obj.highest_level_num}
+        return sorted(subjects, key=lambda subj: subj.pk) if subjects else ['Unknown']
+
+    def max_level(self, obj): return obj.highest_level_num
+    def beg_done(self, obj): return obj.beg_done
+    def l2_done(self, obj): return obj.l2_done
+    def l3_done(self, obj): return obj.l3_done
+    max_subject.admin_order_field = 'highest_level_num'
+    max_level.admin_order_field = 'highest_level_num'
+    beg_done.admin_order_field = 'beg_done'
+    l2_done.admin_order_field = 'l2_done'
+    l3_done.admin_order_field = 'l3_done'
     beg_done.boolean = True
     l2_done.boolean = True
     l3_done.boolean = True
@@ -306,15 +321,41 @@ class RegistrationAdmin(admin.ModelAdmin):
     # TODO: modify so by default it shows current session filter
 
 
+class ResourcePublicationAdmin(admin.ModelAdmin):
+    """View the precomputed publish dates of Resources for each ClassOffer. These are updated automatically. """
+    model = ResourcePublication
+    list_display = ('resource', 'classoffer', 'user_type', 'publish_date', 'expire_date', )
+    list_select_related = ('resource', 'classoffer__subject', 'classoffer__session', )
+    list_filter = ('classoffer__session', 'user_type', )
+    date_hierarchy = 'publish_date'
+
+    def has_add_permission(self, request): return False
+    def has_change_permission(self, request, obj=None): return False
+
+
+class EmailOutboxAdmin(admin.ModelAdmin):
+    """View the queued, sent, and failed emails. These are sent by the 'send_outbox' management command. """
+    model = EmailOutbox
+    list_display = ('subject', 'to', 'status', 'attempts', 'send_after', 'sent_at', )
+    list_filter = ('status', )
+    search_fields = ('to', 'subject', )
+    date_hierarchy = 'date_added'
+
+    def has_add_permission(self, request): return False
+    def has_change_permission(self, request, obj=None): return False
+
+
 admin.site.site_header = settings.BUSINESS_NAME + ' Admin'
 admin.site.site_title = settings.BUSINESS_NAME + ' Admin'
 admin.site.index_title = 'Admin Home'
 admin.site.register(Resource, ResourceAdmin)
+admin.site.register(ResourcePublication, ResourcePublicationAdmin)
 admin.site.register(Subject, SubjectAdmin)
 admin.site.register(ClassOffer, ClassOfferAdmin)
 admin.site.register(Session, SessiontAdmin)
 admin.site.register(Staff, StaffAdmin)
 admin.site.register(Student, StudentAdmin)
 admin.site.register(Registration, RegistrationAdmin)
+admin.site.register(EmailOutbox, EmailOutboxAdmin)
 # For the following: each model in the tuple for the first parameter will use default admin.
 admin.site.register((SiteContent, Payment, Location))
@@ -0,0 +1,163 @@
+from django.views.generic.edit import FormMixin, ProcessFormView
+from django.views.generic.list import MultipleObjectMixin, MultipleObjectTemplateResponseMixin
+from django.core.exceptions import ImproperlyConfigured
+from django.http import Http404, HttpResponseRedirect
+from django.utils.functional import cached_property
+from datetime import date
+from users.multiform import multimodelformset_factory
+from .forms import BulkRowForm, BulkFormSet, SessionFormSet, ClassOfferFormSet, ResourceFormSet, prefetched_formfield
+from .models import Session, ClassOffer, Resource
+from .views import ViewOnlyForTeacherOrAdminMixin
+
+
+class CreateMany(
+        ViewOnlyForTeacherOrAdminMixin,
+        MultipleObjectTemplateResponseMixin,
+        FormMixin,
+        MultipleObjectMixin,
+        ProcessFormView
+        ):
+    """Sometimes we want to allow the creation of many records/objects.
+        Sometimes we will want to edit mulitiple records/objects.
+        Sometimes we will want to update or create if they do not exist.
+        This is going to be a lot like the default Django UpdateView,
+        but will use MultipleObject instead of SingleObject versions of mixins
+
+        CreateView Process we will mimic:
+        SingleObjectTemplateResponseMixin => MultipleObjectTemplateResponseMixin
+            TemplateResponseMixin
+        BaseCreateView:
+            ModelFormMixin
+                FormMixin
+                    ContextMixin
+                SingleObjectMixin => MultipleObjectMixin
+                    ContextMixin
+            ProcessFormView
+                View
+
+        The form is a formset with a row for each object of the queryset, and extra rows for new objects, or for
+        each of the 'initial' dicts if given. The rows are saved together by the 'formset_class', which does the
+        work of the model save methods once for all of them after the transaction is committed.
+    """
+    required_group = ('admin', )
+    template_name = 'classwork/create_many.html'
+    object_list = None  # MultipleObjectMixin looks for this
+    fields = None  # Matches ModelForm Mixin
+    formset_class = BulkFormSet
+    extra = 3
+    can_delete = False
+
+    def get_form_class(self):  # Matches ModelForm Mixin
+        """Return the formset class to use in this view."""
+        if self.fields is not None and self.form_class:
+            raise ImproperlyConfigured(
+                "Specifying both 'fields' and 'form_class' is not permitted."
+            )
+        if self.form_class:
+            return self.form_class
+        if self.fields is None:
+            raise ImproperlyConfigured(
+                "Using CreateMany (base class of %s) without "
+                "the 'fields' attribute is prohibited." % self.__class__.__name__
+            )
+        model = self.model if self.model is not None else self.get_queryset().model
+        return multimodelformset_factory(
+            [model], form=BulkRowForm, formset=self.formset_class, fields=self.fields,
+            extra=len(self.get_initial()) or self.extra, can_delete=self.can_delete,
+            formfield_callback=prefetched_formfield,
+            )
+
+    def get_initial(self):
+        """Return a list of the initial data for each of the extra forms. """
+        if not hasattr(self, '_initial'):
+            self._initial = list(self.initial or ())
+        return self._initial
+
+    def get_form_kwargs(self):
+        """The formset has a form for each object in the queryset. """
+        kwargs = super().get_form_kwargs()
+        if self.object_list is None:
+            self.object_list = self.get_queryset()
+        kwargs['queryset'] = self.object_list
+        return kwargs
+
+    def get_context_data(self, **kwargs):
+        kwargs.setdefault('title', self.get_queryset().model._meta.verbose_name_plural.title())
+        return super().get_context_data(**kwargs)
+
+    def get_success_url(self):
+        """Return the URL to redirect to after processing a valid form."""
+        return str(self.success_url) if self.success_url else self.request.path
+
+    def form_valid(self, form):
+        """If the formset is valid, save all of the changed and new objects."""
+        self.object_list = form.save()
+        return HttpResponseRedirect(self.get_success_url())
+
+    def form_invalid(self, form):
+        self.object_list = form.queryset
+        return super().form_invalid(form)
+
+    #  end class CreateMany
+
+
+class SessionCreateMany(CreateMany):
+    """Create and edit the Sessions that have not yet expired. """
+    model = Session
+    formset_class = SessionFormSet
+    fields = ('name', 'key_day_date', 'max_day_shift', 'num_weeks', 'skip_weeks', 'flip_last_day', 'break_weeks',
+              'publish_date', 'expire_date', )
+
+    def get_queryset(self):
+        return Session.objects.filter(expire_date__gte=date.today()).order_by('key_day_date')
+
+
+class ClassOfferCreateMany(CreateMany):
+    """Create and edit the ClassOffers of a Session. With a 'clone' query parameter naming another Session, there is
+        a new row for each of its ClassOffers, already filled in to be the same class in this Session.
+        The teachers are not copied, as they are often different each Session.
+    """
+    model = ClassOffer
+    formset_class = ClassOfferFormSet
+    fields = ('subject', 'session', 'location', 'class_day', 'start_time', 'skip_weeks', 'skip_tagline',
+              'manager_approved', )
+    can_delete = True
+
+    def get_session(self, name):
+        session = Session.objects.filter(name=name).order_by('-key_day_date').first()
+        if session is None:
+            raise Http404(f"There is no {name} Session. ")
+        return session
+
+    @cached_property
+    def session(self):
+        return self.get_session(self.kwargs['display_session'])
+
+    def get_queryset(self):
+        return ClassOffer.objects.filter(session=self.session).order_by('_num_level', 'class_day', 'start_time')
+
+    def get_initial(self):
+        """Each ClassOffer of the 'clone' Session, if given, as the initial values for a new one in this Session. """
+        if not hasattr(self, '_initial'):
+            clone = self.request.GET.get('clone')
+            self._initial = []
+            if clone:
+                clone_fields = [name for name in self.fields if name != 'session']
+                classoffers = ClassOffer.objects.filter(session=self.get_session(clone))
+                classoffers = classoffers.order_by('_num_level', 'class_day', 'start_time').values(*clone_fields)
+                self._initial = [dict(ea, session=self.session.pk) for ea in classoffers]
+        return self._initial
+
+    def get_context_data(self, **kwargs):
+        kwargs.setdefault('title', f"{self.session} Classes")
+        return super().get_context_data(**kwargs)
+
+
+class ResourceCreateMany(CreateMany):
+    """Create Resources, and edit those not yet connected to any Subject or ClassOffer. """
+    model = Resource
+    formset_class = ResourceFormSet
+    fields = ('name', 'content_type', 'user_type', 'avail', 'expire', 'link', 'text', 'description', )
+
+    def get_queryset(self):
+        return Resource.objects.filter(subjects__isnull=True, classoffers__isnull=True).order_by('name')
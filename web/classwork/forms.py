@@ -1,15 +1,22 @@
 from django import forms
+from django.db import transaction
 from django.core.exceptions import ValidationError  # NON_FIELD_ERRORS,
 from django.contrib.auth import get_user_model
+from django.db.models import ForeignKey
 from django.forms.fields import FileField  # Field,
 from django.utils.translation import gettext_lazy as _
 from django_countries.widgets import CountrySelectWidget
-from .models import Student, Payment, Registration, Notify  # , Staff, Session, ClassOffer
+from .models import Student, Payment, Registration, Notify, Session, ClassOffer  # , Staff
+from .models import ResourcePublication, bump_schedule_version
 from users.mixins import FocusMixIn, AddressUsernameMixIn  # AddressMixIn,
+from users.multiform import BaseMultiModelFormSet
+from .logs import log_event
+import logging
 # from django.urls import reverse_lazy
 # from django.shortcuts import render
 # TODO: should we be using datetime.datetime or datetime.today ?
 User = get_user_model()
+logger = logging.getLogger(__name__)
 
 
 class RegisterForm(AddressUsernameMixIn, forms.ModelForm):
@@ -54,26 +61,21 @@ class RegisterForm(AddressUsernameMixIn, forms.ModelForm):
     field_order = [*new_fields, *Meta.fields]
 
     def __init__(self, *args, **kwargs):
-        print("======================= classwork.RegisterForm.__init__ =================================")
         class_choices = kwargs.pop('class_choices', None)
         self.base_fields['class_selected'].queryset = class_choices
         super(RegisterForm, self).__init__(*args, **kwargs)
-        print("--------------------- FINISH RegisterForm.__init__ --------------------")
 
     def clean_first_name(self):
-        print('======== RegisterForm.clean_first_name =========')
         first_name = self.cleaned_data.get('first_name')
         return first_name.capitalize()
 
     def clean_last_name(self):
-        print('======== RegisterForm.clean_last_name =========')
         value = self.cleaned_data.get('last_name')
         if value.isupper() or value.islower():  # Some names have mid-capitols, so assume mixed capitals are intended.
             return value.capitalize()  # Assume unintended if it was all caps, or all lowercase.
         return value
 
     def clean_email(self):
-        print('======== RegisterForm.clean_email =========')
         email = self.cleaned_data.get('email')
         # We are using casefold() to lowercase, which may technically be incorrect for the user's email system.
         return email.casefold()
@@ -81,7 +83,6 @@ class RegisterForm(AddressUsernameMixIn, forms.ModelForm):
     def _clean_fields(self):
         # print('======== RegisterForm._clean_fields =========')
         # super()._clean_fields()
-        print('======== Duplicate code as normal: RegisterForm._clean_fields =========')
         for name, field in self.fields.items():
             # The widget.value_from_datadict() can handle if it's data is split across several fields in self.data.
             if field.disabled:
@@ -101,12 +102,7 @@ class RegisterForm(AddressUsernameMixIn, forms.ModelForm):
             except ValidationError as e:
                 self.add_error(name, e)
 
-    def _clean_form(self):
-        print('======== RegisterForm._clean_form =========****************')
-        super()._clean_form()
-
     def full_clean(self):
-        print('======== RegisterForm.full_clean =========*****************')
         # Cleaning data is done by:
         # 1) _clean_fields(): for each self.fields, calls field.clean() which will populate cleaned_data, in 3 stages:
         #     a) to_python() to coerce datatype or raise ValidationError if impossible
@@ -114,7 +110,10 @@ class RegisterForm(AddressUsernameMixIn, forms.ModelForm):
         #     c) run_validators() runs all validators and aggregates into single ValidationError
         # 2) clean_<fieldname>() Takes no params, must return the cleaned value even if unchanged
         # 3) Form.clean() where we can deal with cross-field validations.
-        super().full_clean()
+        with log_event(logger, 'register_clean', user=getattr(self.initial.get('user'), 'pk', None)) as fields:
+            super().full_clean()
+            student = getattr(self, 'cleaned_data', {}).get('student')
+            fields.update(valid=not self._errors, student=getattr(student, 'pk', None))
 
     def create_form_user(self, **kwargs):
         """New user accounts can be created when submitting this form. """
@@ -124,13 +123,11 @@ class RegisterForm(AddressUsernameMixIn, forms.ModelForm):
         return user
 
     def clean(self):
-        print('======== RegisterForm.clean =========********************')
         cleaned_data = super().clean()
         input_email = cleaned_data.get('email')
         first_name = cleaned_data.get('first_name')
         last_name = cleaned_data.get('last_name')
         new_user = cleaned_data.get('new_user') == 'T'
-        print(f'new user: {new_user}')
         billing_info = {
             'billing_address_1': cleaned_data['billing_address_1'],
             'billing_address_2': cleaned_data['billing_address_2'],
@@ -150,23 +147,17 @@ class RegisterForm(AddressUsernameMixIn, forms.ModelForm):
             if username_expected and username:
                 data_new_user.update(username=username, username_not_email=True,)
                 user = self.create_form_user(**data_new_user)
+        match = None  # The Users that may match the given email and name, found in one query when needed.
         if user.is_anonymous and new_user:  # They say they are new, but check to avoid collisions
-            # Look by email
-            same_email = User.objects.filter(email__iexact=input_email)
-            if same_email.count():  # TODO: Change to .exists()
-                found = same_email.filter(first_name__iexact=first_name, last_name__iexact=last_name).count()  # TODO: Change to .exists()
-                if found:
-                    message = "We found a user account with your name and email. "
-                    message += "Try the login link, or resubmit the form and select you are a returning student. "
-                    raise forms.ValidationError(_(message))
-                    # If user was found, then we should have them login
-                    # TODO: send user to login credentials, keep track of data they have given
+            match = User.objects.match_identity(email=input_email, first_name=first_name, last_name=last_name)
+            if match.exact:
+                message = "We found a user account with your name and email. "
+                message += "Try the login link, or resubmit the form and select you are a returning student. "
+                raise forms.ValidationError(_(message))
+                # If user was found, then we should have them login
+                # TODO: send user to login credentials, keep track of data they have given
                 # TODO: Create a system to deal with matches
-                # TODO: Either pass above queries to that function, or use .count() above.
-            # Look by name
-            same_name = User.objects.filter(first_name__iexact=first_name, last_name__iexact=last_name)
-            if same_name.count():  # TODO: Change to .exists()
-                print('We found user(s) with that same name')
+            if match.same_name:
                 message = "Are you sure you have not had classes with us? "
                 message += "We have someone with that name already in our records. "
                 message += "If this is you, either login or select you are a returning student. "
@@ -177,31 +168,24 @@ class RegisterForm(AddressUsernameMixIn, forms.ModelForm):
             # We can create this user
             user = self.create_form_user(**data_new_user)
         elif user.is_anonymous:  # new_user is False; User says they have an account, we should use that account.
-            print('User says they are returning. They should login!')
-            query_user = User.objects.filter(
-                email__iexact=input_email,
-                first_name__iexact=first_name,
-                last_name__iexact=last_name,
-                )
-            user_count = query_user.count()
+            match = User.objects.match_identity(email=input_email, first_name=first_name, last_name=last_name)
+            user_count = len(match.exact)
             if user_count > 1:
-                print('MULTIPLE users with that email & name. We are using the first one.')
+                logger.info("RegisterForm: %d users with the same email & name, using the first. ", user_count)
             # TODO: Create Logic when more than one user has the same email, for now using first match.
-            user = query_user.first() if user_count > 0 else None  # TODO: refactor to use get_one_or_none ?
+            user = match.exact[0] if user_count > 0 else None
             # TODO: Anyone is allowed to add a user to classoffers (but no address update). Should login be required?
             if not user:
                 message = "We did not find your user account with your name and email address. "
                 message += "Try the login link. "
                 message += "If that does not work, select that you are a new student and we can fix it later. "
                 raise forms.ValidationError(_(message))
-            # user = User.objects.find_or_create_for_anon(email=input_email, first_name=first_name, last_name=last_name)
             # TODO: What if a non-user is paying for a friend (established or new user)
         else:  # Existing users can update their billing address if they are logged in.
             for key, value in billing_info.items():
                 if value:
                     setattr(user, key, value)
             user.save()
-        print(f'user before paid_by_other check {user}')
         if cleaned_data.get('paid_by_other'):
             # We need to now get the billing info for user who is paying
             # Assign the logged in user name & email to paid_by
@@ -217,66 +201,76 @@ class RegisterForm(AddressUsernameMixIn, forms.ModelForm):
             #   -  maybe email is friend user that needs to be created
 
             # if email does not match paid_by.email then we know the other user
-            possible_friends = User.objects.filter(email__iexact=input_email).exclude(id=user.id)
-            num_friends = possible_friends.count()
+            match = match or User.objects.match_identity(email=input_email, first_name=first_name, last_name=last_name)
+            possible_friends = [ea for ea in match.same_email if ea.pk != user.pk]
+            num_friends = len(possible_friends)
             username_not_email = True if user.email == input_email or num_friends > 1 else False
-            friend = possible_friends.first() if num_friends == 1 else None
+            friend = possible_friends[0] if num_friends == 1 else None
             if not friend:  # could be none in list, could have matching emails, could be many to choose from
-                friend = User.objects.find_or_create_by_name(
+                friend = match.find(possible_friends) or User.objects.create_user(
                     first_name=first_name,
                     last_name=last_name,
                     email=input_email,
                     username_not_email=username_not_email,
                     is_student=True,
-                    possible_users=possible_friends,
                     )
                 # if that user needed to be created, a decorator will create the profile
-            else:
-                print('friend found without using find_or_create_by_name')
             user = friend
-        print(f'user as used for student profile {user}')
         cleaned_data['student'] = Student.objects.get(user=user)  # TODO: ? instead use user.student
-        print(f"student profile: {cleaned_data['student']}")
-        print(f"class selected: {cleaned_data['class_selected']}")
+        logger.debug("RegisterForm student %s for classes: %s",
+                     cleaned_data['student'], cleaned_data.get('class_selected'))
         return cleaned_data
 
     def save(self, commit=True):
-        print('======== Inside RegisterForm.save ===========')
-        class_selected = self.cleaned_data.get('class_selected')
+        """Creates the Payment and Registrations, and queues the confirmation email, all in one transaction.
+            Classes the student already has a Registration with a Payment for are skipped, paid or not, so a repeated
+            submission does not register the student again, and returns the Payment already made for it.
+        """
+        class_selected = list(self.cleaned_data.get('class_selected'))
         student = self.cleaned_data.get('student')  # Profile for the User taking the ClassOffer
-        paid_by = self.cleaned_data.get('paid_by')  # Profile for the User paying for the ClassOffer
-        # TODO: Send confirmation email here? Or maybe do so with a decorator after save?
-        email = Notify.register(selected=class_selected, student=student, paid_by=paid_by)
-        if email:
-            print(f"Email was sent for register of {student} paid by {paid_by}")
-        else:
-            print(f"Email ERROR for registering {student}")
-        billing_info = {
-            'billing_address_1': self.cleaned_data['billing_address_1'],
-            'billing_address_2': self.cleaned_data['billing_address_2'],
-            'billing_city': self.cleaned_data['billing_city'],
-            'billing_country_area': self.cleaned_data['billing_country_area'],
-            'billing_postcode': self.cleaned_data['billing_postcode'],
-            }
-        if 'billing_country_code' in self.cleaned_data:
-            billing_info['billing_country_code'] = self.cleaned_data['billing_country_code']
-        # Create payment for all, then a Registration for each class they selected.
-        payment = Payment.objects.classRegister(
-            register=class_selected,
-            student=student,
-            paid_by=paid_by,
-            **billing_info
-            )
-        # We can not use objects.bulk_create due to Many-to-Many relationships
-        for each in class_selected:
-            print(each)
-            Registration.objects.create(
+        student_id, classes = getattr(student, 'pk', None), len(class_selected)
+        with log_event(logger, 'register_save', student=student_id, classes=classes) as fields, transaction.atomic():
+            # Lock the student, so a double-submitted form waits here until the first one is committed.
+            list(Student.objects.select_for_update().filter(pk=student_id).values_list('pk', flat=True))
+            registered = Registration.objects.filter(student=student, classoffer__in=class_selected)
+            registered = dict(registered.values_list('classoffer_id', 'payment_id'))
+            # Skip those with a Payment, even if not yet paid, since that is what a repeated submission made.
+            class_selected = [ea for ea in class_selected if not registered.get(ea.pk)]
+            if not class_selected:
+                fields['duplicate'] = True
+                logger.info("RegisterForm: student %s is already registered for the selected classes", student_id)
+                return Payment.objects.filter(pk__in=registered.values()).latest('pk')
+            paid_by = self.cleaned_data.get('paid_by')  # Profile for the User paying for the ClassOffer
+            billing_info = {
+                'billing_address_1': self.cleaned_data['billing_address_1'],
+                'billing_address_2': self.cleaned_data['billing_address_2'],
+                'billing_city': self.cleaned_data['billing_city'],
+                'billing_country_area': self.cleaned_data['billing_country_area'],
+                'billing_postcode': self.cleaned_data['billing_postcode'],
+                }
+            if 'billing_country_code' in self.cleaned_data:
+                billing_info['billing_country_code'] = self.cleaned_data['billing_country_code']
+            # Create payment for all, then a Registration for each class they selected.
+            payment = Payment.objects.classRegister(
+                register=class_selected,
                 student=student,
-                classoffer=each,
-                payment=payment
+                paid_by=paid_by,
+                **billing_info
                 )
-            print('-+-+-+-+-+-+-+-+-+-+-+-+-+-+-+-')
-        return payment
+            fields['payment'] = payment.pk
+            # Registrations from before, without a Payment, are given this one. The unique constraint on student and
+            # classoffer rolls back this transaction if a concurrent request registered them first.
+            unpaid = [ea.pk for ea in class_selected if ea.pk in registered]
+            Registration.objects.filter(student=student, classoffer__in=unpaid).update(payment=payment)
+            new_registrations = [Registration(student=student, classoffer=ea, payment=payment)
+                                 for ea in class_selected if ea.pk not in registered]
+            Registration.objects.bulk_create(new_registrations)
+            # The email is queued with the Payment, and sent by the 'send_outbox' management command.
+            email = Notify.register(selected=class_selected, student=student, paid_by=paid_by)
+            fields['email_queued'] = bool(email)
+            if not email:
+                logger.warning("RegisterForm: registration email not queued for student %s", student_id)
+            return payment
 
 
 class PaymentForm(FocusMixIn, forms.ModelForm):
@@ -293,3 +287,144 @@ class PaymentForm(FocusMixIn, forms.ModelForm):
             'billing_country_area',
             'billing_postcode',
             ]
+
+
+class PrefetchedModelChoiceField(forms.ModelChoiceField):
+    """Once given the objects loaded for all the forms of a formset, uses them for the choices and the selected object.
+        Otherwise, each form would query for its choices when rendered, and for the selected object when cleaned.
+    """
+    objects = None
+
+    def load_objects(self):
+        """Returns a dict of the queryset objects by their form value, and the choices for them, from one query. """
+        objects = list(self.queryset)
+        choices = [("", self.empty_label)] if self.empty_label is not None else []
+        choices.extend((self.prepare_value(obj), self.label_from_instance(obj)) for obj in objects)
+        return {str(self.prepare_value(obj)): obj for obj in objects}, choices
+
+    def set_objects(self, objects, choices):
+        self.objects = objects
+        self.choices = choices
+
+    def to_python(self, value):
+        if self.objects is None or value in self.empty_values or isinstance(value, self.queryset.model):
+            return super().to_python(value)
+        try:
+            return self.objects[str(value)]
+        except KeyError:
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+
+
+def prefetched_formfield(db_field, **kwargs):
+    """The formfield_callback for bulk entry forms, using a PrefetchedModelChoiceField for each ForeignKey. """
+    if isinstance(db_field, ForeignKey):
+        kwargs.setdefault('form_class', PrefetchedModelChoiceField)
+    return db_field.formfield(**kwargs)
+
+
+class BulkRowForm(forms.ModelForm):
+    """A row of a BulkFormSet. New rows given initial values, such as copies of existing records, are to be saved.
+        The selected related objects are among those already loaded, so the model does not query for each again.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.given_initial = bool(kwargs.get('initial'))
+        super().__init__(*args, **kwargs)
+
+    def has_changed(self):
+        return super().has_changed() or (self.instance._state.adding and self.given_initial)
+
+    def _get_validation_exclusions(self):
+        exclude = super()._get_validation_exclusions()
+        prefetched = [name for name, field in self.fields.items()
+                      if getattr(field, 'objects', None) is not None and name not in exclude]
+        return [*exclude, *prefetched]
+
+
+class BulkFormSet(BaseMultiModelFormSet):
+    """Rows of a bulk entry page, with the related field choices loaded once for all of the forms.
+        The rows are saved in bulk, and once committed, after_commit updates the values that depend on them.
+    """
+    bulk_save = True
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        for name, field in form.fields.items():
+            if isinstance(field, PrefetchedModelChoiceField):
+                field.set_objects(*self.get_choice_objects(name, field))
+        return form
+
+    def get_choice_objects(self, name, field):
+        """The objects and choices for the named field, loaded once and shared by all the forms. """
+        if not hasattr(self, '_choice_objects'):
+            self._choice_objects = {}
+        key = (field.queryset.model, name)
+        if key not in self._choice_objects:
+            self._choice_objects[key] = field.load_objects()
+        return self._choice_objects[key]
+
+    def saved_objects(self):
+        """The objects added or changed by the last save. """
+        return [*self.new_objects, *(obj for obj, fields in self.changed_objects)]
+
+    def save(self, commit=True):
+        saved = super().save(commit=commit)
+        if commit:
+            transaction.on_commit(self.after_commit)
+        return saved
+
+    def after_commit(self):
+        """Once for all the saved rows, do what their model save methods and signals would have done. """
+
+
+class SessionFormSet(BulkFormSet):
+    """Sessions saved in bulk, with the 'expire_date' and next Session 'publish_date' set as Session.save does. """
+
+    def prepare_bulk_save(self, model, objs):
+        for session in objs:
+            if not session.expire_date:
+                session.expire_date = session.computed_expire_day(key_day=session.key_day_date)
+        return ('expire_date', )
+
+    def after_commit(self):
+        """The Session after each saved one is published when it expires, and changed Sessions update their classes. """
+        Session.clear_timeline()
+        following = {}
+        for session in self.saved_objects():
+            next_sess = session.next_session
+            if next_sess and next_sess.publish_date != session.expire_date:
+                next_sess.publish_date = session.expire_date
+                following[next_sess.pk] = next_sess
+        if following:
+            Session.objects.bulk_update(following.values(), ['publish_date'])
+            Session.clear_timeline()
+        class_date_fields = set(Session.CLASS_DATE_FIELDS)
+        changed = [obj for obj, fields in self.changed_objects if class_date_fields.intersection(fields)]
+        if changed:
+            ClassOffer.objects.filter(session__in=changed).update_dates()
+        bump_schedule_version()
+
+
+class ClassOfferFormSet(BulkFormSet):
+    """ClassOffers saved in bulk, with their level and dates set, and their Resource windows refreshed together. """
+
+    def prepare_bulk_save(self, model, objs):
+        for classoffer in objs:
+            classoffer.set_num_level()
+            classoffer.set_dates()
+        return ('_num_level', 'start_date', 'end_date', )
+
+    def after_commit(self):
+        saved = self.saved_objects()
+        if saved:
+            ResourcePublication.objects.refresh(classoffers=saved)
+        bump_schedule_version()
+
+
+class ResourceFormSet(BulkFormSet):
+    """Resources saved in bulk. New ones are not yet connected to classes, so only changed ones are refreshed. """
+
+    def after_commit(self):
+        changed = [obj for obj, fields in self.changed_objects]
+        if changed:
+            ResourcePublication.objects.refresh(resources=changed)
@@ -0,0 +1,33 @@
+import logging
+from contextlib import contextmanager
+from django.db import connections
+from time import perf_counter
+
+
+@contextmanager
+def log_event(logger, event, level=logging.INFO, using='default', **fields):
+    """Logs the event when the block is done, with 'queries' count and 'elapsed_ms' added to the given fields.
+        The fields, and the event name as 'event', are attributes of the log record for structured log handlers, so
+        they can not be LogRecord attribute names. The block may add to the yielded fields dict. Nothing is measured
+        if the logger is not enabled for the level.
+    """
+    if not logger.isEnabledFor(level):
+        yield fields
+        return
+    count = [0]
+
+    def counter(execute, sql, params, many, context):
+        count[0] += 1
+        return execute(sql, params, many, context)
+
+    start = perf_counter()
+    try:
+        with connections[using].execute_wrapper(counter):
+            yield fields
+    except Exception as e:
+        fields['error'] = e.__class__.__name__
+        raise
+    finally:
+        fields.update(queries=count[0], elapsed_ms=round((perf_counter() - start) * 1000, 1))
+        details = ' '.join(f"{key}={value}" for key, value in fields.items())
+        logger.log(level, "%s %s", event, details, extra=dict(fields, event=event))
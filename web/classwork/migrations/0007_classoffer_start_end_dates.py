@@ -0,0 +1,53 @@
+# Generated by Django 3.1.5 on 2021-01-20 18:02
+
+from django.db import migrations, models
+from datetime import timedelta
+
+
+def compute_dates(classoffer):
+    """Historical models do not have the model methods, so this matches ClassOffer.compute_dates. """
+    session = classoffer.session
+    if session is None:
+        return (None, None)
+    key_day, shift = session.key_day_date, session.max_day_shift
+    dif = classoffer.class_day - key_day.weekday()
+    if dif == 0:
+        shifted = 0
+    elif dif < shift < 0 or shift > dif + 7:
+        shifted = dif + 7
+    elif shift < dif - 7 or 0 < shift < dif:
+        shifted = dif - 7
+    else:
+        shifted = dif
+    start = key_day + timedelta(days=shifted)
+    end = start + timedelta(days=7*(session.num_weeks - 1 + classoffer.skip_weeks))
+    return (start, end)
+
+
+def populate_dates(apps, schema_editor):
+    ClassOffer = apps.get_model('classwork', 'ClassOffer')
+    classoffers = list(ClassOffer.objects.select_related('session'))
+    for classoffer in classoffers:
+        classoffer.start_date, classoffer.end_date = compute_dates(classoffer)
+    ClassOffer.objects.bulk_update(classoffers, ['start_date', 'end_date'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classwork', '0006_auto_20210101_1551'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classoffer',
+            name='start_date',
+            field=models.DateField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='classoffer',
+            name='end_date',
+            field=models.DateField(blank=True, db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(populate_dates, migrations.RunPython.noop),
+    ]
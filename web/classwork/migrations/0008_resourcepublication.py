@@ -0,0 +1,73 @@
+# Generated by Django 3.1.5 on 2021-01-24 21:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+from datetime import timedelta
+
+
+def compute_window(avail, expire, start, end, skips, num_weeks):
+    """Historical models do not have the model methods, so this matches ResourcePublication.compute_window. """
+    if avail == 0:
+        publish_date = None
+    elif avail < num_weeks:
+        publish_date = start + timedelta(days=7*(avail - 1))
+    else:
+        publish_date = end
+    if expire == 0:
+        return (publish_date, None)
+    weeks = max(1, min(avail, num_weeks))
+    return (publish_date, start + timedelta(days=7*(weeks + expire + skips - 1)))
+
+
+def populate_publications(apps, schema_editor):
+    Resource = apps.get_model('classwork', 'Resource')
+    ClassOffer = apps.get_model('classwork', 'ClassOffer')
+    ResourcePublication = apps.get_model('classwork', 'ResourcePublication')
+    pairs = set(Resource.classoffers.through.objects.values_list('resource_id', 'classoffer_id'))
+    pairs.update(ClassOffer.objects.filter(subject__resources__isnull=False).values_list('subject__resources', 'pk'))
+    resources = {ea.pk: ea for ea in Resource.objects.all()}
+    classoffers = {ea.pk: ea for ea in ClassOffer.objects.select_related('session')}
+    windows = []
+    for res_id, co_id in pairs:
+        res, co = resources[res_id], classoffers[co_id]
+        if co.start_date is None or co.session is None:
+            continue
+        publish_date, expire_date = compute_window(res.avail, res.expire, co.start_date, co.end_date,
+                                                   co.skip_weeks, co.session.num_weeks)
+        windows.append(ResourcePublication(resource_id=res_id, classoffer_id=co_id, user_type=res.user_type,
+                                           publish_date=publish_date, expire_date=expire_date))
+    ResourcePublication.objects.bulk_create(windows, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classwork', '0007_classoffer_start_end_dates'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResourcePublication',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_type', models.PositiveSmallIntegerField(choices=[(0, 'Public'), (1, 'Student'), (2, 'Teacher'), (3, 'Admin')], default=1)),
+                ('publish_date', models.DateField(blank=True, help_text='Empty if available on sign-up. ', null=True)),
+                ('expire_date', models.DateField(blank=True, help_text='Last day published. Empty if always. ', null=True)),
+                ('classoffer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='publications', to='classwork.classoffer')),
+                ('resource', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='publications', to='classwork.resource')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='resourcepublication',
+            index=models.Index(fields=['publish_date', 'expire_date'], name='publication_window_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='resourcepublication',
+            index=models.Index(fields=['classoffer', 'publish_date', 'expire_date'], name='publication_class_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='resourcepublication',
+            constraint=models.UniqueConstraint(fields=('resource', 'classoffer'), name='unique_publication'),
+        ),
+        migrations.RunPython(populate_publications, migrations.RunPython.noop),
+    ]
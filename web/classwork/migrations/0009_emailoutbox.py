@@ -0,0 +1,34 @@
+# Generated by Django 3.1.5 on 2021-01-28 19:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classwork', '0008_resourcepublication'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailOutbox',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=191)),
+                ('body', models.TextField()),
+                ('from_email', models.CharField(max_length=191)),
+                ('to', models.TextField(help_text='Comma separated email addresses. ')),
+                ('status', models.CharField(choices=[('P', 'Pending'), ('S', 'Sent'), ('F', 'Failed')], default='P', max_length=1)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('send_after', models.DateTimeField(default=django.utils.timezone.now, help_text='Not sent before this time. ')),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('date_added', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='emailoutbox',
+            index=models.Index(fields=['status', 'send_after'], name='outbox_due_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.1.5 on 2021-01-28 19:12
+
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+def remove_duplicates(apps, schema_editor):
+    """Keep one Registration of a Student in a ClassOffer, so the unique constraint can be added.
+        The kept one is a paid one if any, then one with a Payment, then the first. If it has no Payment, it gets the
+        Payment of a removed one, so no payment record is lost.
+    """
+    Registration = apps.get_model('classwork', 'Registration')
+    duplicates = (Registration.objects.filter(student__isnull=False, classoffer__isnull=False)
+                  .values('student', 'classoffer').annotate(count=Count('id')).filter(count__gt=1))
+    for dup in duplicates:
+        regs = Registration.objects.filter(student=dup['student'], classoffer=dup['classoffer'])
+        regs = list(regs.order_by('-paid', F('payment_id').asc(nulls_last=True), 'id'))
+        keep, extra = regs[0], regs[1:]
+        if keep.payment_id is None:
+            keep.payment_id = next((reg.payment_id for reg in extra if reg.payment_id is not None), None)
+            if keep.payment_id is not None:
+                keep.save(update_fields=['payment'])
+        Registration.objects.filter(id__in=[reg.id for reg in extra]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('classwork', '0009_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='registration',
+            constraint=models.UniqueConstraint(fields=('student', 'classoffer'), name='unique_registration'),
+        ),
+    ]
@@ -1,20 +1,31 @@
-from django.db import models
-from django.db.models import Q, F, Func, Case, When, Count, Sum, Max, OuterRef, DateField, ExpressionWrapper as EW
+from django.db import models, transaction, connections
+from django.db.models import Q, F, Case, When, Count, Sum, Max, Exists, OuterRef, Subquery, ExpressionWrapper as EW
 # , Avg, Sum, Min, Value, Subquery
-from django.db.models.functions import Least, Extract  # , ExtractWeek, ExtractIsoYear, Trunc, Now,
-# from .transforms import AddDate, DateDiff, DayYear, NumDay, DateFromNum, MakeDate, DateToday
+from django.db.models.functions import Least, Extract, Coalesce  # , ExtractWeek, ExtractIsoYear, Trunc, Now,
+from .transforms import AddDate, DateDiff, DateToday  # , DayYear, NumDay, DateFromNum, MakeDate
 # from django.contrib.admin.views.decorators import staff_member_required  # TODO: Add decorator to needed views.
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, post_migrate, m2m_changed
 from django.dispatch import receiver
+from django.core.cache import cache
 from django.utils.translation import gettext_lazy as _
-from django.core.mail import EmailMessage
+from django.core.mail import EmailMessage, get_connection
+from django.template.loader import get_template
 from django.conf import settings
+from django.utils import timezone
+from .logs import log_event
 from django.urls import reverse
 from django_countries.fields import CountryField
 from decimal import Decimal  # used for Payments
 from payments import PurchasedItem
 from payments.models import BasePayment
 from datetime import date, timedelta, datetime as dt
+from bisect import bisect_left, bisect_right
+from uuid import uuid4
+from time import time, perf_counter, sleep
+from contextlib import suppress, contextmanager
+from threading import local
+import logging
+logger = logging.getLogger(__name__)
 
 # TODO: Implement calling resource_filepath for resource uploads.
 # TODO: Add @staff_member_required decorator to admin views?
@@ -67,9 +78,13 @@ class ResourceManager(models.Manager):
     def get_queryset(self):
         return super().get_queryset()
 
-    def live(self, start=None, end=None, skips=0, type_user=0, **kwargs):
-        """Will filter and annotate to return only currently published Resource for the given context. """
-        raise NotImplementedError
+    def live(self, start=None, end=None, type_user=None, classoffers=None, **kwargs):
+        """Returns the Resources published for at least one ClassOffer on any day from start to end (default today).
+            This is a range lookup on the precomputed ResourcePublication windows, which already account for skips.
+            Optionally limited to a maximum type_user (int, or str such as 'student'), and to the given ClassOffers.
+        """
+        windows = ResourcePublication.objects.live(start, end, type_user=type_user, classoffers=classoffers)
+        return self.get_queryset().filter(Exists(windows.filter(resource=OuterRef('pk'))))
 
 
 class Resource(models.Model):
@@ -118,6 +133,7 @@ class Resource(models.Model):
     date_added = models.DateField(auto_now_add=True, )
     date_modified = models.DateField(auto_now=True, )
     objects = ResourceManager()
+    # publications exists from ResourcePublication, the precomputed publish windows for each connected ClassOffer.
 
     # def respath(self):
     #     """Returns the data field for the selected content type"""
@@ -132,6 +148,12 @@ class Resource(models.Model):
     #     }
     #     return content_path[self.content_type]
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if not adding:  # New Resources are not yet connected to any ClassOffer or Subject.
+            ResourcePublication.objects.refresh(resources=[self])
+
     def get_absolute_url(self):
         return reverse('resource_detail', args=[str(self.id)])
 
@@ -241,6 +263,23 @@ def default_publish(): return Session._default_date('publish_date')
 def default_key_day(): return Session._default_date('key_day_date')
 
 
+_snapshot = local()  # The Session timeline shared by lookups within a timeline_snapshot block of a thread.
+
+
+@contextmanager
+def timeline_snapshot():
+    """While in a transaction, the Session timeline lookups in this block use one build of it, instead of a query for
+        each, until a Session is saved or deleted. Used for the lookups in a Session clean and save.
+    """
+    _snapshot.depth = getattr(_snapshot, 'depth', 0) + 1
+    try:
+        yield
+    finally:
+        _snapshot.depth -= 1
+        if not _snapshot.depth:
+            _snapshot.data = None
+
+
 class Session(models.Model):
     """Classes are offered and published according to which session they belong.
         Each session start date is computed based on 'key_day_date' and the earliest class day.
@@ -276,6 +315,11 @@ class Session(models.Model):
 
     date_added = models.DateField(auto_now_add=True, )
     date_modified = models.DateField(auto_now=True, )
+    CLASS_DATE_FIELDS = ('key_day_date', 'max_day_shift', 'num_weeks', )  # Changes require ClassOffer date updates.
+    TIMELINE_KEY = 'session_timeline'
+    TIMELINE_VERSION_KEY = 'session_timeline_version'
+    TIMELINE_TIMEOUT = 60  # Seconds a process may use a timeline without seeing a clear, as with a per-process cache.
+    _timeline = None  # In-process copy of the timeline as a tuple of (version, expires, data).
 
     @property
     def start_date(self):
@@ -303,29 +347,81 @@ class Session(models.Model):
     @property
     def next_session(self):
         """Returns the Session that comes after the current Session, or 'None' if none exists. """
-        key_day = self.key_day_date
-        key_day = key_day() if callable(key_day) else key_day
-        key_day = key_day.isoformat() if isinstance(key_day, (date, dt)) else key_day
-        later = Session.objects.filter(key_day_date__gt=key_day)
-        # next_one_or_none = later.order_by('key_day_date').first()
-        try:
-            next_sess = later.filter(num_weeks__gt=settings.SESSION_LOW_WEEKS).earliest('key_day_date')
-        except self.DoesNotExist:
-            next_sess = None
-        return next_sess
+        key_days, rows = Session.timeline()
+        num_weeks = Session.timeline_fields().index('num_weeks')
+        for row in rows[bisect_right(key_days, self._as_date(self.key_day_date)):]:
+            if row[num_weeks] > settings.SESSION_LOW_WEEKS:
+                return Session.from_timeline(row)
+        return None
 
     @classmethod
     def last_session(cls, since=None):
         """Returns the Session starting the latest, or latest prior to given 'since' date. Return None if none. """
-        query = cls.objects
-        if since:
-            # TODO: Check isinstance an appropriate datetime obj
-            query = query.filter(key_day_date__lt=since)
-        try:
-            result = query.latest('key_day_date')  # .order_by('-key_day_date').first()
-        except cls.DoesNotExist:
-            result = None
-        return result
+        key_days, rows = cls.timeline()
+        index = bisect_left(key_days, cls._as_date(since)) if since else len(rows)
+        return cls.from_timeline(rows[index - 1]) if index else None
+
+    @staticmethod
+    def _as_date(value):
+        """Returns a date for a date, datetime, callable returning either, or an isoformat string. """
+        value = value() if callable(value) else value
+        if isinstance(value, dt):
+            value = value.date()
+        elif isinstance(value, str):
+            value = date.fromisoformat(value)
+        return value
+
+    @classmethod
+    def timeline_fields(cls):
+        return [field.attname for field in cls._meta.concrete_fields]
+
+    @classmethod
+    def from_timeline(cls, row):
+        """Returns a new Session instance, as if loaded from the database, for a row of the timeline. """
+        return cls.from_db(cls.objects.db, cls.timeline_fields(), row)
+
+    @classmethod
+    def timeline(cls):
+        """Returns a tuple of (key_day_dates, rows) for all Sessions, ordered by 'key_day_date', for bisect lookups.
+            Each row is a tuple of values for the timeline_fields. Kept in-process and in the shared cache until a
+            Session is saved or deleted, or for at most TIMELINE_TIMEOUT seconds. Not kept if the cache is unavailable.
+            While in a transaction, computed from the database, and only shared within a timeline_snapshot block.
+        """
+        if transaction.get_connection().in_atomic_block:
+            if not getattr(_snapshot, 'depth', 0):
+                return cls._build_timeline()
+            if getattr(_snapshot, 'data', None) is None:
+                _snapshot.data = cls._build_timeline()
+            return _snapshot.data
+        version = cache.get(cls.TIMELINE_VERSION_KEY)
+        local = cls._timeline
+        if local is not None and local[0] == version and local[1] > time():
+            return local[2]
+        shared = cache.get(cls.TIMELINE_KEY) if version is not None else None
+        if shared is not None and shared[0] == version:
+            data = shared[1]
+        else:
+            data = cls._build_timeline()
+            if version is None:
+                cache.add(cls.TIMELINE_VERSION_KEY, uuid4().hex, None)
+                version = cache.get(cls.TIMELINE_VERSION_KEY)
+            if version is not None:
+                cache.set(cls.TIMELINE_KEY, (version, data), cls.TIMELINE_TIMEOUT)
+        cls._timeline = (version, time() + cls.TIMELINE_TIMEOUT, data) if version is not None else None
+        return data
+
+    @classmethod
+    def _build_timeline(cls):
+        rows = list(cls.objects.order_by('key_day_date', 'pk').values_list(*cls.timeline_fields()))
+        key_day = cls.timeline_fields().index('key_day_date')
+        return [row[key_day] for row in rows], rows
+
+    @classmethod
+    def clear_timeline(cls):
+        """Discard the in-process and shared cache Session timeline, so it is rebuilt when next needed. """
+        cls._timeline = None
+        _snapshot.data = None
+        cache.delete_many([cls.TIMELINE_VERSION_KEY, cls.TIMELINE_KEY])
 
     @classmethod
     def _default_date(cls, field, since=None):
@@ -335,9 +431,12 @@ class Session(models.Model):
             raise ValueError(_("Not a valid field parameter: {} ".format(field)))
         now = date.today()
         new_date = None
-        final_session = cls.last_session(since=since)
-        while final_session is not None and final_session.num_weeks < settings.SESSION_LOW_WEEKS:
-            final_session = final_session.prev_session
+        key_days, rows = cls.timeline()
+        num_weeks = cls.timeline_fields().index('num_weeks')
+        index = bisect_left(key_days, cls._as_date(since)) if since else len(rows)
+        while index and rows[index - 1][num_weeks] < settings.SESSION_LOW_WEEKS:
+            index = bisect_left(key_days, key_days[index - 1])  # Skip to the Session before this key_day_date.
+        final_session = cls.from_timeline(rows[index - 1]) if index else None
         if not final_session:
             new_date = None
         elif field == 'key_day_date':
@@ -364,6 +463,7 @@ class Session(models.Model):
         expire = key_day + timedelta(days=adj)
         return expire
 
+    @timeline_snapshot()
     def clean(self):
         """Modifies values for validity checks and if needed to avoid overlapping published Sessions.
             If avoiding overlaps, the publish_date and expire_date are overwritten by determined values.
@@ -412,6 +512,7 @@ class Session(models.Model):
             setattr(self, field_to_clean, field)
         return super().clean_fields(exclude=exclude)
 
+    @timeline_snapshot()
     def save(self, *args, with_clean=False, **kwargs):
         """If given an 'update_fields' list of field names, directly saves if doing so won't break expire_date.
             Otherwise, which clean methods are used depends on 'with_clean'.
@@ -420,7 +521,11 @@ class Session(models.Model):
         """
         if 'update_fields' in kwargs:
             if not all(['expire_date' in kwargs['update_fields'], self.expire_date is None]):
-                return super().save(*args, **kwargs)
+                super().save(*args, **kwargs)
+                if set(self.CLASS_DATE_FIELDS).intersection(kwargs['update_fields']):
+                    self.update_classoffer_dates()
+                return
+        adding = self._state.adding
         exclude = kwargs.get('exclude', None)
         if with_clean:
             self.full_clean(exclude=exclude)
@@ -429,12 +534,23 @@ class Session(models.Model):
         if not self.expire_date:
             self.expire_date = self.computed_expire_day(key_day=self.key_day_date)
         next_sess = self.next_session
-        if next_sess:
+        if next_sess and next_sess.publish_date != self.expire_date:
             next_sess.publish_date = self.expire_date
             next_sess.save(update_fields=['publish_date'])
         # try: self.objects.get_next_by_key_day_date().update(publish_date=self.expire_date)
         # except Session.DoesNotExist as e: print(f"There is no next session: {e} ")
         super().save(*args, **kwargs)
+        if not adding:
+            self.update_classoffer_dates()
+
+    def update_classoffer_dates(self):
+        """Recompute the stored 'start_date' and 'end_date' for each ClassOffer in this Session. Returns count. """
+        classoffers = list(self.classoffer_set.all())
+        for classoffer in classoffers:
+            classoffer.set_dates(session=self)
+        ClassOffer.objects.bulk_update(classoffers, ['start_date', 'end_date'])
+        ResourcePublication.objects.refresh(classoffers=classoffers)
+        return len(classoffers)
 
     def get_admin_absolute_url(self):
         return reverse('checkin_session', args=[str(self)])
@@ -452,6 +568,10 @@ class Session(models.Model):
 class CustomQuerySet(models.QuerySet):
 
     def with_dates(self):
+        """Annotates the start and end dates computed by the database, as 'computed_start' and 'computed_end'.
+            The stored 'start_date' and 'end_date' fields should be used when querying. These annotations are
+            kept for confirming the stored values, such as by the 'classoffer_dates' management command.
+        """
         return self.annotate(
                 dif=Case(
                     When(Q(session__key_day_date__week_day=1),  # On the DB Sunday is 1, but is 6 in Python.
@@ -471,11 +591,19 @@ class CustomQuerySet(models.QuerySet):
                     When(Q(session__max_day_shift__gt=0) & Q(session__max_day_shift__lt=F('dif')), then=F('dif')-7),
                     default=F('dif'), output_field=models.SmallIntegerField()),
             ).annotate(
-                start_date=Func(F('session__key_day_date'), F('shifted'), function='ADDDATE', output_field=DateField()),
+                computed_start=AddDate(F('session__key_day_date'), F('shifted')),
             ).annotate(
-                end_date=Func(F('start_date'), 7 * (F('session__num_weeks') - 1 + F('skip_weeks')), function='ADDDATE',
-                              output_field=DateField()),
-            ).select_related()
+                computed_end=AddDate(F('computed_start'), 7 * (F('session__num_weeks') - 1 + F('skip_weeks'))),
+            )
+
+    def update_dates(self):
+        """Recompute and store the 'start_date' and 'end_date' for all ClassOffers in this queryset. Returns count. """
+        classoffers = list(self.select_related('session'))
+        for classoffer in classoffers:
+            classoffer.set_dates()
+        self.model.objects.bulk_update(classoffers, ['start_date', 'end_date'], batch_size=500)
+        ResourcePublication.objects.refresh(classoffers=classoffers)
+        return len(classoffers)
 
     def prepare_get_resources_params(self, **kwargs):
         qs = Resource.objects
@@ -512,8 +640,9 @@ class CustomQuerySet(models.QuerySet):
             start = start or OuterRef('start_date')
             end = end or OuterRef('end_date')
             skips = skips if skips is not None else OuterRef('skip_weeks')
+            max_weeks = max_weeks if max_weeks is not None else OuterRef('session__num_weeks')
             qs = qs.filter(Q(classoffers__id=OuterRef('pk')) | Q(subjects=OuterRef('subject')))
-            qs = qs.order_by('pk').distinct()
+            qs = qs.order_by('pk')  # Only used as a subquery, so distinct is not needed and would break values()[:1]
 
         if not isinstance(start, (date, OuterRef)) or not isinstance(end, (date, OuterRef)):
             raise TypeError(_("Both start and end parameters must be date objects or OuterRefs to DateFields. "))
@@ -526,7 +655,9 @@ class CustomQuerySet(models.QuerySet):
             raise TypeError(_("The type_user parameter must be an appropriate string or integer"))
         # now = kwargs('check_date', None)
         max_weeks = settings.SESSION_MAX_WEEKS if max_weeks is None else max_weeks
-        return (qs, start, end, skips, int(max_weeks), kwargs)
+        if not isinstance(max_weeks, OuterRef):
+            max_weeks = int(max_weeks)
+        return (qs, start, end, skips, max_weeks, kwargs)
 
     def get_resources(self, live=False, **kwargs):
         """Returns a filtered & annotated queryset of Resources connected to the current ClassOffer queryset.
@@ -536,22 +667,20 @@ class CustomQuerySet(models.QuerySet):
         """
 
         res_qs, start, end, skips, max_weeks, kwargs = self.prepare_get_resources_params(**kwargs)
-        now = Func(function='CURDATE', output_field=models.DateField())  # TODO: decide CURDATE or UTC_DATE
-        dates = [Least(start, now)]
-        dates += [Func(start, 7 * i, function='ADDDATE', output_field=models.DateField()) for i in range(max_weeks - 1)]
-        # dates += [Func(start, 7 * i, function='ADDDATE') for i in range(max_weeks - 1)]
-        # MySQL Functions: ADDDATE, DATEDIFF, DAYOFYEAR, TO_DAYS, FROM_DAYS, MAKEDATE, CURDATE
+        now = DateToday()  # TODO: decide CURDATE or UTC_DATE
+        # Date functions from .transforms compile for the database in use: MySQL, SQLite, or PostgreSQL.
+        # The max_weeks may be an OuterRef, so the publish date after class 'avail' is computed instead of listed.
         res_qs = res_qs.annotate(
                 publish=Case(
-                    *[When(Q(avail=num), then=date) for num, date in enumerate(dates)],
+                    When(Q(avail=0), then=Least(start, now)),
+                    When(Q(avail__lt=max_weeks), then=AddDate(start, 7 * (F('avail') - 1))),
                     default=end,  # Uses default if 'after class ends' was selected option (value = 200).
                     output_field=models.DateField()),
-                days_since=Func(now, start, function='DATEDIFF', output_field=models.IntegerField()),
+                days_since=DateDiff(now, start),
             ).annotate(
                 expire_date=Case(
                     When(Q(expire=0), then=None),
-                    default=Func(F('publish'), 7 * (F('expire') + skips),
-                                 function='ADDDATE', output_field=models.DateField()),
+                    default=AddDate(F('publish'), 7 * (F('expire') + skips)),
                     output_field=models.DateField()),
                 live=Case(
                     When(Q(publish__gt=now), then=False),
@@ -578,42 +707,75 @@ class CustomQuerySet(models.QuerySet):
         return res_qs
 
     def resources(self, **kwargs):
-        """Return a queryset.values() of Resource objects that are alive and connected to the current queryset. """
+        """Return a queryset.values() of Resource objects that are alive and connected to the current queryset.
+            The ClassOffers are determined when called, then the Resources live for any of them are a single query.
+        """
         resource_fields = ('name', 'id', 'content_type', )  # , 'imagepath',
         kwargs['live'] = True  # Calling resources will always only return currently available resources.
-        # kwargs.setdefault('live', True)  # unless set False in kwargs, will only return currently available resources.
-        arr = [self.get_resources(model=ea, **kwargs).order_by().values(*resource_fields) for ea in self.all()]
+        kwargs.pop('model', None)  # Each ClassOffer is given by the OuterRef of the classoffers subquery.
+        classoffers = self.model.objects.filter(pk__in=list(self.values_list('pk', flat=True)))
+        live_res = classoffers.get_resources(**kwargs).filter(pk=OuterRef(OuterRef('pk')))
+        classoffers = classoffers.filter(Exists(live_res))
         # TODO: Look into 'defer' as a query option instead of 'values' to have a qs of models instead of dicts.
-        if len(arr):
-            collected = arr[0].union(*arr[1:])
-        else:
-            collected = Resource.objects.none().values()
-        return collected
-
-    def most_recent_resource_per_classoffer(self):
-        """This feature is not yet implemented correctly. """
-        # res = self.get_resources(
-        #         start=OuterRef('start_date'),
-        #         end=OuterRef('end_date'),
-        #         skips=OuterRef('skip_weeks')
-        #     )
-        # try:
-        #     result = self.annotate(
-        #             recent_resource=Subquery(res.values('name')[:1]),
-        #         )
-        #     print(result)
-        # except Exception as e:
-        #     print("Exception in ClassOffer manager method: most_recent_resource_per_classoffer ")
-        #     print(e)
-        raise NotImplementedError
-        # return result
+        return Resource.objects.filter(Exists(classoffers)).values(*resource_fields)
+
+    def most_recent_resource_per_classoffer(self, **kwargs):
+        """Annotates each ClassOffer with its most recently published, and still live, Resource.
+            Adds 'recent_resource' (name), 'recent_resource_id', and 'recent_resource_publish' (date) annotations,
+            which are None if the ClassOffer does not have a live Resource. Accepts the get_resources kwargs.
+        """
+        kwargs['live'] = True
+        kwargs.pop('model', None)  # Each ClassOffer is given by the OuterRef of the Resource subquery.
+        res = self.get_resources(**kwargs)
+        # For a given ClassOffer, publish date increases with 'avail'. SQLite does not allow OuterRef in ORDER BY.
+        order = ('-avail', '-pk')
+        return self.annotate(
+                recent_resource=Subquery(res.values('name').order_by(*order)[:1]),
+                recent_resource_id=Subquery(res.values('pk').order_by(*order)[:1]),
+                recent_resource_publish=Subquery(res.values('publish').order_by(*order)[:1]),
+            )
+
+    def with_roster(self):
+        """Annotates the check-in totals of each ClassOffer, and prefetches its Registrations to the 'roster' list.
+            Adds 'headcount', 'paid_count', 'paid_total', 'owed_total', and 'credit_total' annotations. The 'paid_total'
+            and 'owed_total' share the captured and owed amounts of each Payment evenly by the Registrations it paid
+            for, so a Payment for several classes is not counted in full for each. Each roster Registration has its
+            'amount_owed' for its whole Payment computed by the database, and is ordered by the Student's first name.
+        """
+        owed = Registration.owed_expression(prefix='registration__')
+        shares = Subquery(Registration.objects.filter(payment=OuterRef('registration__payment')).order_by()
+                          .values('payment').annotate(count=Count('pk')).values('count'))
+        paid_share = EW(F('registration__payment__captured_amount') / shares, output_field=owed.output_field)
+        owed_share = EW(owed / shares, output_field=owed.output_field)
+        registrations = Registration.objects.annotate(amount_owed=Registration.owed_expression())
+        registrations = registrations.select_related('student__user').order_by('student__user__first_name', 'pk')
+        return self.annotate(
+                headcount=Count('registration'),
+                paid_count=Count('registration', filter=Q(registration__paid=True)),
+                paid_total=Coalesce(Sum(paid_share), 0, output_field=owed.output_field),
+                owed_total=Coalesce(Sum(owed_share), 0, output_field=owed.output_field),
+                credit_total=Coalesce(Sum('registration__student__credit'), 0, output_field=owed.output_field),
+            ).prefetch_related(models.Prefetch('registration_set', queryset=registrations, to_attr='roster'))
+
+    def quote(self, classoffers, student=None):
+        """Returns a PriceQuote for the given ClassOffers, or their ids, with the Subject prices fetched in one query.
+            The quoted classes are in the order given, and the student's credit is applied if a Student is given.
+        """
+        ids = [getattr(ea, 'pk', ea) for ea in classoffers]
+        found = {ea.pk: ea for ea in self.filter(pk__in=ids).select_related('subject', 'session')}
+        return PriceQuote([found[pk] for pk in ids if pk in found], credit=getattr(student, 'credit', 0))
 
 
 class ClassOfferManager(models.Manager):
-    def get_queryset(self): return CustomQuerySet(self.model, using=self._db).with_dates()
+    def get_queryset(self): return CustomQuerySet(self.model, using=self._db)
     def get_resources(self, **kwargs): return self.get_queryset().get_resources(**kwargs)
     def resources(self, **kwargs): return self.get_queryset().resources(**kwargs)
-    def most_recent_resource_per_classoffer(self): return self.get_queryset().most_recent_resource_per_classoffer()
+
+    def most_recent_resource_per_classoffer(self, **kwargs):
+        return self.get_queryset().most_recent_resource_per_classoffer(**kwargs)
+
+    def with_roster(self): return self.get_queryset().with_roster()
+    def quote(self, classoffers, student=None): return self.get_queryset().quote(classoffers, student=student)
     # TODO: If all the methods are just querysets, then refactor to use CustomQuerySet as manager.
 
 
@@ -643,6 +805,9 @@ class ClassOffer(models.Model):
     start_time = models.TimeField()
     skip_weeks = models.PositiveSmallIntegerField(_('skipped mid-session class weeks'), default=0, )
     skip_tagline = models.CharField(max_length=46, blank=True, )
+    # start_date and end_date are computed from the Session and class_day, and updated when either is saved.
+    start_date = models.DateField(null=True, blank=True, editable=False, db_index=True, )
+    end_date = models.DateField(null=True, blank=True, editable=False, db_index=True, )
     # students exists from Student.taken for users who are signed up for this ClassOffer.
     # resources exits, but only directly connected Resources, not those connected through Subject.
     # # future: class_resources exists, but only includes directly connected Resources, but not those through Subject.
@@ -734,9 +899,39 @@ class ClassOffer(models.Model):
         self._num_level = num
         return num
 
+    def compute_dates(self, session=None):
+        """Returns a tuple of the first and last class dates, or (None, None) if there is no Session.
+            The first class is on the 'class_day' nearest the Session 'key_day_date', in the direction of (and
+            within the range of) the Session 'max_day_shift'. Otherwise it is in the opposite direction.
+            The last class date also depends on the Session 'num_weeks' and the ClassOffer 'skip_weeks'.
+        """
+        session = session or self.session
+        if session is None:
+            return (None, None)
+        key_day = session.key_day_date
+        shift = session.max_day_shift
+        dif = self.class_day - key_day.weekday()
+        if dif == 0:
+            shifted = 0
+        elif dif < shift < 0 or shift > dif + 7:
+            shifted = dif + 7
+        elif shift < dif - 7 or 0 < shift < dif:
+            shifted = dif - 7
+        else:
+            shifted = dif
+        start = key_day + timedelta(days=shifted)
+        end = start + timedelta(days=7*(session.num_weeks - 1 + self.skip_weeks))
+        return (start, end)
+
+    def set_dates(self, session=None):
+        self.start_date, self.end_date = self.compute_dates(session=session)
+        return (self.start_date, self.end_date)
+
     def save(self, *args, **kwargs):
         self.set_num_level()
+        self.set_dates()
         super().save(*args, **kwargs)
+        ResourcePublication.objects.refresh(classoffers=[self])
 
     def get_absolute_url(self):
         return reverse('classoffer_detail', args=[str(self.id)])
@@ -748,6 +943,129 @@ class ClassOffer(models.Model):
         return '<Class Id: {} | Subject: {} | Session: {} >'.format(self.id, self.subject, self.session)
 
 
+class ResourcePublicationManager(models.Manager):
+
+    def live(self, start=None, end=None, type_user=None, classoffers=None):
+        """Returns the publication windows that overlap the dates from start to end, defaulting to just today. """
+        start = start or date.today()
+        end = end or start
+        qs = self.get_queryset().filter(
+                Q(publish_date__isnull=True) | Q(publish_date__lte=end),
+                Q(expire_date__isnull=True) | Q(expire_date__gte=start),
+            )
+        if isinstance(type_user, str):
+            user_lookup = {'public': 0, 'student': 1, 'teacher': 2, 'admin': 3, }
+            type_user = user_lookup.get(type_user, len(Resource.USER_CHOICES))
+        if type_user is not None:
+            qs = qs.filter(user_type__lte=type_user)
+        if classoffers is not None:
+            qs = qs.filter(classoffer__in=classoffers)
+        return qs
+
+    def refresh(self, resources=None, classoffers=None):
+        """Recompute the windows for the given Resources and/or ClassOffers (instances or ids), or all if neither.
+            Returns the number of publication windows stored for them.
+        """
+        direct, by_subject, current = {}, {}, {}
+        if resources is not None:
+            res_ids = [getattr(ea, 'pk', ea) for ea in resources]
+            direct['resource_id__in'] = by_subject['subject__resources__in'] = current['resource_id__in'] = res_ids
+        if classoffers is not None:
+            co_ids = [getattr(ea, 'pk', ea) for ea in classoffers]
+            direct['classoffer_id__in'] = by_subject['pk__in'] = current['classoffer_id__in'] = co_ids
+        by_subject.setdefault('subject__resources__isnull', False)
+        pairs = set(Resource.classoffers.through.objects.filter(**direct).values_list('resource_id', 'classoffer_id'))
+        pairs.update(ClassOffer.objects.filter(**by_subject).values_list('subject__resources', 'pk'))
+        res_fields = ('id', 'avail', 'expire', 'user_type', )
+        co_fields = ('id', 'start_date', 'end_date', 'skip_weeks', 'session__num_weeks', )
+        res_data = {ea['id']: ea for ea in Resource.objects.filter(id__in={r for r, c in pairs}).values(*res_fields)}
+        co_data = {ea['id']: ea for ea in ClassOffer.objects.filter(id__in={c for r, c in pairs}).values(*co_fields)}
+        windows = []
+        for res_id, co_id in pairs:
+            res, co = res_data[res_id], co_data[co_id]
+            if co['start_date'] is None or co['session__num_weeks'] is None:
+                continue
+            publish_date, expire_date = self.model.compute_window(
+                res['avail'], res['expire'], co['start_date'], co['end_date'],
+                co['skip_weeks'], co['session__num_weeks'])
+            windows.append(self.model(resource_id=res_id, classoffer_id=co_id, user_type=res['user_type'],
+                                      publish_date=publish_date, expire_date=expire_date))
+        with transaction.atomic():
+            self.get_queryset().filter(**current).delete()
+            self.bulk_create(windows, batch_size=500)
+        return len(windows)
+
+
+class ResourcePublication(models.Model):
+    """The precomputed dates a Resource is published for a connected ClassOffer, directly or through its Subject.
+        These are refreshed when a Resource, ClassOffer, or Session is saved, or Resource connections are changed.
+    """
+    resource = models.ForeignKey(Resource, on_delete=models.CASCADE, related_name='publications', )
+    classoffer = models.ForeignKey(ClassOffer, on_delete=models.CASCADE, related_name='publications', )
+    user_type = models.PositiveSmallIntegerField(default=1, choices=Resource.USER_CHOICES, )
+    publish_date = models.DateField(null=True, blank=True, help_text=_('Empty if available on sign-up. '), )
+    expire_date = models.DateField(null=True, blank=True, help_text=_('Last day published. Empty if always. '), )
+    objects = ResourcePublicationManager()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['resource', 'classoffer'], name='unique_publication'), ]
+        indexes = [
+            models.Index(fields=['publish_date', 'expire_date'], name='publication_window_idx'),
+            models.Index(fields=['classoffer', 'publish_date', 'expire_date'], name='publication_class_idx'),
+            ]
+
+    @staticmethod
+    def compute_window(avail, expire, start, end, skips, num_weeks):
+        """Returns a tuple of publish_date and expire_date, matching the get_resources 'live' annotation rules.
+            The publish_date is None if published on sign-up, and the expire_date is None if it never expires.
+        """
+        if avail == 0:
+            publish_date = None
+        elif avail < num_weeks:
+            publish_date = start + timedelta(days=7*(avail - 1))
+        else:  # Includes 'after class ends' option (value = 200).
+            publish_date = end
+        if expire == 0:
+            return (publish_date, None)
+        weeks = max(1, min(avail, num_weeks))
+        return (publish_date, start + timedelta(days=7*(weeks + expire + skips - 1)))
+
+    def __str__(self):
+        return '{} - {}'.format(self.resource_id, self.classoffer_id)
+
+    def __repr__(self):
+        values = (self.resource_id, self.classoffer_id, self.publish_date, self.expire_date)
+        return '<Publication Resource: {} | Class Id: {} | Dates: {} - {} >'.format(*values)
+
+
+@receiver(post_save, sender=Session)
+@receiver(post_delete, sender=Session)
+def clear_session_timeline(sender, **kwargs):
+    """The Session timeline is rebuilt after a Session is saved or deleted, and again when the change is committed. """
+    Session.clear_timeline()
+    transaction.on_commit(Session.clear_timeline)
+
+
+@receiver(post_migrate)
+def clear_session_timeline_after_migrate(sender, **kwargs):
+    """Migrate and flush (including between tests) change Sessions without sending the save or delete signals. """
+    Session.clear_timeline()
+
+
+@receiver(m2m_changed, sender=Resource.subjects.through)
+@receiver(m2m_changed, sender=Resource.classoffers.through)
+def refresh_resource_publications(sender, instance, action, **kwargs):
+    """Update the ResourcePublication windows when Resources are connected to, or removed from, classes. """
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if isinstance(instance, Resource):
+        ResourcePublication.objects.refresh(resources=[instance])
+    elif isinstance(instance, ClassOffer):
+        ResourcePublication.objects.refresh(classoffers=[instance])
+    else:  # A Subject had its Resources changed.
+        ResourcePublication.objects.refresh(classoffers=instance.classoffer_set.values_list('pk', flat=True))
+
+
 class RoleActivity(models.TextChoices):
     """Students and Staff may participate as identified roles for a given ClassOffer, event, or in general. """
     LEAD = 'L'
@@ -864,6 +1182,7 @@ class Staff(AbstractProfile):
                                        help_text=_("Negative numbers will not be shown. "), )
     tax_doc = models.CharField(max_length=9, blank=True, )
     # taught exists from ClassOffer.teachers related_name
+    SCHEDULE_FIELDS = ('bio', 'listing', )  # Shown on the schedule pages, so changes need a new schedule_version.
 
     class Meta(AbstractProfile.Meta):
         verbose_name_plural = 'staff'
@@ -872,12 +1191,87 @@ class Staff(AbstractProfile):
         super().__init__(*args, **kwargs)
         self._meta.get_field('bio').max_length = 1530  # Current for Chris is 1349 characters!
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Keeps the loaded values, so a save can tell if any SCHEDULE_FIELDS changed. """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     def get_absolute_url(self):
         return reverse("profile_staff", kwargs={"id": self.user_id})
 
 
+class StudentQuerySet(models.QuerySet):
+
+    def level_aggregates(self):
+        """Returns the aggregates, over Registration, ClassOffer, and Subject, used for computing Student level. """
+        beginning = Subject.LEVEL_CHOICES[0][0]
+        aggregates = {
+            'taken_count': Count('taken'),
+            'beg_count': Count('taken', filter=Q(taken__subject__level=beginning), distinct=True),
+            'highest_level_num': Max('taken__subject__level_num'),
+            }
+        for stage in self.model.LEVEL_STAGES:
+            level = Subject.LEVEL_CHOICES[self.model.LEVEL_STAGES[stage][0]][0]
+            for key, versions in self.model.stage_ver_map(stage).items():
+                q_full = Q(taken__subject__level=level, taken__subject__version__in=versions)
+                aggregates[f"{stage}_{key}"] = Count('taken', filter=q_full, distinct=True)
+        return aggregates
+
+    def with_level_data(self):
+        """Annotate each Student with the counts from the classes they have taken, used to compute their level.
+            Also annotates a boolean '<stage>_done' for each of the LEVEL_STAGES, matching the stage property 'done'.
+        """
+        aggregates = self.level_aggregates()
+        done = {}
+        for stage in self.model.LEVEL_STAGES:
+            goal = Q(**{f"{stage}_{key}__gte": 1 for key in self.model.stage_ver_map(stage)})
+            done[f"{stage}_done"] = Case(When(goal, then=True), default=False, output_field=models.BooleanField())
+        return self.annotate(**aggregates).annotate(**done)
+
+    def level_data(self, *fields):
+        """Returns a values queryset, with a dict for each Student, from a single query grouped by Student.
+            Each dict has 'pk', any given fields, and the level_aggregates results as used by Student.level_from_data.
+        """
+        return self.order_by('pk').values('pk', *fields).annotate(**self.level_aggregates())
+
+    def compute_levels(self):
+        """Returns a dict of Student pk: computed level, for all Students in the queryset, using a single query. """
+        return {data['pk']: self.model.level_from_data(data) for data in self.level_data()}
+
+    def update_levels(self, batch_size=1000):
+        """Compute and store the level for all Students in the queryset. Returns the count of changed records. """
+        pks = list(self.order_by('pk').values_list('pk', flat=True))
+        count = 0
+        for i in range(0, len(pks), batch_size):
+            changed = {}
+            for data in self.model.objects.filter(pk__in=pks[i:i + batch_size]).level_data('level'):
+                level = int(self.model.level_from_data(data))
+                if level != data['level']:
+                    changed.setdefault(level, []).append(data['pk'])
+            for level, ids in changed.items():
+                count += self.model.objects.filter(pk__in=ids).update(level=level)
+        return count
+
+
+class StudentManager(models.Manager):
+    def get_queryset(self): return StudentQuerySet(self.model, using=self._db)
+    def with_level_data(self): return self.get_queryset().with_level_data()
+    def level_data(self, *fields): return self.get_queryset().level_data(*fields)
+    def compute_levels(self): return self.get_queryset().compute_levels()
+    def update_levels(self, batch_size=1000): return self.get_queryset().update_levels(batch_size=batch_size)
+
+
 class Student(AbstractProfile):
     """A profile model appropriate for Student users. """
+    # Each stage is (row in Subject.LEVEL_CHOICES, ver_map). A ver_map of None counts each version except 'N'.
+    # TODO: Allow this mapping logic to be created by admin or in settings.
+    LEVEL_STAGES = {
+        'beg': (0, {'A': ('A', 'C'), 'B': ('B', 'D')}),
+        'l2': (1, None),
+        'l3': (2, None),
+        }
 
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True,
                                 limit_choices_to={'is_student': True})
@@ -891,6 +1285,8 @@ class Student(AbstractProfile):
     # TODO: The following properties could be extracted further to allow the program admin user
     # to set their own rules for number of versions needed and other version translation decisions.
 
+    objects = StudentManager()
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         # self._meta.get_field('user').limit_choices_to = Q(is_student=True)  # {'is_student': True}
@@ -914,9 +1310,8 @@ class Student(AbstractProfile):
     @property
     def beg(self):
         """Completed the two versions of Beginning. """
-        # TODO: Allow this mapping logic to be created by admin or in settings.
-        ver_map = {'A': ['A', 'C'], 'B': ['B', 'D']}
-        goal, data, extra = self.subject_data(level=0, each_ver=1, ver_map=ver_map)
+        level, ver_map = self.LEVEL_STAGES['beg']
+        goal, data, extra = self.subject_data(level=level, each_ver=1, ver_map=ver_map)
         return extra
 
     @property
@@ -1024,17 +1419,44 @@ class Student(AbstractProfile):
         extra['done'] = True
         return goal, data, extra
 
-    def compute_level(self):
-        if self.taken.count() < 1:
+    @classmethod
+    def stage_ver_map(cls, stage):
+        """Returns a dict of key: versions, where a Subject of any of these versions counts toward that key. """
+        ver_map = cls.LEVEL_STAGES[stage][1]
+        if ver_map is None:
+            ver_map = {key: (key, ) for key, string in Subject.VERSION_CHOICES if key != 'N'}
+        return ver_map
+
+    @classmethod
+    def progress_from_data(cls, stage, data, each_ver=1):
+        """Returns the same 'extra' dict as the stage property (beg, l2, l3), but from a dict of level_data results.
+            Unlike subject_data, all keys are included even when the goal has not been reached.
+        """
+        extra = {key: data.get(f"{stage}_{key}", 0) - each_ver for key in cls.stage_ver_map(stage)}
+        extra['done'] = min(extra.values(), default=0) >= 0
+        return extra
+
+    @classmethod
+    def level_from_data(cls, data):
+        """Returns the computed level from a dict with the level_data results (or a Student with_level_data). """
+        if not isinstance(data, dict):
+            data = vars(data)
+        if not data.get('taken_count'):
             return 0
-        if self.l3.get('done'):
-            return 4 if min(self.l3.values(), default=0) > 0 else 3.5
-        if self.l2.get('done'):
-            return 3 if min(self.l2.values(), default=0) > 0 else 2.5
-        if self.beg.get('done'):
+        l3 = cls.progress_from_data('l3', data)
+        if l3['done']:
+            return 4 if min(l3.values(), default=0) > 0 else 3.5
+        l2 = cls.progress_from_data('l2', data)
+        if l2['done']:
+            return 3 if min(l2.values(), default=0) > 0 else 2.5
+        if cls.progress_from_data('beg', data)['done']:
             return 2
-        beg_count = self.taken.filter(subject__level=Subject.LEVEL_CHOICES[0][0]).count()
-        return 1 if beg_count > 0 else 0
+        return 1 if data.get('beg_count', 0) > 0 else 0
+
+    def compute_level(self):
+        """Returns the level computed from the classes taken, using a single query. """
+        data = Student.objects.filter(pk=self.pk).level_data().first() if self.pk else None
+        return self.level_from_data(data) if data else 0
 
     def get_absolute_url(self):
         return reverse("profile_student", kwargs={"id": self.user_id})
@@ -1045,6 +1467,78 @@ class Student(AbstractProfile):
         super().save(*args, **kwargs)
 
 
+SCHEDULE_VERSION_KEY = 'schedule_version'
+
+
+def schedule_version():
+    """Returns the current cache version for values, like the published Sessions and classes, based on the schedule.
+        Starts from a timestamp, so an evicted version key never makes previously stored values current again.
+    """
+    version = cache.get(SCHEDULE_VERSION_KEY)
+    if version is None:
+        cache.add(SCHEDULE_VERSION_KEY, int(time()), None)
+        version = cache.get(SCHEDULE_VERSION_KEY)
+    return version
+
+
+def bump_schedule_version():
+    """All cached values stored with a previous schedule_version are no longer used. """
+    try:
+        cache.incr(SCHEDULE_VERSION_KEY)
+    except ValueError:  # The key is not in the cache.
+        cache.add(SCHEDULE_VERSION_KEY, int(time()), None)
+
+
+@receiver(post_save, sender=Session)
+@receiver(post_delete, sender=Session)
+@receiver(post_save, sender=ClassOffer)
+@receiver(post_delete, sender=ClassOffer)
+@receiver(post_save, sender=Subject)
+@receiver(post_delete, sender=Subject)
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+@receiver(m2m_changed, sender=ClassOffer.teachers.through)
+@receiver(post_save, sender=SiteContent)
+@receiver(post_delete, sender=SiteContent)
+@receiver(post_delete, sender=Staff)
+def schedule_changed(sender, **kwargs):
+    """Changes that affect the published schedule. Bumped again on commit, in case it was cached before then. """
+    if kwargs.get('action', '').startswith('pre_'):
+        return  # Only the post_add, post_remove, and post_clear actions of m2m_changed are needed.
+    bump_schedule_version()
+    transaction.on_commit(bump_schedule_version)
+
+
+def loaded_values_changed(instance, names, update_fields=None):
+    """Returns True if any of the named fields of the saved instance differ from the values it was loaded with.
+        Also True if it was not loaded with them. Afterwards, the saved values are kept as the loaded ones.
+    """
+    if update_fields is not None and not set(names).intersection(update_fields):
+        return False
+    loaded = getattr(instance, '_loaded_values', None)
+    if loaded is None:
+        instance._loaded_values = loaded = {}
+    attnames = [instance._meta.get_field(name).attname for name in names]
+    changed = any(name not in loaded or loaded[name] != getattr(instance, name) for name in attnames)
+    loaded.update((name, getattr(instance, name)) for name in attnames)
+    return changed
+
+
+@receiver(post_save, sender=Staff)
+def staff_schedule_changed(sender, instance, created, update_fields=None, **kwargs):
+    """Staff are saved with each save of their user, including on login, so only some changes affect the schedule. """
+    if loaded_values_changed(instance, Staff.SCHEDULE_FIELDS, update_fields) or created:
+        schedule_changed(sender)
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def staff_user_schedule_changed(sender, instance, created, update_fields=None, **kwargs):
+    """The names of active staff are shown as the teachers of classes, and on the about us page. """
+    changed = loaded_values_changed(instance, ('first_name', 'last_name', 'is_active'), update_fields)
+    if changed and instance.is_staff and not created:
+        schedule_changed(sender)
+
+
 @receiver(post_save, sender=settings.AUTH_USER_MODEL)
 def create_or_update_user_profile(sender, instance, created, **kwargs):
     profile = None
@@ -1064,65 +1558,83 @@ def create_or_update_user_profile(sender, instance, created, **kwargs):
         # instance.profile = profile
 
 
+class PriceQuote:
+    """The prices for a list of ClassOffers, computed in Decimal, as used for the Payment of a class registration.
+        Usually made by 'ClassOffer.objects.quote', and 'select' gives the quote for some of them without any queries.
+    """
+
+    def __init__(self, classoffers, credit=0):
+        self.classoffers = list(classoffers)
+        self.credit = Decimal(credit or 0)
+        self.prices = {}
+        full_price, pre_pay_discount, multi_discount_list = Decimal(0), Decimal(0), []
+        for item in self.classoffers:
+            subject = item.subject
+            qualifies = getattr(subject, 'qualifies_as_multi_class_discount', False)
+            multi = subject.multiple_purchase_discount if qualifies else 0
+            self.prices[item.pk] = price = {'full_price': item.full_price, 'pre_discount': item.pre_discount,
+                                            'multi_discount': Decimal(multi)}
+            full_price += price['full_price']
+            pre_pay_discount += price['pre_discount']
+            multi_discount_list.append(price['multi_discount'])
+        multi_discount_list.sort()
+        self.full_price = full_price
+        self.pre_pay_discount = pre_pay_discount
+        self.multiple_purchase_discount = multi_discount_list[-2] if len(multi_discount_list) > 1 else Decimal(0)
+        self.credit_applied = self.credit if self.credit > 0 else Decimal(0)
+        self.full_total = full_price - self.multiple_purchase_discount - self.credit_applied
+        self.pre_total = self.full_total - pre_pay_discount
+        self.description = ''.join(str(item) + ', ' for item in self.classoffers)
+
+    def select(self, classoffers):
+        """Returns a PriceQuote for only the given ClassOffers, or their ids, out of the ones in this quote. """
+        ids = {str(getattr(ea, 'pk', ea)) for ea in classoffers}
+        return self.__class__([ea for ea in self.classoffers if str(ea.pk) in ids], credit=self.credit)
+
+    def payment_fields(self):
+        """The Payment field values for this quote. """
+        return {
+            'description': self.description,
+            'full_price': self.full_price,
+            'pre_pay_discount': self.pre_pay_discount,
+            'multiple_purchase_discount': self.multiple_purchase_discount,
+            'credit_applied': self.credit_applied,
+            'total': self.pre_total,
+            }
+
+    def as_dict(self):
+        """The totals and per-class prices, as strings, such as for a price preview on the register page. """
+        totals = ('full_price', 'pre_pay_discount', 'multiple_purchase_discount', 'credit_applied', 'full_total',
+                  'pre_total')
+        data = {key: str(getattr(self, key)) for key in totals}
+        data['classes'] = {pk: {key: str(value) for key, value in price.items()} for pk, price in self.prices.items()}
+        return data
+
+    def __len__(self):
+        return len(self.classoffers)
+
+    def __repr__(self):
+        return f"<PriceQuote: {len(self)} class(es) | {self.pre_total} >"
+
+
 class PaymentManager(models.Manager):
 
     def classRegister(self, register=None, student=None, paid_by=None, **extra_fields):
-        """Used for students registering for classoffers, which is the most common usage of our payments """
-        print("===== Payment.objects.classRegister (PaymentManager) ======")
+        """Used for students registering for classoffers, which is the most common usage of our payments.
+            The register can be a PriceQuote, otherwise it is the ClassOffers, or their ids, to get a quote for.
+        """
         if not isinstance(student, Student):
             raise TypeError('We need a user Student profile passed here.')
-        print(student)
-
-        full_price, pre_pay_discount, credit_applied = 0, 0, 0
-        description = ''
-        multi_discount_list = []
-        register = register if isinstance(register, list) else list(register)
-        # line_items = []
-        for item in register:
-            # This could be stored in Registration, or get from ClassOffer
-            # purchased = PurchasedItem(name=str(item), sku=str(item), quantity=1,
-            #                           price=item.full_price, currency='USD')
-            # line_items.append(purchased)
-            description = description + str(item) + ', '
-            # TODO: DONE? Change to look up the actual class prices & discount
-            full_price += item.full_price
-            pre_pay_discount += item.pre_discount
-            multi_discount_list.append(item.multi_discount)
-        # TODO: DONE? Change multiple_discount amount to not be hard-coded.
-        multi_discount_list.sort()
-        multiple_purchase_discount = multi_discount_list[-2] if len(multi_discount_list) > 1 else 0
-        if student.credit > 0:
-            credit_applied = student.credit
-            # TODO: Remove the used credit from the student profile
-            # student.credit_applied = 0
-            # student.save()
-        full_total = full_price - multiple_purchase_discount - credit_applied
-        pre_total = full_total - pre_pay_discount
+        quote = register if isinstance(register, PriceQuote) else ClassOffer.objects.quote(register, student)
+        # TODO: Remove the used credit from the student profile
         # TODO: Insert logic to determine if they owe full_total or pre_total
         paid_by = paid_by if paid_by else student
         user = paid_by.user
         # TODO: If billing address info added to user Student profile, let
         # Payment.objects.classRegister get that info from user profile
-
-        # print("------ Check some pricing processesing ")
-        # print(full_price)
-        # print(multiple_purchase_discount)
-        # print(credit_applied)
-        # print('----------')
-        # print(full_total)
-        # print(pre_pay_discount)
-        # print('----------')
-        # print(pre_total)
-        # print('-=-=-=-=-=-=-=-=-=-=-=-')
         payment_kwargs = dict(
             student=student,
             paid_by=paid_by,
-            description=description,
-            full_price=full_price,
-            pre_pay_discount=pre_pay_discount,
-            multiple_purchase_discount=multiple_purchase_discount,
-            credit_applied=credit_applied,
-            total=Decimal(pre_total),
             tax=Decimal(0),
             billing_first_name=user.first_name,
             billing_last_name=user.last_name,
@@ -1132,15 +1644,14 @@ class PaymentManager(models.Manager):
             # TODO: Capture and use _ip_address
             variant='paypal',
             currency='USD',
-            # items_list=register,
+            **quote.payment_fields(),
             )
         payment_kwargs.update(extra_fields)
-        payment = self.create(payment_kwargs)
+        with log_event(logger, 'payment_class_register', student=student.pk, classes=len(quote)) as fields:
+            payment = self.create(**payment_kwargs)
+            fields.update(payment=payment.pk, total=payment.total)
         # TODO; Do we really feel safe passing forward the extra_fields?
         # TODO: Do we need customer_ip_address, and if yes, need to populate now?
-        print(payment)
-        print("==============----------===========")
-        # print(payment.items)
         return payment
     # end class PaymentManager
 
@@ -1212,21 +1723,18 @@ class Payment(BasePayment):
     # captured_amount = models.DecimalField(max_digits=9, decimal_places=2, default='0.0')
 
     def get_failure_url(self):
-        print('============ Payment.get_failure_url =================')
         return reverse('payment_fail', args=(self.pk,))
 
     def get_success_url(self):
-        print('============ Payment.get_success_url =================')
         return reverse('payment_success', args=(self.pk,))
 
     def get_done_url(self):
-        print('============ Payment.get_success_url =================')
         return reverse('payment_done', args=(self.pk,))
 
     def get_purchased_items(self):
         # TODO: Write this method.
         # you'll probably want to retrieve these from an associated order
-        print('====== Payment.get_purchased_items ===========')
+        logger.debug("Payment.get_purchased_items for payment %s", self.pk)
         # registrations = Registration.objects.filter(payment=self.id)
         # items, multi_discount_list, pre_pay_total = [], [], 0
         # for ea in registrations:
@@ -1280,6 +1788,9 @@ class Registration(models.Model):
     payment = models.ForeignKey(Payment, on_delete=models.SET_NULL, null=True, blank=True, )
     paid = models.BooleanField(default=False, )
 
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['student', 'classoffer'], name='unique_registration'), ]
+
     @property
     def owed(self):
         """How much is owed by this student currently in this classoffer. """
@@ -1290,6 +1801,18 @@ class Registration(models.Model):
             owed = self.payment.full_total - self.payment.captured_amount
         return owed
 
+    @staticmethod
+    def owed_expression(prefix=''):
+        """The 'owed' property computed by the database. The prefix is the lookup path from the queried model. """
+        pay = prefix + 'payment__'
+        balance = F(pay + 'total') - F(pay + 'captured_amount')
+        full_balance = F(pay + 'full_price') - F(pay + 'multiple_purchase_discount') - F(pay + 'credit_applied')
+        return Case(
+            When(**{pay + 'isnull': True}, then=0),
+            When(**{pay + 'total__gt': F(pay + 'captured_amount')}, then=full_balance - F(pay + 'captured_amount')),
+            default=balance,
+            output_field=models.DecimalField(max_digits=9, decimal_places=2))
+
     @property
     def first_name(self):
         return self.student.user.first_name
@@ -1378,16 +1901,182 @@ def resource_filepath(instance, filename):
     return path
 
 
+class EmailOutboxManager(models.Manager):
+
+    def enqueue(self, subject, body, to, from_email=None, **kwargs):
+        """Store an email to be sent later by the 'send_outbox' management command. Returns the EmailOutbox.
+            When called inside a transaction, the email is only stored, and later sent, if that transaction commits.
+        """
+        to = [to] if isinstance(to, str) else list(to)
+        from_email = from_email or settings.DEFAULT_FROM_EMAIL
+        return self.create(subject=subject, body=body, to=', '.join(to), from_email=from_email, **kwargs)
+
+    def due(self, now=None, pks=None):
+        """The pending emails ready to send at the given datetime (default now), oldest first. If given a list of
+            primary keys, only the due emails among them.
+        """
+        now = now or timezone.now()
+        queryset = self.get_queryset().filter(status=self.model.PENDING, send_after__lte=now)
+        if pks is not None:
+            queryset = queryset.filter(pk__in=pks)
+        return queryset.order_by('send_after', 'pk')
+
+    def claim(self, batch_size, now=None, pks=None):
+        """Claims up to 'batch_size' due emails by moving their 'send_after' forward by EMAIL_OUTBOX_CLAIM_SECONDS.
+            Done in a short transaction, locked with 'select_for_update(skip_locked=True)' when supported, so other
+            workers skip them. If this worker stops, those it did not send are due again once the claim expires.
+        """
+        now = now or timezone.now()
+        with transaction.atomic():
+            batch = list(self.due(now=now, pks=pks).select_for_update(skip_locked=True)[:batch_size])
+            if batch:
+                claimed_until = now + timedelta(seconds=settings.EMAIL_OUTBOX_CLAIM_SECONDS)
+                self.filter(pk__in=[outbox.pk for outbox in batch]).update(send_after=claimed_until)
+                for outbox in batch:
+                    outbox.send_after = claimed_until
+        return batch
+
+    def send_due(self, batch_size=None, max_attempts=None, rate=None, pks=None):
+        """Send the due emails in claimed batches, each over one connection, saving the result of each as it is sent.
+            Sends no more than 'rate' emails per second (default EMAIL_OUTBOX_RATE, 0 for no limit). No transaction is
+            held open while sending. If given a list of primary keys, only those are sent. Returns the counts of
+            (sent, not sent).
+        """
+        batch_size = batch_size or settings.EMAIL_OUTBOX_BATCH_SIZE
+        rate = settings.EMAIL_OUTBOX_RATE if rate is None else rate
+        sent, unsent, start = 0, 0, perf_counter()
+        while True:
+            batch = self.claim(batch_size, pks=pks)
+            if not batch:
+                return sent, unsent
+            connection = get_connection()
+            with suppress(Exception):  # If it can not be opened now, each send attempt records the error.
+                connection.open()
+            try:
+                for outbox in batch:
+                    wait = start + (sent + unsent) / rate - perf_counter() if rate else 0
+                    if wait > 0:
+                        sleep(wait)
+                    if outbox.send(connection=connection, max_attempts=max_attempts):
+                        sent += 1
+                    else:
+                        unsent += 1
+            finally:
+                connection.close()
+            if len(batch) < batch_size:
+                return sent, unsent
+
+
+class EmailOutbox(models.Model):
+    """An email waiting to be sent, or the record of one that was sent or has failed.
+        Stored in the same transaction as the records it is about, then sent by the 'send_outbox' management command.
+    """
+    PENDING, SENT, FAILED = 'P', 'S', 'F'
+    STATUS_CHOICES = ((PENDING, _('Pending')), (SENT, _('Sent')), (FAILED, _('Failed')), )
+    STATUS_FIELDS = ('status', 'attempts', 'send_after', 'sent_at', 'last_error', )
+    subject = models.CharField(max_length=191, )
+    body = models.TextField()
+    from_email = models.CharField(max_length=191, )
+    to = models.TextField(help_text=_('Comma separated email addresses. '), )
+    status = models.CharField(max_length=1, choices=STATUS_CHOICES, default=PENDING, )
+    attempts = models.PositiveSmallIntegerField(default=0, )
+    send_after = models.DateTimeField(default=timezone.now, help_text=_('Not sent before this time. '), )
+    sent_at = models.DateTimeField(null=True, blank=True, )
+    last_error = models.TextField(blank=True, default='', )
+    date_added = models.DateTimeField(auto_now_add=True, )
+    objects = EmailOutboxManager()
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'send_after'], name='outbox_due_idx'), ]
+
+    @property
+    def recipients(self):
+        return [ea.strip() for ea in self.to.split(',') if ea.strip()]
+
+    def as_message(self, connection=None):
+        return EmailMessage(self.subject, self.body, self.from_email, self.recipients, connection=connection)
+
+    def retry_delay(self):
+        """Time to wait before the next attempt, which doubles after each failed attempt. """
+        return timedelta(seconds=settings.EMAIL_OUTBOX_RETRY_DELAY * 2 ** max(0, self.attempts - 1))
+
+    def send(self, connection=None, max_attempts=None):
+        """Send the email, and save the result. Returns True if it was sent.
+            A failed attempt is retried after the retry_delay, unless it has reached max_attempts and is marked failed.
+        """
+        max_attempts = max_attempts or settings.EMAIL_OUTBOX_MAX_ATTEMPTS
+        self.attempts += 1
+        try:
+            self.as_message(connection=connection).send()
+        except Exception as e:
+            self.last_error = f"{e.__class__.__name__}: {e}"
+            if self.attempts >= max_attempts:
+                self.status = self.FAILED
+            else:
+                self.send_after = timezone.now() + self.retry_delay()
+            logger.warning("EmailOutbox %s attempt %d failed: %s", self.pk, self.attempts, self.last_error)
+        else:
+            self.status, self.sent_at, self.last_error = self.SENT, timezone.now(), ''
+        self.save(update_fields=self.STATUS_FIELDS)
+        return self.status == self.SENT
+
+    def __str__(self):
+        return f"{self.get_status_display()}: {self.subject} to {self.to}"
+
+    def __repr__(self):
+        return f"<EmailOutbox: {self.pk} | {self.get_status_display()} | {self.subject} >"
+
+
 class Notify(EmailMessage):
     """Usually used for sending emails, or other communcation methods, to users. """
+    announce_template = 'classwork/email_announcement.txt'
 
     @classmethod
-    def register(cls, selected=None, student=None, paid_by=None, **kwargs):
-        """This is for when a user is registered for a ClassOffer. """
-        from django.core.mail import send_mail
-        from pprint import pprint
+    def announce(cls, subject, message='', session=None, classoffer=None, template_name=None, context=None,
+                 from_email=None, send=False):
+        """Queue an email, rendered from the template, for each Student registered in the ClassOffer or Session.
+            The template context has the 'student', their 'classoffers' in the ClassOffer or Session, 'session',
+            'classoffer', 'message', and 'business_name', updated with the given context. With send=True the emails
+            queued here are sent now, otherwise by the 'send_outbox' management command. Returns the queued
+            EmailOutboxes. Sending is done over one connection for each batch, and recorded in each EmailOutbox.status.
+        """
+        if not session and not classoffer:
+            raise ValueError(_("Either a Session or a ClassOffer is needed for an announcement. "))
+        registrations = Registration.objects.filter(student__isnull=False)
+        if classoffer:
+            registrations = registrations.filter(classoffer=classoffer)
+        else:
+            registrations = registrations.filter(classoffer__session=session)
+        registrations = registrations.select_related('student__user', 'classoffer__subject', 'classoffer__session')
+        registrations = registrations.order_by('student__user__first_name', 'student', 'classoffer__start_time')
+        students = {}
+        for reg in registrations:
+            students.setdefault(reg.student, []).append(reg.classoffer)
+        template = get_template(template_name or cls.announce_template)
+        from_email = from_email or settings.DEFAULT_FROM_EMAIL
+        base = {'session': session, 'classoffer': classoffer, 'message': message}
+        base['business_name'] = settings.BUSINESS_NAME
+        outboxes = []
+        for student, classoffers in students.items():
+            if not student.user.email:
+                continue
+            data = dict(base, student=student, classoffers=classoffers, **(context or {}))
+            body = template.render(data)
+            outboxes.append(EmailOutbox(subject=subject, body=body, to=student.user.email, from_email=from_email))
+        with log_event(logger, 'notify_announce', recipients=len(outboxes), send=send) as fields:
+            if send and not connections[EmailOutbox.objects.db].features.can_return_rows_from_bulk_insert:
+                for outbox in outboxes:  # Only these are sent, so their primary keys are needed.
+                    outbox.save()
+            else:
+                outboxes = EmailOutbox.objects.bulk_create(outboxes, batch_size=500)
+            if send:
+                pks = [outbox.pk for outbox in outboxes]
+                fields['sent'], fields['unsent'] = EmailOutbox.objects.send_due(pks=pks)
+        return outboxes
 
-        print("========== Notify.register ==============")
+    @classmethod
+    def register(cls, selected=None, student=None, paid_by=None, **kwargs):
+        """This is for when a user is registered for a ClassOffer. Returns the queued EmailOutbox, or False. """
         if not student and not paid_by:
             # TODO: raise error or other catch
             return False
@@ -1401,21 +2090,12 @@ class Notify(EmailMessage):
         class_list = [str(ea) for ea in selected]
         purchase_list = ', '.join(class_list)
         body = f"You signed up {student} to attend {purchase_list}"
-        pprint({
-            "***send_email***": "============================",
-            "subject": subject,
-            "body": body,
-            "from_email": from_email,
-            "to_email": to_email
-        })
-        mail_sent = 0
-        try:
-            mail_sent = send_mail(subject, body, from_email, [to_email])
-        except Exception as e:
-            print("Send Mail Error", e)
-        # instantiate a new Notify to send an email
-        print(f"Mail Sent: {mail_sent}")
-        return mail_sent
+        logger.debug("Notify.register email to %s with subject %r: %s", to_email, subject, body)
+        student_id = getattr(student, 'pk', None)
+        with log_event(logger, 'notify_register', student=student_id, classes=len(class_list)) as fields:
+            outbox = EmailOutbox.objects.enqueue(subject, body, [to_email], from_email=from_email)
+            fields['outbox'] = outbox.pk
+        return outbox
 
 
 # end models.py
@@ -1,6 +1,4 @@
-from django.views.generic import ListView, FormView, CreateView, DetailView, UpdateView
-from django.views.generic.edit import BaseUpdateView, BaseCreateView, FormMixin, ProcessFormView
-from django.views.generic.list import MultipleObjectMixin, MultipleObjectTemplateResponseMixin
+from django.views.generic import CreateView
 
 
 class TempCreateView(CreateView):
@@ -138,95 +136,6 @@ class TempCreateView(CreateView):
     # end class TempCreateView
 
 
-class CreateMany(
-    MultipleObjectTemplateResponseMixin,
-    FormMixin,
-    MultipleObjectMixin,
-    ProcessFormView
-    ):
-    """Sometimes we want to allow the creation of many records/objects.
-        Sometimes we will want to edit mulitiple records/objects.
-        Sometimes we will want to update or create if they do not exist.
-        This is going to be a lot like the default Django UpdateView,
-        but will use MultipleObject instead of SingleObject versions of mixins
-
-        CreateView Process we will mimic:
-        SingleObjectTemplateResponseMixin => MultipleObjectTemplateResponseMixin
-            TemplateResponseMixin
-        BaseCreateView:
-            ModelFormMixin
-                FormMixin
-                    ContextMixin
-                SingleObjectMixin => MultipleObjectMixin
-                    ContextMixin
-            ProcessFormView
-                View
-    """
-    from django.core.exceptions import ImproperlyConfigured
-    from django.forms import models as model_forms
-
-    object_list = None  # MultipleObjectMixin looks for this
-    template_name_suffix = '_form'  # Matches the normal CreateView
-    fields = None  # Matches ModelForm Mixin
-
-    def get_form_class(self):  # Matches ModelForm Mixin
-        """Return the form class to use in this view."""
-        if self.fields is not None and self.form_class:
-            raise ImproperlyConfigured(
-                "Specifying both 'fields' and 'form_class' is not permitted."
-            )
-        if self.form_class:
-            return self.form_class
-        else:
-            if self.model is not None:
-                # If a model has been explicitly provided, use it
-                model = self.model
-            elif getattr(self, 'object', None) is not None:
-                # If this view is operating on a single object, use
-                # the class of that object
-                model = self.object.__class__
-            else:
-                # Try to get a queryset and extract the model class
-                # from that
-                model = self.get_queryset().model
-
-            if self.fields is None:
-                raise ImproperlyConfigured(
-                    "Using ModelFormMixin (base class of %s) without "
-                    "the 'fields' attribute is prohibited." % self.__class__.__name__
-                )
-
-            return model_forms.modelform_factory(model, fields=self.fields)
-
-    def get_form_kwargs(self):  # Matches ModelForm Mixin
-        """Return the keyword arguments for instantiating the form."""
-        kwargs = super().get_form_kwargs()
-        if hasattr(self, 'object'):
-            kwargs.update({'instance': self.object})
-        return kwargs
-
-    def get_success_url(self):  # Matches ModelForm Mixin
-        """Return the URL to redirect to after processing a valid form."""
-        if self.success_url:
-            url = self.success_url.format(**self.object.__dict__)
-        else:
-            try:
-                url = self.object.get_absolute_url()
-            except AttributeError:
-                raise ImproperlyConfigured(
-                    "No URL to redirect to.  Either provide a url or define"
-                    " a get_absolute_url method on the Model.")
-        return url
-
-    def form_valid(self, form):  # Matches ModelForm Mixin
-        """If the form is valid, save the associated model."""
-        self.object = form.save()
-        return super().form_valid(form)
-
-    #  end class CreateMany
-
-
-
 # USEFUL CODE SNIPPET:
 # for attr in dir(Registration):
 #     print("self.%s = %r" % (attr, getattr(self, attr)))
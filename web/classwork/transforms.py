@@ -1,71 +1,119 @@
-from django.db.models import DateField, DateTimeField, SmallIntegerField, PositiveIntegerField, IntegerField, Transform
-# from django.db.models import F, Func
+from django.db import NotSupportedError
+from django.db.models import DateField, DateTimeField, SmallIntegerField, PositiveIntegerField, IntegerField
+from django.db.models import Func, Transform
 
 
-class AddDate(Transform):
+class DateFunc(Func):
+    """Date functions compiled with the SQL template for the database vendor: MySQL, SQLite, or PostgreSQL.
+        Each template has a '{}' placeholder for each compiled argument, used once and in the same order.
+        A literal '%' in a template must be escaped as '%%', as it is for all SQL with parameters.
+    """
+    mysql_template = None
+    sqlite_template = None
+    postgresql_template = None
+
+    def compile_template(self, template, compiler, connection):
+        if template is None:
+            message = f"{self.__class__.__name__} is not supported on the {connection.vendor} database backend. "
+            raise NotSupportedError(message)
+        sql_parts, params = [], []
+        for arg in self.get_source_expressions():
+            arg_sql, arg_params = compiler.compile(arg)
+            sql_parts.append(arg_sql)
+            params.extend(arg_params)
+        return template.format(*sql_parts), params
+
+    def as_sql(self, compiler, connection, **extra_context):
+        return self.compile_template(self.mysql_template, compiler, connection)
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        return self.compile_template(self.mysql_template, compiler, connection)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.compile_template(self.sqlite_template, compiler, connection)
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.compile_template(self.postgresql_template, compiler, connection)
+
+
+class AddDate(DateFunc):
     """date1: Date, days: int -> Date. Returns a date that is number of days (+ or -) from given the initial date. """
-    lookup_name = 'adddate'
-    function = 'ADDDATE'
+    arity = 2
+    mysql_template = 'ADDDATE({}, {})'
+    sqlite_template = 'DATE(JULIANDAY({}) + {})'
+    postgresql_template = '(({})::date + ({})::integer)'
 
     @property
     def output_field(self):
         return DateField()
 
 
-class DateDiff(Transform):
-    """date1: Date, date2: Date -> int. Returns the number of days between two given dates. """
-    lookup_name = 'numday'
-    function = 'DATEDIFF'
+class DateDiff(DateFunc):
+    """date1: Date, date2: Date -> int. Returns the number of days from date2 until date1 (date1 - date2). """
+    arity = 2
+    mysql_template = 'DATEDIFF({}, {})'
+    sqlite_template = 'CAST(JULIANDAY(DATE({})) - JULIANDAY(DATE({})) AS INTEGER)'
+    postgresql_template = '(({})::date - ({})::date)'
 
     @property
     def output_field(self):
         return SmallIntegerField()  # Good enough for just over plus-or-minus 89 year difference in days.
 
 
-class DayYear(Transform):
+class DayYear(DateFunc, Transform):
     """date1: Date -> int. Returns a number 1 to 366 as the day of the year for the given date or datetime input. """
     lookup_name = 'dayyear'
-    function = 'DAYOFYEAR'
+    mysql_template = 'DAYOFYEAR({})'
+    sqlite_template = "CAST(STRFTIME('%%j', {}) AS INTEGER)"
+    postgresql_template = 'CAST(EXTRACT(DOY FROM {}) AS INTEGER)'
 
     @property
     def output_field(self):
         return SmallIntegerField()
 
 
-class NumDay(Transform):
+class NumDay(DateFunc, Transform):
     """date1: Date -> int. Returns number of days since 0 date ('0000-00-00') for the given date or datetime input. """
     lookup_name = 'numday'
-    function = 'TO_DAYS'
+    mysql_template = 'TO_DAYS({})'  # MySQL counts year 0 as a leap year, so TO_DAYS('0001-01-01') is 366.
+    sqlite_template = "(CAST(JULIANDAY(DATE({})) - JULIANDAY('0001-01-01') AS INTEGER) + 366)"
+    postgresql_template = "(({})::date - DATE '0001-01-01' + 366)"
 
     @property
     def output_field(self):
         return PositiveIntegerField()
 
 
-class DateFromNum(Transform):
+class DateFromNum(DateFunc, Transform):
     """Given a number of days since 0 date ('0000-00-00'), returns a date. The opposite of 'numday'. """
     lookup_name = 'datefromnum'
-    function = 'FROM_DAYS'
+    mysql_template = 'FROM_DAYS({})'
+    sqlite_template = "DATE(JULIANDAY('0001-01-01') + {} - 366)"
+    postgresql_template = "(DATE '0001-01-01' + ({})::integer - 366)"
 
     @property
     def output_field(self):
         return DateField()
 
 
-class MakeDate(Transform):
+class MakeDate(DateFunc):
     """year: int, day: int -> Date. Returns a Date for the given 4-digit year and day integer (1 to 366). """
-    lookup_name = 'makedate'
-    function = 'MAKEDATE'
+    arity = 2
+    mysql_template = 'MAKEDATE({}, {})'
+    sqlite_template = "DATE(JULIANDAY(PRINTF('%%04d-01-01', {})) + {} - 1)"
+    postgresql_template = '(MAKE_DATE(({})::integer, 1, 1) + ({})::integer - 1)'
 
     @property
     def output_field(self):
         return DateField()
 
 
-class DateToday(Transform):
+class DateToday(DateFunc):
     """Returns the date portion, without any information about the time, of the current day. """
-    lookup_name = 'today'
-    function = 'CURDATE'
+    arity = 0
+    mysql_template = 'CURDATE()'
+    sqlite_template = "DATE('now', 'localtime')"
+    postgresql_template = 'CURRENT_DATE'
 
     @property
     def output_field(self):
@@ -80,10 +128,6 @@ class StartClassDate(Transform):
         return DateField()
 
 
-DateField.register_lookup(AddDate)
-DateTimeField.register_lookup(AddDate)
-DateField.register_lookup(DateDiff)
-DateTimeField.register_lookup(DateDiff)
 DateField.register_lookup(DayYear)
 DateTimeField.register_lookup(DayYear)
 DateField.register_lookup(NumDay)
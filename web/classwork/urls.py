@@ -6,6 +6,7 @@ from .views import (AboutUsListView, ResourceDetailView,
                     Checkin, RegisterView, ProfileView,
                     PaymentProcessView, payment_details,
                     )
+from .bulk_views import SessionCreateMany, ClassOfferCreateMany, ResourceCreateMany
 minute = 3  # Number of seconds in a minute.
 # SubjectCreateView, SessionCreateView, ClassOfferCreateView,
 urlpatterns = [  # All following are in root
@@ -29,4 +30,7 @@ urlpatterns = [  # All following are in root
      path('profile/<int:id>', ProfileView.as_view(), name='profile_user'),  # profile_type='profile'
      path('profile/', ProfileView.as_view(), name='profile_page'),
      path('resource/<int:id>', ResourceDetailView.as_view(), name='resource_detail'),
+     path('classes/many/<str:display_session>', ClassOfferCreateMany.as_view(), name='classoffer_many'),
+     path('session/many/', SessionCreateMany.as_view(), name='session_many'),
+     path('resource/many/', ResourceCreateMany.as_view(), name='resource_many'),
  ]
@@ -5,21 +5,118 @@ from payments import get_payment_model, RedirectNeeded  # used for Payments
 # from django.core.cache import caches  # This is not correct.
 from django.core.cache import cache
 # from django.views.decorators.cache import cache_page
+from django.views.decorators.http import condition
 # from django.views.decorators.vary import vary_on_cookie, vary_on_headers
-# from django.utils.decorators import method_decorator
+from django.utils.decorators import method_decorator
+from django.http import HttpResponse
 from django.urls import reverse_lazy
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
+from django.db.models import Prefetch, Max
 from django.core.exceptions import ObjectDoesNotExist  # , PermissionDenied
 from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import UserPassesTestMixin  # , LoginRequiredMixin
 # from django.contrib.admin.views.decorators import staff_member_required  # TODO: Add decorator to needed views.
 from .forms import RegisterForm, PaymentForm
 from .models import (SiteContent, Resource, Location, ClassOffer, Subject,  # ? Session, Student
-                     Staff, Payment, Registration, Session)
-from datetime import datetime as dt
+                     Staff, Payment, Session, schedule_version)
+from .logs import log_event
+from datetime import date, datetime as dt
+from functools import wraps
+from hashlib import md5
+import logging
 # from pprint import pprint
 User = get_user_model()
+logger = logging.getLogger(__name__)
+SCHEDULE_PAGE_MODELS = (Session, ClassOffer, Subject, Location, Staff, SiteContent)
+SCHEDULE_PAGE_TIMEOUT = 60 * 60 * 24  # one day, as the current Sessions also depend on the date.
+
+
+def model_values(obj):
+    """Returns a tuple of the concrete field values for a model instance, or None if there is no instance. """
+    if obj is None:
+        return None
+    return tuple(getattr(obj, field.attname) for field in obj._meta.concrete_fields)
+
+
+def model_from_values(model, values):
+    """Returns a model instance, as if loaded from the database, from the model_values result. """
+    if values is None:
+        return None
+    return model.from_db(model.objects.db, [field.attname for field in model._meta.concrete_fields], values)
+
+
+def schedule_last_modified(version=None):
+    """Returns the latest 'date_modified' for the models shown on the schedule pages, cached with schedule_version. """
+    version = version or schedule_version()
+    latest = cache.get('schedule_last_modified', version=version)
+    if latest is None:
+        dates = [model.objects.aggregate(latest=Max('date_modified'))['latest'] for model in SCHEDULE_PAGE_MODELS]
+        latest = max((ea for ea in dates if ea), default=date.min)
+        cache.set('schedule_last_modified', latest, SCHEDULE_PAGE_TIMEOUT, version=version)
+    return latest
+
+
+def schedule_page_variant(request):
+    """The rendered page differs for staff (template_admin) and other users, and the header differs by user. """
+    user = request.user
+    if not user.is_authenticated:
+        return 'public'
+    return f"{'staff' if user.is_staff else 'user'}_{user.pk}"
+
+
+def schedule_etag(request, *args, **kwargs):
+    """Changes with any schedule model change, the date (for the current Sessions), path, and page variant. """
+    values = (schedule_page_variant(request), request.get_full_path(), schedule_version(), date.today())
+    return md5(str(values).encode()).hexdigest()
+
+
+def schedule_last_modified_header(request, *args, **kwargs):
+    """The 'date_modified' fields only have a date, so an edit today could not be distinguished from an earlier
+        one on the same day. The Last-Modified header is only given when the latest edit was before today.
+    """
+    latest = schedule_last_modified()
+    if not latest or latest == date.min or latest >= date.today():
+        return None
+    return dt.combine(latest, dt.min.time())
+
+
+def cache_schedule_page(view_func):
+    """For anonymous users, the rendered page is cached until a schedule change (see schedule_version). """
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return view_func(request, *args, **kwargs)
+        version = schedule_version()
+        key_cache = 'schedule_page_' + md5(f"{request.get_full_path()}_{date.today()}".encode()).hexdigest()
+        content = cache.get(key_cache, version=version)
+        if content is not None:
+            return HttpResponse(content)
+        response = view_func(request, *args, **kwargs)
+        if callable(getattr(response, 'render', None)):
+            response = response.render()
+        if response.status_code == 200:
+            cache.set(key_cache, response.content, SCHEDULE_PAGE_TIMEOUT, version=version)
+        return response
+    return _wrapped_view
+
+
+schedule_page_cache = method_decorator(
+    [condition(etag_func=schedule_etag, last_modified_func=schedule_last_modified_header), cache_schedule_page],
+    name='dispatch')
+
+
+def schedule_cache_timeout(sessions, current=False, today=None):
+    """Seconds to cache values for the given Sessions. Model changes use a new schedule_version, not the timeout.
+        For the current Session(s), until it expires. For past Sessions one week, otherwise when it will expire.
+    """
+    today = today or dt.now().date()
+    end_date = sessions[0].expire_date
+    if not end_date:
+        return 60 * 15  # 15 minutes
+    elif current or end_date >= today:
+        return int((end_date - today).total_seconds())  # end when the session expires.
+    return 60 * 60 * 24 * 7  # one week
 
 
 def decide_session(sess=None, display_date=None, return_key=False):
@@ -35,7 +132,8 @@ def decide_session(sess=None, display_date=None, return_key=False):
     if display_date and sess:
         raise SyntaxError(_("You can't filter by both Session and Display Date"))
     key_cache = 'current_session' if not sess and not display_date else sess
-    data_cache = None if not key_cache else cache.get(key_cache)
+    version = schedule_version()
+    data_cache = None if not key_cache else cache.get(key_cache, version=version)
     if data_cache:
         return (data_cache, key_cache) if return_key else data_cache
     # Otherwise not in cache. Find it, add to cache (except if determining by display_date), and return the session.
@@ -58,15 +156,9 @@ def decide_session(sess=None, display_date=None, return_key=False):
             result = None
         sess_data = [result] if result else Session.objects.none()
     if key_cache and sess_data:  # Add to cache with expiration depending on session.
-        end_date = sess_data[0].expire_date  # Note: target is always today if we are adding to the cache.
-        if key_cache == 'current_session':
-            expire_in = end_date - target  # end when the session expires.
-            expire_in = int(expire_in.total_seconds())
-        elif end_date and end_date < target:
-            expire_in = 60 * 60 * 24 * 7  # one week
-        else:  # end_date >= today or end_date is None.
-            expire_in = 60 * 15  # 15 minutes
-        cache.set(key_cache, sess_data, expire_in)
+        # Note: target is always today if we are adding to the cache.
+        expire_in = schedule_cache_timeout(sess_data, current=key_cache == 'current_session', today=target)
+        cache.set(key_cache, sess_data, expire_in, version=version)
     if return_key:
         return sess_data, key_cache
     return sess_data  # a list of Session records, even if only 0-1 session
@@ -94,6 +186,7 @@ class ViewOnlyForTeacherOrAdminMixin(UserPassesTestMixin):
         return True
 
 
+@schedule_page_cache
 class AboutUsListView(ListView):
     """Display details about Business and Staff """
     template_name = 'classwork/aboutus.html'
@@ -119,6 +212,7 @@ class SubjectProgressView(ListView):
     context_object_name = 'levels'
 
 
+@schedule_page_cache
 class LocationListView(ListView):
     """Display all the Locations that we have stored """
     # TODO: Should we only list them if a published ClassOffer has them listed?
@@ -135,6 +229,7 @@ class LocationDetailView(DetailView):
     pk_url_kwarg = 'id'
 
 
+@schedule_page_cache
 class ClassOfferDetailView(DetailView):
     """Sometimes we want to show more details for a given class offering """
     template_name = 'classwork/classoffer_detail.html'
@@ -143,6 +238,7 @@ class ClassOfferDetailView(DetailView):
     pk_url_kwarg = 'id'
 
 
+@schedule_page_cache
 class ClassOfferListView(ListView):
     """We will want to list the classes that are scheduled to be offered. """
     template_name = 'classwork/classoffer_list.html'
@@ -154,41 +250,72 @@ class ClassOfferListView(ListView):
     query_order_by = ('session__key_day_date', '_num_level', )  # TODO: ? Refactor to Meta: ordering(...) ?
 
     def get_queryset(self):
-        """We can limit the classes list by session, what is published on a given date, or currently published. """
-        print("=============== ClassOfferListView.get_queryset ===============")
+        """We can limit the classes list by session, what is published on a given date, or currently published.
+            The cache stores the evaluated rows (see cache_rows). On a cache hit, a list of the ClassOffers is returned,
+            instead of a QuerySet, so nothing using it queries the database.
+        """
         display_session = self.kwargs.get('display_session', None)
         display_date = self.kwargs.get('display_date', None)
+        logger.debug("ClassOfferListView.get_queryset session=%s date=%s", display_session, display_date)
         if display_date and display_session:
             raise SyntaxError(_("You can't filter by both Session and Display Date"))
         key_cache = 'current_session' if not display_session and not display_date else display_session
         sessions, data_cache, sess_key = None, None, None
+        version = schedule_version()
         if key_cache:
-            sessions, data_cache = cache.get(f"{key_cache}_classes", (None, None))
-        if not sessions:
-            sessions, sess_key = decide_session(sess=display_session, display_date=display_date, return_key=True)
-        self.kwargs['sessions'] = sessions
+            data_cache = cache.get(f"{key_cache}_classes", None, version=version)
         if data_cache:
-            return data_cache
-        q = ClassOffer.objects.filter(session__in=sessions)
-        q = q.order_by(*self.query_order_by) if getattr(self, 'query_order_by', None) else q
-        q = q.select_related('subject', 'session', 'location').prefetch_related('teachers')
+            sessions, classoffers = self.from_cache_rows(*data_cache)
+            self.kwargs['sessions'] = sessions
+            return classoffers
+        sessions, sess_key = decide_session(sess=display_session, display_date=display_date, return_key=True)
+        self.kwargs['sessions'] = sessions
+        q = self.get_class_query(sessions)
+        for classoffer in q:
+            classoffer.teacher_names = [str(ea) for ea in classoffer.teachers.all()]
         if sess_key and key_cache and sessions:  # False if query by date or no current session,
-            end_date = sessions[0].expire_date
-            today = dt.now().date()
-            if key_cache == 'current_session':
-                expire_in = end_date - today  # end when the session expires.
-                expire_in = int(expire_in.total_seconds())
-            elif end_date and end_date < today:
-                expire_in = 60 * 60 * 24 * 7  # one week
-            else:  # end_date >= today or end_date is None.
-                expire_in = 60 * 15  # 15 minutes
-            q = q.all()
-            cache.set(f"{key_cache}_classes", (sessions, q), expire_in)
+            expire_in = schedule_cache_timeout(sessions, current=key_cache == 'current_session')
+            cache.set(f"{key_cache}_classes", self.cache_rows(sessions, q), expire_in, version=version)
         return q
 
+    def get_class_query(self, sessions):
+        q = ClassOffer.objects.filter(session__in=sessions)
+        q = q.order_by(*self.query_order_by) if getattr(self, 'query_order_by', None) else q
+        teachers = Prefetch('teachers', queryset=Staff.objects.select_related('user'))
+        return q.select_related('subject', 'session', 'location').prefetch_related(teachers)
+
+    @staticmethod
+    def cache_rows(sessions, classoffers):
+        """Returns a compact version of the Sessions and evaluated ClassOffers, with their subject, location, and
+            teacher names, for the cache. Only field values are stored, not model instances or QuerySets.
+        """
+        session_rows = [model_values(ea) for ea in sessions]
+        class_rows = [(model_values(ea), model_values(ea.subject), model_values(ea.location), ea.teacher_names)
+                      for ea in classoffers]
+        return session_rows, class_rows
+
+    @staticmethod
+    def from_cache_rows(session_rows, class_rows):
+        """Returns a list of Sessions and a list of ClassOffers, with related models, from the cache_rows result. """
+        sessions = [model_from_values(Session, row) for row in session_rows]
+        session_lookup = {ea.pk: ea for ea in sessions}
+        classoffers = []
+        for values, subject_values, location_values, teacher_names in class_rows:
+            classoffer = model_from_values(ClassOffer, values)
+            related = {
+                'subject': model_from_values(Subject, subject_values),
+                'location': model_from_values(Location, location_values),
+                'session': session_lookup.get(classoffer.session_id),
+                }
+            for name, obj in related.items():
+                ClassOffer._meta.get_field(name).set_cached_value(classoffer, obj)
+            classoffer.teacher_names = teacher_names
+            classoffers.append(classoffer)
+        return sessions, classoffers
+
     def get_context_data(self, **kwargs):
         """Get context of class list we are showing, typically currently published or modified by URL parameters """
-        print("=============== ClassOfferListView.get_context_data ===============")
+        logger.debug("ClassOfferListView.get_context_data")
         # pprint(cache)
         # print("----------------------------------------------------------------")
         # test_val = cache.get('test')
@@ -201,6 +328,7 @@ class ClassOfferListView(ListView):
         sessions = self.kwargs.pop('sessions', '')
         sessions = ', '.join(ea.name for ea in sessions)
         context['sessions'] = sessions
+        context['schedule_version'] = schedule_version()  # For the template fragment cache of the class list.
         if self.request.user.is_staff:
             admin_log = [sessions, self.kwargs.pop('display_session', 'None'), self.kwargs.pop('display_date', 'None')]
             context['admin_log'] = ' | '.join(admin_log)
@@ -215,23 +343,24 @@ class ClassOfferListView(ListView):
 class Checkin(ViewOnlyForTeacherOrAdminMixin, ListView):
     """This is a report for which students are in which classes. """
     group_required = ('teacher', 'admin', )
-    model = Registration  # context_object_name = 'object_list'
+    model = ClassOffer  # context_object_name = 'object_list'
     template_name = 'classwork/checkin.html'
     display_session = None  # 'all' or <start_month>_<year> as stored in DB Session.name
-    query_order_by = ('classoffer__session__key_day_date', '-classoffer__class_day', 'classoffer__start_time', )
+    query_order_by = ('session__key_day_date', '-class_day', 'start_time', )
     # TODO: ? Refactor to Meta: ordering(...) ?
 
     def get_queryset(self):
-        """List all the students from all the classes sorted according to the class property query_order_by.
-            Student list should be grouped in days, then in start_time order, and then alphabetical first name.
+        """List all the classes sorted according to the class property query_order_by, each with its roster.
+            The roster of Registrations is in alphabetical first name order, with the amount owed and class totals
+            computed by the database. The page is built from two queries, no matter how many students are listed.
         """
         display_session = self.kwargs.get('display_session', None)
         display_date = self.kwargs.get('display_date', None)
         sessions = decide_session(sess=display_session, display_date=display_date)
         self.kwargs['sessions'] = sessions
-        q = self.model.objects.filter(classoffer__session__in=sessions)
+        q = self.model.objects.filter(session__in=sessions)
         q = q.order_by(*self.query_order_by)
-        q = q.select_related('classoffer__subject', 'student', 'student__user', 'payment')
+        q = q.select_related('subject').with_roster()
         return q
 
     def get_context_data(self, **kwargs):
@@ -350,11 +479,16 @@ class RegisterView(CreateView):
     #     print('================ RegisterView.put =================')
     #     return super().put(*args, **kwargs)
 
-    # def get_context_data(self, **kwargs):
-    #     print('========== RegisterView.get_context_data =============')
-    #     context = super().get_context_data(**kwargs)
-    #     print(context)
-    #     return context
+    def get_context_data(self, **kwargs):
+        """Adds the 'price_quote' for all class choices, and 'price_preview' for any classes selected so far. """
+        context = super().get_context_data(**kwargs)
+        form = context['form']
+        student = getattr(self.request.user, 'student', None)
+        quote = ClassOffer.objects.quote(form.fields['class_selected'].queryset, student=student)
+        context['price_quote'] = quote
+        if form.is_bound:
+            context['price_preview'] = quote.select(form['class_selected'].value() or [])
+        return context
 
     # def get_form(self, form_class=None):
     #     # print('================ RegisterView.get_form =================')
@@ -413,11 +547,10 @@ class RegisterView(CreateView):
     #     return fv
 
     def get_success_url(self):
-        print('================ RegisterView.get_success_url =================')
         # TODO: We will need to adjust this later.
         # url = self.test_url + str(self.object.id)
         url = '../payment/' + str(self.object.id)
-        print(url)
+        logger.debug("RegisterView success url: %s", url)
         return url
 
     # Unsure after this one.
@@ -517,13 +650,13 @@ class PaymentProcessView(UpdateView):
 
 def payment_details(self, id):
     """The route for this function is called by django-payments after a registration is submitted. """
-    print('========== views function - payment_details ==============')
-    payment = get_object_or_404(get_payment_model(), id=id)
-    try:
-        form = payment.get_form(data=self.POST or None)
-    except RedirectNeeded as redirect_to:
-        print('---- payment_details redirected -------')
-        return redirect(str(redirect_to))
-    print('------ payment_details TemplateResponse ---------')
-    return TemplateResponse(self, 'payment/payment.html',
-                            {'form': form, 'payment': payment})
+    with log_event(logger, 'payment_details', payment=id, method=self.method) as fields:
+        payment = get_object_or_404(get_payment_model(), id=id)
+        try:
+            form = payment.get_form(data=self.POST or None)
+        except RedirectNeeded as redirect_to:
+            fields['redirect'] = True
+            return redirect(str(redirect_to))
+        fields['status'] = payment.status
+        return TemplateResponse(self, 'payment/payment.html',
+                                {'form': form, 'payment': payment})
@@ -0,0 +1,63 @@
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.http import QueryDict
+from time import perf_counter
+from classwork.forms import RegisterForm
+from classwork.models import ClassOffer
+from users.forms import CustomRegistrationForm
+from users.mixins import clear_layout_cache
+
+INVALID_POST = 'first_name=chris&last_name=&email=not-an-email'
+
+
+class Command(BaseCommand):
+    """Benchmark rendering the fieldset forms, as on a GET of the register page or after an invalid POST.
+        The 'before' column clears the cached layouts for every render, so the fieldsets, label widths, column
+        formats, and overrides are all computed again as they were before. The 'after' column uses the cache.
+    """
+    help = "Compare the per-render time of the fieldset forms when computing the layout each time to the cached one. "
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', '-n', type=int, default=200, metavar='count',
+                            help='Number of renders in each timed run. Default: 200. ')
+        parser.add_argument('--repeat', '-r', type=int, default=5, metavar='count',
+                            help='Number of timed runs, the best of which is reported. Default: 5. ')
+
+    def get_forms(self):
+        """Returns a dict of labels and functions returning a new form, as the views would create them. """
+        classes = ClassOffer.objects.none()
+        return {
+            'register GET': lambda: RegisterForm(class_choices=classes),
+            'register POST': lambda: RegisterForm(data=QueryDict(INVALID_POST), class_choices=classes,
+                                                  initial={'user': AnonymousUser()}),
+            'signup GET': lambda: CustomRegistrationForm(),
+        }
+
+    def per_render(self, make_form, number, repeat, cached):
+        """Returns the best time in milliseconds to render a form. Creating and cleaning the forms is not timed. """
+        best = None
+        for _ in range(repeat):
+            forms = [make_form() for _ in range(number)]
+            for form in forms:
+                form.errors  # Validates a bound form, as the view does before it is rendered.
+            clear_layout_cache()
+            start = perf_counter()
+            for form in forms:
+                if not cached:
+                    clear_layout_cache()
+                form.as_test()
+            elapsed = perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best * 1e3 / number
+
+    def handle(self, *args, **kwargs):
+        number, repeat = max(1, kwargs['number']), max(1, kwargs['repeat'])
+        template = "{:>14} | {:>9} {:>9} | {:>7}"
+        self.stdout.write("Milliseconds per render, the best of each timed run. ")
+        self.stdout.write(template.format('form', 'before', 'after', 'saved'))
+        for label, make_form in self.get_forms().items():
+            before = self.per_render(make_form, number, repeat, cached=False)
+            after = self.per_render(make_form, number, repeat, cached=True)
+            saved = f"{(before - after) / before:.0%}" if before else ''
+            self.stdout.write(template.format(label, f"{before:.3f}", f"{after:.3f}", saved))
+        clear_layout_cache()
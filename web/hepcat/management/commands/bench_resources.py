@@ -0,0 +1,69 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from datetime import date, time, timedelta
+from time import perf_counter
+from classwork.models import Resource, Subject, Session, ClassOffer
+
+
+class Command(BaseCommand):
+    """Benchmark the query count and time for ClassOffer resources() as the number of classes taken grows.
+        All records created for the benchmark are rolled back when it is done.
+    """
+    help = "Compare ClassOffer resources() to the per-class union it replaced, for each number of classes. "
+    resource_fields = ('name', 'id', 'content_type', )
+
+    def add_arguments(self, parser):
+        parser.add_argument('sizes', nargs='*', type=int, default=[1, 10, 50, 100, 200], metavar='size',
+                            help='Number of ClassOffers for each benchmark row. Default: 1 10 50 100 200. ')
+        parser.add_argument('--repeat', '-r', type=int, default=3, metavar='count',
+                            help='Number of timed runs, the best of which is reported. Default: 3. ')
+
+    def make_classoffers(self, count):
+        """Returns a list of ClassOffer ids, each with a few Resources, in a Session that is currently running. """
+        start = date.today() - timedelta(days=14)
+        session = Session.objects.create(name='bench_resources', key_day_date=start, publish_date=start)
+        ids = []
+        for num in range(count):
+            subject = Subject.objects.create(name=f"bench_{num}", version='N', description='benchmark')
+            classoffer = ClassOffer.objects.create(subject=subject, session=session, class_day=start.weekday(),
+                                                   start_time=time(19, 0))
+            for avail in range(3):
+                res = Resource.objects.create(content_type='text', name=f"bench_{num}_{avail}", avail=avail)
+                subject.resources.add(res)
+            classoffer.resources.add(Resource.objects.create(content_type='text', name=f"bench_{num}_class"))
+            ids.append(classoffer.pk)
+        return ids
+
+    def per_class_union(self, query):
+        """The previous resources() implementation: a get_resources query for each ClassOffer, combined by union. """
+        arr = [query.get_resources(model=ea, live=True).order_by().values(*self.resource_fields) for ea in query]
+        return arr[0].union(*arr[1:]) if arr else Resource.objects.none().values()
+
+    def measure(self, method, query, repeat):
+        """Returns the number of queries, result count, and best time in milliseconds for evaluating the method. """
+        best, count, num_queries = None, 0, 0
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as context:
+                start = perf_counter()
+                count = len(list(method(query.all())))
+                elapsed = (perf_counter() - start) * 1000
+            num_queries = len(context.captured_queries)
+            best = elapsed if best is None else min(best, elapsed)
+        return num_queries, count, best
+
+    def handle(self, *args, **kwargs):
+        sizes, repeat = sorted(kwargs['sizes']), max(1, kwargs['repeat'])
+        template = "{:>8} | {:>13} {:>11} | {:>13} {:>11} | {:>9}"
+        self.stdout.write(template.format('classes', 'union queries', 'union ms', 'set queries', 'set ms', 'resources'))
+        with transaction.atomic():
+            ids = self.make_classoffers(sizes[-1] if sizes else 0)
+            for size in sizes:
+                query = ClassOffer.objects.filter(pk__in=ids[:size])
+                union_queries, union_count, union_ms = self.measure(self.per_class_union, query, repeat)
+                set_queries, set_count, set_ms = self.measure(lambda qs: qs.resources(), query, repeat)
+                if union_count != set_count:
+                    self.stderr.write(f"Results differ for {size} classes: {union_count} vs {set_count} resources. ")
+                values = (size, union_queries, f"{union_ms:.1f}", set_queries, f"{set_ms:.1f}", set_count)
+                self.stdout.write(template.format(*values))
+            transaction.set_rollback(True)
@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from random import Random
+from time import perf_counter
+from users.models import UserHC
+
+
+class Command(BaseCommand):
+    """Benchmark case-insensitive user lookups using 'iexact' against the indexed casefolded copies of the fields.
+        All users created for the benchmark are rolled back when it is done.
+    """
+    help = "Compare iexact lookups of email, username, and name to the folded fields, with a synthetic user table. "
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', '-n', type=int, default=100000, metavar='count',
+                            help='Number of synthetic users to create. Default: 100000. ')
+        parser.add_argument('--lookups', '-l', type=int, default=200, metavar='count',
+                            help='Number of values looked up for each row. Default: 200. ')
+        parser.add_argument('--repeat', '-r', type=int, default=3, metavar='count',
+                            help='Number of timed runs, the best of which is reported. Default: 3. ')
+
+    def make_users(self, count, batch_size=5000):
+        """Creates the users with mixed case values, setting the folded fields since bulk_create does not save. """
+        for start in range(0, count, batch_size):
+            users = []
+            for num in range(start, min(start + batch_size, count)):
+                user = UserHC(username=f"Bench_User_{num}", email=f"Bench.User{num}@Example.com", password='!',
+                              first_name=f"First{num % 997}", last_name=f"Last{num % 4999}")
+                user.set_folded()
+                users.append(user)
+            UserHC.objects.bulk_create(users)
+
+    def lookups(self, nums):
+        """For each row, a pair of functions returning the filter kwargs for a number, using iexact or folded. """
+        return {
+            'email': (lambda num: {'email__iexact': f"bench.user{num}@example.com"},
+                      lambda num: {'email_folded': f"bench.user{num}@example.com"}),
+            'username': (lambda num: {'username__iexact': f"BENCH_USER_{num}"},
+                         lambda num: {'username_folded': f"bench_user_{num}"}),
+            'name': (lambda num: {'first_name__iexact': f"first{num % 997}", 'last_name__iexact': f"LAST{num % 4999}"},
+                     lambda num: {'first_name_folded': f"first{num % 997}", 'last_name_folded': f"last{num % 4999}"}),
+            }
+
+    def measure(self, make_filter, nums, repeat):
+        """Returns the count of lookups that found users, and the best time in milliseconds per lookup. """
+        best, found = None, 0
+        for _ in range(repeat):
+            start = perf_counter()
+            found = sum(UserHC.objects.filter(**make_filter(num)).exists() for num in nums)
+            elapsed = (perf_counter() - start) * 1000 / max(1, len(nums))
+            best = elapsed if best is None else min(best, elapsed)
+        return found, best
+
+    def handle(self, *args, **kwargs):
+        count, repeat = max(1, kwargs['users']), max(1, kwargs['repeat'])
+        nums = Random(count).sample(range(count * 2), min(count * 2, max(1, kwargs['lookups'])))
+        template = "{:>10} | {:>9} {:>9} | {:>9} {:>9} | {:>8}"
+        message = f"Lookups of {len(nums)} values among {count} users, with about half the emails and usernames found. "
+        self.stdout.write(message)
+        with transaction.atomic():
+            start = perf_counter()
+            self.make_users(count)
+            self.stdout.write(f"Created the users in {perf_counter() - start:.1f} seconds. ")
+            self.stdout.write(template.format('lookup', 'iexact', 'ms each', 'folded', 'ms each', 'speedup'))
+            for name, (iexact, folded) in self.lookups(nums).items():
+                iexact_found, iexact_ms = self.measure(iexact, nums, repeat)
+                folded_found, folded_ms = self.measure(folded, nums, repeat)
+                if iexact_found != folded_found:
+                    self.stderr.write(f"Results differ for {name}: {iexact_found} vs {folded_found} found. ")
+                speedup = f"{iexact_ms / folded_ms:.1f}x" if folded_ms else '-'
+                values = (name, iexact_found, f"{iexact_ms:.3f}", folded_found, f"{folded_ms:.3f}", speedup)
+                self.stdout.write(template.format(*values))
+            transaction.set_rollback(True)
@@ -0,0 +1,57 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand
+from confusable_homoglyphs import confusables
+from timeit import Timer
+from users import validators
+
+SAMPLE_VALUES = {
+    'ascii name': 'chris_chapman',
+    'accented name': 'josé_müller',
+    'mixed script': 'chrіs',  # The 'і' is CYRILLIC SMALL LETTER BYELORUSSIAN-UKRAINIAN I
+    'reserved': 'webmaster',
+    'email': 'chris.chapman@example.com',
+}
+
+
+class Command(BaseCommand):
+    """Microbenchmark the per-call cost of the signup reserved name and confusables checks, for some sample values.
+        The 'before' columns are the direct checks the validators used, the 'after' columns use the current ones.
+    """
+    help = "Compare the per-call time of the username and email checks to the precompiled and memoized ones. "
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', '-n', type=int, default=2000, metavar='count',
+                            help='Number of calls in each timed run. Default: 2000. ')
+        parser.add_argument('--repeat', '-r', type=int, default=5, metavar='count',
+                            help='Number of timed runs, the best of which is reported. Default: 5. ')
+
+    def per_call(self, func, value, number, repeat):
+        """Returns the best time in microseconds for a call of the function with the value. """
+        return min(Timer(lambda: func(value)).repeat(repeat=repeat, number=number)) * 1e6 / number
+
+    def validate_all(self, value):
+        """Runs all the username or email checks with validate_critical. """
+        kwargs = {'email': value} if '@' in value else {'username': value}
+        try:
+            validators.validate_critical(**kwargs)
+        except ValidationError:
+            pass
+
+    def handle(self, *args, **kwargs):
+        number, repeat = max(1, kwargs['number']), max(1, kwargs['repeat'])
+        reserved_list = list(validators.DEFAULT_RESERVED_NAMES)
+        rows = (
+            ('reserved', lambda val: val in reserved_list, lambda val: val in validators.RESERVED_NAMES),
+            ('confusables', confusables.is_dangerous, validators.is_dangerous),
+            )
+        template = "{:>14} | {:>11} | {:>9} {:>9} | {:>9}"
+        self.stdout.write("Microseconds per call, the best of each timed run. ")
+        self.stdout.write(template.format('value', 'check', 'before', 'after', 'all'))
+        for label, value in SAMPLE_VALUES.items():
+            all_checks = f"{self.per_call(self.validate_all, value, number, repeat):.2f}"
+            for check, before, after in rows:
+                before_us = self.per_call(before, value, number, repeat)
+                after_us = self.per_call(after, value, number, repeat)
+                self.stdout.write(template.format(label, check, f"{before_us:.2f}", f"{after_us:.2f}", all_checks))
+                label = all_checks = ''  # Only shown on the first row for each value.
+        validators.is_dangerous.cache_clear()
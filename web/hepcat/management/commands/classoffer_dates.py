@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, Q
+from classwork.models import ClassOffer, ResourcePublication
+
+
+class Command(BaseCommand):
+    """Backfill, or verify, the stored 'start_date' and 'end_date' for ClassOffer records. """
+    help = "Computes and stores the ClassOffer start and end dates, or with '--verify' only reports incorrect ones. "
+
+    def add_arguments(self, parser):
+        parser.add_argument('sessions', nargs='*', type=str, default=[], metavar='session',
+                            help='Only process ClassOffers in the Session name(s) listed. Default: all ClassOffers.')
+        parser.add_argument('--verify', action='store_true',
+                            help='Do not modify records. Report ClassOffers where stored dates are not as computed.')
+        parser.add_argument('--batch-size', '-b', type=int, default=500, metavar='size',
+                            help='Number of ClassOffers to update in each query. Default: 500. ')
+
+    def get_queryset(self, sessions=None):
+        query = ClassOffer.objects.select_related('session').order_by('pk')
+        if sessions:
+            query = query.filter(session__name__in=sessions)
+        return query
+
+    def verify(self, query):
+        """Compare stored dates to the values computed by the database. Returns a list of incorrect ClassOffers. """
+        query = query.with_dates()
+        same_start = Q(start_date=F('computed_start')) | Q(start_date__isnull=True, computed_start__isnull=True)
+        same_end = Q(end_date=F('computed_end')) | Q(end_date__isnull=True, computed_end__isnull=True)
+        return list(query.exclude(same_start & same_end))
+
+    def backfill(self, query, batch_size):
+        """Compute and store the dates for all ClassOffers in the query. Returns the count of changed records. """
+        changed, count = [], 0
+        for classoffer in query.iterator(chunk_size=batch_size):
+            initial = (classoffer.start_date, classoffer.end_date)
+            if classoffer.set_dates() != initial:
+                changed.append(classoffer)
+            if len(changed) >= batch_size:
+                count += self.store(changed)
+                changed = []
+        if changed:
+            count += self.store(changed)
+        return count
+
+    def store(self, classoffers):
+        """Save the dates for the given ClassOffers, and their Resource publication windows. Returns count. """
+        ClassOffer.objects.bulk_update(classoffers, ['start_date', 'end_date'])
+        ResourcePublication.objects.refresh(classoffers=classoffers)
+        return len(classoffers)
+
+    def handle(self, *args, **kwargs):
+        query = self.get_queryset(kwargs['sessions'])
+        if kwargs['verify']:
+            incorrect = self.verify(query)
+            for classoffer in incorrect:
+                values = (repr(classoffer), classoffer.start_date, classoffer.end_date,
+                          classoffer.computed_start, classoffer.computed_end)
+                self.stdout.write("{} stored: {} - {} | computed: {} - {}".format(*values))
+            self.stdout.write(f"Found {len(incorrect)} ClassOffer(s) with incorrect stored dates. ")
+        else:
+            count = self.backfill(query, kwargs['batch_size'])
+            self.stdout.write(f"Updated the stored dates for {count} ClassOffer(s). ")
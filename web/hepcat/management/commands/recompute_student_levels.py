@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from classwork.models import Student
+
+
+class Command(BaseCommand):
+    """Recompute, or verify, the stored 'level' for Student records from the classes they have taken. """
+    help = "Computes and stores the Student levels in batches, or with '--verify' only reports incorrect ones. "
+
+    def add_arguments(self, parser):
+        parser.add_argument('sessions', nargs='*', type=str, default=[], metavar='session',
+                            help='Only process Students who took a class in the Session name(s) listed. Default: all.')
+        parser.add_argument('--verify', action='store_true',
+                            help='Do not modify records. Report Students where stored level is not as computed.')
+        parser.add_argument('--batch-size', '-b', type=int, default=1000, metavar='size',
+                            help='Number of Students to compute in each query. Default: 1000. ')
+
+    def get_queryset(self, sessions=None):
+        query = Student.objects.order_by('pk')
+        if sessions:
+            query = query.filter(taken__session__name__in=sessions).distinct()
+        return query
+
+    def verify(self, query, batch_size):
+        """Compare stored levels to the computed levels. Returns a list of (pk, stored, computed) when incorrect. """
+        pks = list(query.values_list('pk', flat=True))
+        incorrect = []
+        for i in range(0, len(pks), batch_size):
+            for data in Student.objects.filter(pk__in=pks[i:i + batch_size]).level_data('level'):
+                level = int(Student.level_from_data(data))
+                if level != data['level']:
+                    incorrect.append((data['pk'], data['level'], level))
+        return incorrect
+
+    def handle(self, *args, **kwargs):
+        query = self.get_queryset(kwargs['sessions'])
+        batch_size = max(1, kwargs['batch_size'])
+        if kwargs['verify']:
+            incorrect = self.verify(query, batch_size)
+            for values in incorrect:
+                self.stdout.write("Student {} stored: {} | computed: {}".format(*values))
+            self.stdout.write(f"Found {len(incorrect)} Student(s) with an incorrect stored level. ")
+        else:
+            count = query.update_levels(batch_size=batch_size)
+            self.stdout.write(f"Updated the stored level for {count} Student(s). ")
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from time import sleep
+from classwork.models import EmailOutbox
+
+
+class Command(BaseCommand):
+    """Send the queued EmailOutbox messages that are due, retrying failed ones with a doubling delay.
+        Several workers can run at once on databases that support 'select_for_update(skip_locked=True)'.
+    """
+    help = "Sends the due emails from the outbox in batches, or with '--loop' keeps polling for more. "
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', '-b', type=int, default=settings.EMAIL_OUTBOX_BATCH_SIZE, metavar='size',
+                            help='Number of emails sent over each connection. Default: EMAIL_OUTBOX_BATCH_SIZE. ')
+        parser.add_argument('--max-attempts', type=int, default=settings.EMAIL_OUTBOX_MAX_ATTEMPTS, metavar='count',
+                            help='Attempts before an email is marked as failed. Default: EMAIL_OUTBOX_MAX_ATTEMPTS. ')
+        parser.add_argument('--rate', type=float, default=settings.EMAIL_OUTBOX_RATE, metavar='per_second',
+                            help='Most emails sent per second, or 0 for no limit. Default: EMAIL_OUTBOX_RATE. ')
+        parser.add_argument('--loop', action='store_true',
+                            help='Keep running, waiting for more emails when the outbox is empty. ')
+        parser.add_argument('--sleep', type=float, default=10, metavar='seconds',
+                            help='With --loop, the seconds to wait when no emails are due. Default: 10. ')
+
+    def handle(self, *args, **kwargs):
+        options = {'batch_size': max(1, kwargs['batch_size']), 'max_attempts': max(1, kwargs['max_attempts']),
+                   'rate': max(0, kwargs['rate'])}
+        while True:
+            sent, unsent = EmailOutbox.objects.send_due(**options)
+            if sent or unsent or not kwargs['loop']:
+                self.stdout.write(f"Sent {sent} email(s), with {unsent} failed attempt(s). ")
+            if not kwargs['loop']:
+                break
+            if not sent and not unsent:
+                sleep(kwargs['sleep'])
@@ -69,24 +69,45 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     # 'django.middleware.cache.FetchFromCacheMiddleware',  # CUSTOM: Add for full-site Cache
 ]
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'DEBUG' if DEBUG else 'WARNING')  # Per-module loggers. INFO for timed events.
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'app': {
+            'format': '{asctime} {levelname} {name} {message}',
+            'style': '{',
+            },
+        },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            },
+        'app_console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'app',
+            },
+        },
+    'loggers': {
+        'classwork': {
+            'level': LOG_LEVEL,
+            'handlers': ['app_console'],
+            'propagate': False,
+            },
+        'users': {
+            'level': LOG_LEVEL,
+            'handlers': ['app_console'],
+            'propagate': False,
+            },
+        },
+    }
 if DEBUG:
     INTERNAL_IPS = ALLOWED_HOSTS
     INSTALLED_APPS = INSTALLED_APPS + DEV_APPS
     MIDDLEWARE = DEV_MIDDLEWARE + MIDDLEWARE
-    LOGGING = {
-        'version': 1,
-        'disable_existing_loggers': False,
-        'handlers': {
-            'console': {
-                'class': 'logging.StreamHandler',
-                },
-            },
-        'loggers': {
-            'django.db.backends': {
-                'level': 'DEBUG',
-                'handlers': ['console'],
-                }
-            },
+    LOGGING['loggers']['django.db.backends'] = {
+        'level': 'DEBUG',
+        'handlers': ['console'],
         }
     TOOLBAR_DEFAULT = [
         'debug_toolbar.panels.history.HistoryPanel',
@@ -175,6 +196,8 @@ DATABASES = {
 if os.environ.get('DB_TYPE') == 'mysql':
     DATABASES['default']['OPTIONS'] = {'charset': 'utf8mb4'}
     MAX_INDEX_CHARACTER_SIZE = 191
+elif os.environ.get('DB_TYPE') is None:
+    DATABASES['default']['TEST']['NAME'] = None  # SQLite uses an in-memory database when running tests.
 FIXTURE_DIRS = ['tests/fixtures']
 if HOSTED_PYTHONANYWHERE and not LOCAL:  # pragma: no cover
     LOGNAME = os.environ.get('LOGNAME', DATABASES['default']['USER'])
@@ -266,6 +289,12 @@ elif USE_S3:  # pragma: no cover
     AWS_SES_REGION_ENDPOINT = os.environ.get('AWS_SES_REGION_ENDPOINT')
 else:  # pragma: no cover
     EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+# Queued emails are sent by the 'send_outbox' management command, which retries with a doubling delay.
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.environ.get('EMAIL_OUTBOX_MAX_ATTEMPTS', '5'))
+EMAIL_OUTBOX_RETRY_DELAY = int(os.environ.get('EMAIL_OUTBOX_RETRY_DELAY', '60'))  # seconds before the first retry.
+EMAIL_OUTBOX_BATCH_SIZE = int(os.environ.get('EMAIL_OUTBOX_BATCH_SIZE', '100'))  # emails for each connection.
+EMAIL_OUTBOX_RATE = float(os.environ.get('EMAIL_OUTBOX_RATE', '14'))  # max emails per second, 0 for no limit.
+EMAIL_OUTBOX_CLAIM_SECONDS = int(os.environ.get('EMAIL_OUTBOX_CLAIM_SECONDS', '600'))  # until unsent claims retry.
 # Django Newsletter
 # NEWSLETTER_CONFIRM_EMAIL = False
 # Using django-tinymce
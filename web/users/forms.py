@@ -27,12 +27,10 @@ class CustomRegistrationForm(AddressUsernameMixIn, RegistrationForm):
         }
 
     def __init__(self, *args, **kwargs):
-        print("================================== CustomRegistrationForm.__init__ =====================")
         if not self.tos_required:
             self.base_fields.pop('tos', None)
         super().__init__(*args, **kwargs)
         # TODO: If using RegistrationForm init, then much, but not all, of attach_critical_validators is duplicate code.
-        print("--------------------- FINISH users.CustomRegistrationForm.__init__ --------------------")
 
 
 class CustomUserCreationForm(UserCreationForm):
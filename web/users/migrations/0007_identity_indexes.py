@@ -0,0 +1,50 @@
+# Generated by Django 3.1.5 on 2021-01-28 19:12
+
+from django.db import migrations
+
+INDEXES = (
+    ('users_email_lower_idx', ('email', )),
+    ('users_name_lower_idx', ('last_name', 'first_name')),
+    )
+
+
+def supports_expression_index(connection):
+    """MySQL has functional indexes from version 8.0.13, MariaDB does not have them. """
+    if connection.vendor == 'mysql':
+        return not connection.mysql_is_mariadb and connection.mysql_version >= (8, 0, 13)
+    return connection.vendor in ('postgresql', 'sqlite')
+
+
+def create_indexes(apps, schema_editor):
+    """Case-insensitive indexes, as used by 'UserHC.objects.match_identity', since Django 3.1 can not declare them. """
+    if not supports_expression_index(schema_editor.connection):
+        return
+    table = schema_editor.quote_name(apps.get_model('users', 'UserHC')._meta.db_table)
+    for name, columns in INDEXES:
+        expressions = ', '.join(f"(LOWER({schema_editor.quote_name(col)}))" for col in columns)
+        schema_editor.execute(f"CREATE INDEX {schema_editor.quote_name(name)} ON {table} ({expressions})")
+
+
+def drop_indexes(apps, schema_editor):
+    """Only those that exist, since SQLite rebuilding the table, to remove later fields, also removes these. """
+    if not supports_expression_index(schema_editor.connection):
+        return
+    db_table = apps.get_model('users', 'UserHC')._meta.db_table
+    with schema_editor.connection.cursor() as cursor:
+        existing = schema_editor.connection.introspection.get_constraints(cursor, db_table)
+    table = schema_editor.quote_name(db_table)
+    on_table = f" ON {table}" if schema_editor.connection.vendor == 'mysql' else ''
+    for name, columns in INDEXES:
+        if name in existing:
+            schema_editor.execute(f"DROP INDEX {schema_editor.quote_name(name)}{on_table}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_auto_20210101_1551'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes),
+    ]
@@ -0,0 +1,62 @@
+# Generated by Django 3.1.5 on 2021-01-28 19:12
+
+from django.db import migrations, models
+import unicodedata
+
+FOLDED_FIELDS = {'email': 'email_folded', 'username': 'username_folded',
+                 'first_name': 'first_name_folded', 'last_name': 'last_name_folded', }
+
+
+def fold_case(value):
+    """Historical models do not have the model methods, so this matches users.validators.fold_case. """
+    return unicodedata.normalize("NFKC", value or '').casefold()
+
+
+def set_folded(apps, schema_editor):
+    """Populate the casefolded copies for existing users, in batches. """
+    UserHC = apps.get_model('users', 'UserHC')
+    batch = []
+    for user in UserHC.objects.only('pk', *FOLDED_FIELDS).iterator(chunk_size=1000):
+        for name, folded in FOLDED_FIELDS.items():
+            setattr(user, folded, fold_case(getattr(user, name)))
+        batch.append(user)
+        if len(batch) >= 1000:
+            UserHC.objects.bulk_update(batch, FOLDED_FIELDS.values())
+            batch = []
+    if batch:
+        UserHC.objects.bulk_update(batch, FOLDED_FIELDS.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_identity_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userhc',
+            name='email_folded',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=191),
+        ),
+        migrations.AddField(
+            model_name='userhc',
+            name='first_name_folded',
+            field=models.CharField(blank=True, editable=False, max_length=150),
+        ),
+        migrations.AddField(
+            model_name='userhc',
+            name='last_name_folded',
+            field=models.CharField(blank=True, editable=False, max_length=150),
+        ),
+        migrations.AddField(
+            model_name='userhc',
+            name='username_folded',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=150),
+        ),
+        migrations.AddIndex(
+            model_name='userhc',
+            index=models.Index(fields=['last_name_folded', 'first_name_folded'], name='users_name_folded_idx'),
+        ),
+        migrations.RunPython(set_folded, migrations.RunPython.noop),
+    ]
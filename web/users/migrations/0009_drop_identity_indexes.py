@@ -0,0 +1,52 @@
+# Generated by Django 3.1.5 on 2021-01-28 19:40
+
+from django.db import migrations
+
+INDEXES = (
+    ('users_email_lower_idx', ('email', )),
+    ('users_name_lower_idx', ('last_name', 'first_name')),
+    )
+
+
+def existing_indexes(schema_editor, table):
+    """SQLite rebuilds the table when fields are added, losing indexes not known to the migration state. """
+    with schema_editor.connection.cursor() as cursor:
+        return schema_editor.connection.introspection.get_constraints(cursor, table)
+
+
+def drop_indexes(apps, schema_editor):
+    """The casefolded fields replace the LOWER() expression indexes, which work for fewer databases. """
+    table = apps.get_model('users', 'UserHC')._meta.db_table
+    existing = existing_indexes(schema_editor, table)
+    on_table = f" ON {schema_editor.quote_name(table)}" if schema_editor.connection.vendor == 'mysql' else ''
+    for name, columns in INDEXES:
+        if name in existing:
+            schema_editor.execute(f"DROP INDEX {schema_editor.quote_name(name)}{on_table}")
+
+
+def create_indexes(apps, schema_editor):
+    """MySQL has functional indexes from version 8.0.13, MariaDB does not have them. """
+    connection = schema_editor.connection
+    if connection.vendor == 'mysql':
+        if connection.mysql_is_mariadb or connection.mysql_version < (8, 0, 13):
+            return
+    elif connection.vendor not in ('postgresql', 'sqlite'):
+        return
+    table = apps.get_model('users', 'UserHC')._meta.db_table
+    existing = existing_indexes(schema_editor, table)
+    for name, columns in INDEXES:
+        if name not in existing:
+            expressions = ', '.join(f"(LOWER({schema_editor.quote_name(col)}))" for col in columns)
+            schema_editor.execute(f"CREATE INDEX {schema_editor.quote_name(name)} ON "
+                                  f"{schema_editor.quote_name(table)} ({expressions})")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_userhc_folded_fields'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_indexes, create_indexes),
+    ]
@@ -4,16 +4,43 @@ from django.core.exceptions import ImproperlyConfigured, ValidationError
 from django.contrib.admin.utils import flatten
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import UsernameField
+from django.dispatch import receiver
 from django.forms.fields import Field, CharField
 from django.forms.widgets import Input, CheckboxInput, CheckboxSelectMultiple, RadioSelect, HiddenInput, Textarea
 from django.forms.utils import ErrorDict  # , ErrorList
 from django.utils.translation import gettext as _
 from django.utils.html import conditional_escape, format_html
 from django.utils.safestring import mark_safe
+from django.core.signals import setting_changed
 from django.urls import reverse
-from django_registration import validators
-# from . import validators
-from pprint import pprint
+from itertools import chain
+from . import validators
+import logging
+logger = logging.getLogger(__name__)
+LAYOUT_CACHE_SIZE = 512
+_layout_cache = {}
+
+
+def cached_layout(form, kind, key, compute):
+    """Returns the value from compute() for this kind of layout part, computed once for the form class and key.
+        The cached values are shared by every instance of the form class, so they must not be modified.
+    """
+    cache_key = (form.__class__, kind, key)
+    try:
+        return _layout_cache[cache_key]
+    except KeyError:
+        pass
+    value = compute()
+    if len(_layout_cache) >= LAYOUT_CACHE_SIZE:
+        _layout_cache.clear()
+    _layout_cache[cache_key] = value
+    return value
+
+
+@receiver(setting_changed)
+def clear_layout_cache(**kwargs):
+    """Discard the cached form layouts, so they are computed again when next rendered. """
+    _layout_cache.clear()
 
 
 class FocusMixIn:
@@ -46,9 +73,7 @@ class FocusMixIn:
         return found_name
 
     def _html_output(self, *args, **kwargs):
-        print("************************** Autofocus FOR _HTML_OUTPUT *************************************")
         content = super()._html_output(*args, **kwargs)
-        print("--------- GIVE FOCUS ----------------")
         self.named_focus = self.assign_focus_field(name=self.named_focus, fields=self.fields_focus)
         return content
 
@@ -59,27 +84,18 @@ class FocusMixIn:
         display_data = func()
         if container not in ('p', 'fieldset', ):
             display_data = self._html_tag(container, display_data)
-        print("==================== Final Stage!=================================")
-        pprint(self._meta.model)
-        print("----------------------- self.data ------------------------------")
-        data = getattr(self, 'data', None)
-        if data:
-            for key in data:
-                print(f"{key} : {data.getlist(key)}")
-        else:
-            print("NO DATA PRESENT")
-        print("----------------------- self.fields ------------------------------")
-        pprint(self.fields)
-        print("--------------------- computed fields ----------------------------")
-        pprint(self.computed_fields)
-        print("------------------------------------------------------------------")
+        if logger.isEnabledFor(logging.DEBUG):
+            data = getattr(self, 'data', None)
+            data = {key: data.getlist(key) for key in data} if data else "NO DATA PRESENT"
+            logger.debug("as_test for %s data: %s fields: %s computed fields: %s",
+                         self._meta.model, data, self.fields, getattr(self, 'computed_fields', None))
         return mark_safe(display_data)
 
     def test_field_order(self, data):
         """Deprecated. Log printing the dict, array, or tuple in the order they are currently stored. """
         log_lines = [(key, value) for key, value in data.items()] if isinstance(data, dict) else data
         for line in log_lines:
-            pprint(line)
+            logger.debug("%s", line)
 
     def _html_tag(self, tag, contents, attr_string=''):
         """Wraps 'contents' in an HTML element with an open and closed 'tag', applying the 'attr_string' attributes. """
@@ -94,7 +110,6 @@ class ComputedFieldsMixIn:
     # reserved_names = []
 
     def __init__(self, *args, **kwargs):
-        print("======================= ComputedFieldsMixIn.__init__ =================================")
         critical_fields = self.fields_for_critical(kwargs.pop('critical_fields', {}))
         self.attach_critical_validators(**critical_fields)
         self.critical_fields = critical_fields
@@ -103,7 +118,8 @@ class ComputedFieldsMixIn:
         super().__init__(*args, **kwargs)
         computed_field_names.extend(kwargs.pop('computed_fields', []))
         self.computed_fields = self.get_computed_fields(computed_field_names)
-        print("--------------------- FINISH ComputedFieldsMixIn.__init --------------------")
+        self.unique_lookups = {}
+        self.bind_unique_validators()
 
     def fields_for_critical(self, critical_fields):
         """Set model properties for 'critical_fields' in kwargs, 'user_model', and expected name_for_<variable>s. """
@@ -165,9 +181,9 @@ class ComputedFieldsMixIn:
             fields = getattr(self, 'base_fields', None)
         if not fields:
             raise ImproperlyConfigured(_("Any ComputedFieldsMixIn depends on access to base_fields or fields. "))
-        reserved_names = kwargs.get('reserved_names', getattr(self, 'reserved_names', []))
+        reserved_names = frozenset(kwargs.get('reserved_names', getattr(self, 'reserved_names', [])))
         if not kwargs.get('reserved_names_replace', getattr(self, 'reserved_names_replace', False)):
-            reserved_names += validators.DEFAULT_RESERVED_NAMES
+            reserved_names = validators.RESERVED_NAMES.union(reserved_names)
         kwargs['reserved_names'] = reserved_names
 
         names = set(list(fields.keys()) + list(self.critical_fields.keys()))
@@ -181,7 +197,7 @@ class ComputedFieldsMixIn:
         field_name = self.name_for_user
         opts = kwargs.get('name_for_user', {})
         strict_username = opts.get('strict', getattr(self, 'strict_username', None))
-        reserved_names = kwargs.get('reserved_name', [])
+        reserved_names = kwargs.get('reserved_names', validators.RESERVED_NAMES)
         username_validators = [
             validators.ReservedNameValidator(reserved_names),
             validators.validate_confusables,
@@ -214,6 +230,35 @@ class ComputedFieldsMixIn:
         field.required = True
         return True
 
+    def get_bound_instance(self, model):
+        """The existing record the submitted values belong to: the ModelForm instance or initial 'user', if saved. """
+        for instance in (getattr(self, 'instance', None), self.initial.get('user', None)):
+            if isinstance(instance, model) and instance.pk is not None:
+                return instance
+        return None
+
+    def unique_lookup(self, model):
+        """The UniqueValues for the model, so all of this form's uniqueness checks on it are done in one query. """
+        if model not in self.unique_lookups:
+            self.unique_lookups[model] = validators.UniqueValues(model, self.get_bound_instance(model))
+        return self.unique_lookups[model]
+
+    def bind_unique_validators(self):
+        """Any CaseInsensitiveUnique validator of the fields is replaced by one using the form's unique_lookup. """
+        for field in chain(self.fields.values(), self.computed_fields.values()):
+            if any(isinstance(ea, validators.CaseInsensitiveUnique) for ea in field.validators):
+                field.validators = [
+                    ea.using(self.unique_lookup(ea.model)) if isinstance(ea, validators.CaseInsensitiveUnique) else ea
+                    for ea in field.validators
+                    ]
+
+    def add_unique_candidates(self):
+        """Before cleaning, add the submitted values for the uniqueness checks so they share a single query. """
+        for name, field in chain(self.fields.items(), self.computed_fields.items()):
+            for validator in field.validators:
+                if isinstance(validator, validators.CaseInsensitiveUnique) and validator.lookup is not None:
+                    validator.lookup.add(validator.field_name, self.data.get(self.add_prefix(name), None))
+
     def construct_value_from_values(self, field_names=None, joiner='_', normalize=None):
         """Must be evaluated after cleaned_data has the named field values populated. """
         if not field_names:
@@ -237,8 +282,6 @@ class ComputedFieldsMixIn:
     def _clean_computed_fields(self):
         """Mimics _clean_fields for computed_fields. Calls compute_<fieldname> and clean_<fieldname> if present. """
         compute_errors = ErrorDict()
-        print("=================== ComputedFieldsMixIn._clean_computed_fields ============================")
-        pprint(self.critical_fields)
         critical = {getattr(self, label): label for label, opts in self.critical_fields.items() if opts.get('computed')}
         for name, field in self.computed_fields.items():
             compute_name = critical.get(name, name)
@@ -256,15 +299,16 @@ class ComputedFieldsMixIn:
                 self.add_error(None, e)
         return compute_errors
 
+    def full_clean(self):
+        if self.is_bound:
+            self.add_unique_candidates()
+        super().full_clean()
+
     def clean(self):
-        print("============================ ComputedFieldsMixIn.clean =========================")
         compute_errors = self._clean_computed_fields()
-        print("---------------- compute_errors -----------------------------------------")
-        print(compute_errors)
         if compute_errors:
-            print("---------------- cleaned_computed_data -----------------------------------------")
             cleaned_compute_data = {name: self.cleaned_data.pop(name, None) for name in self.computed_fields}
-            print(cleaned_compute_data)
+            logger.debug("Computed field errors: %s for cleaned data: %s", compute_errors, cleaned_compute_data)
             raise ValidationError(_("Error occurred with the computed fields. "))
         cleaned_data = super().clean()  # return self.cleaned_data, also sets boolean for unique validation.
         return cleaned_data
@@ -292,7 +336,6 @@ class ComputedUsernameMixIn(ComputedFieldsMixIn):
     }
 
     def __init__(self, *args, **kwargs):
-        print("======================= ComputedUsernameMixIn(ComputedFieldsMixIn).__init__ ==========================")
         user_model = self.user_model = self.get_form_user_model()
         name_for_email = user_model.get_email_field_name()
         name_for_user = user_model.USERNAME_FIELD
@@ -312,7 +355,6 @@ class ComputedUsernameMixIn(ComputedFieldsMixIn):
         #     if self.name_for_user in self.data:
         #         self.assign_focus_field(name=name_for_email)
         self.confirm_required_fields()
-        print("--------------------- FINISH ComputedUsernameMixIn(ComputedFieldsMixIn).__init__ --------------------")
 
     def get_form_user_model(self):
         """Use the model of the ModelForm if it has what is needed. Otherwise assign to the User model. """
@@ -341,13 +383,12 @@ class ComputedUsernameMixIn(ComputedFieldsMixIn):
         username_field_name = username_field_name or self.name_for_user
         normalize = self.user_model.normalize_username  # TODO: Fail gracefully version?
         result = self.construct_value_from_values(field_names=(email_field_name, ), normalize=normalize)
-        lookup = {"{}__iexact".format(self.user_model.USERNAME_FIELD): result}
+        unique = self.unique_lookup(self.user_model)
         try:
-            if not result or self.user_model._default_manager.filter(**lookup).exists():
+            if not result or unique.is_used(self.user_model.USERNAME_FIELD, result):
                 result = self.construct_value_from_values(field_names=self.constructor_fields, normalize=normalize)
         except Exception as e:
-            print("Unable to query to lookup if this username exists. ")
-            print(e)
+            logger.warning("Unable to query to lookup if this username exists. %s", e)
         return result
 
     def compute_name_for_user(self):
@@ -418,9 +459,8 @@ class ComputedUsernameMixIn(ComputedFieldsMixIn):
         """If the user gave a non-shared email, we expect flag is False, and no username value. """
         flag_name = self.USERNAME_FLAG_FIELD
         flag_field = self.fields.get(flag_name, None) or self.computed_fields.get(flag_name, None)
-        print("==================== ComputedUsernameMixIn.handle_flag_field =====================================")
         if not flag_field:
-            print("No flag field")
+            logger.debug("ComputedUsernameMixIn.handle_flag_field: No flag field. ")
             return
         flag_value = self.cleaned_data[flag_name]
         flag_changed = flag_field.has_changed(flag_field.initial, flag_value)
@@ -430,29 +470,51 @@ class ComputedUsernameMixIn(ComputedFieldsMixIn):
         user_field = self.fields[user_field_name]
         user_value = self.cleaned_data[user_field_name]
         user_changed = user_field.has_changed(user_field.initial, user_value)
-        flag_data = f"Init: {flag_field.initial} | Clean: {flag_value} | New: {flag_changed} "
-        email_data = f"Init: {email_field.initial} | Clean: {email_value} | New: {email_changed} "
-        user_data = f"Init: {user_field.initial} | Clean: {user_value} | New: {user_changed} "
-        pprint(flag_data)
-        pprint(email_data)
-        pprint(user_data)
+        template = "%s Init: %s | Clean: %s | New: %s "
+        logger.debug(template, 'flag', flag_field.initial, flag_value, flag_changed)
+        logger.debug(template, 'email', email_field.initial, email_value, email_changed)
+        logger.debug(template, 'user', user_field.initial, user_value, user_changed)
         error_collected = {}
+        unique = self.unique_lookup(self.user_model)
         if not flag_value:  # Using email as username, confirm it is unique.
-            lookup = {"{}__iexact".format(self.user_model.USERNAME_FIELD): email_value}
             try:
-                if self.user_model._default_manager.filter(**lookup).exists():  # not email_changed or
+                if unique.is_used(self.user_model.USERNAME_FIELD, email_value):  # not email_changed or
                     message = "You must give a unique email not shared with other users (or create a username). "
                     error_collected[email_field_name] = _(message)
+                self.username_checked = True
             except Exception as e:
-                print("Could not lookup if the new email is already used as a username. ")
-                print(e)
+                logger.warning("Could not lookup if the new email is already used as a username. %s", e)
             self.cleaned_data[user_field_name] = email_value
         elif email_changed:
             message = "Un-check the box, or leave empty, if you want to use this email address. "
             error_collected[flag_name] = _(message)
-        print("------------------------- END ComputedUsernameMixIn.handle_flag_field END ------------------------")
+        elif user_value:  # A created username, confirm it is unique.
+            try:
+                if unique.is_used(self.user_model.USERNAME_FIELD, user_value):
+                    error_collected[user_field_name] = validators.DUPLICATE_USERNAME
+                self.username_checked = True
+            except Exception as e:
+                logger.warning("Could not lookup if the new username is already used. %s", e)
         return error_collected
 
+    def add_unique_candidates(self):
+        """The username may be the email, given, or from the names, all checked in the same query as other values. """
+        super().add_unique_candidates()
+        names = (self.name_for_email, self.name_for_user, *self.constructor_fields)
+        email, username, *name_values = (self.data.get(self.add_prefix(name), None) or '' for name in names)
+        from_names = self.user_model.normalize_username('_'.join(ea.strip() for ea in name_values).casefold())
+        self.unique_lookup(self.user_model).add(self.user_model.USERNAME_FIELD, email.strip(), username, from_names)
+
+    def validate_unique(self):
+        """Once clean has checked the username, case-insensitive, the model does not need to query it again. """
+        if not getattr(self, 'username_checked', False):
+            return super().validate_unique()
+        exclude = [*self._get_validation_exclusions(), self.user_model.USERNAME_FIELD]
+        try:
+            self.instance.validate_unique(exclude=exclude)
+        except ValidationError as e:
+            self._update_errors(e)
+
     def clean(self):
         cleaned_data = super().clean()  # compute fields, return self.cleaned_data, sets unique validation boolean.
         username_value = self.cleaned_data.get(self.name_for_user, '')
@@ -465,7 +527,7 @@ class ComputedUsernameMixIn(ComputedFieldsMixIn):
             self.fields.update(self.computed_fields)
         error_dict = self.handle_flag_field(self.name_for_email, self.name_for_user)
         if error_dict:
-            print("We had an error processing the flag. ")
+            logger.debug("We had an error processing the flag. %s", error_dict)
             raise ValidationError(error_dict)
         return cleaned_data
 
@@ -542,6 +604,13 @@ class FormOverrideMixIn:
         return attrs
 
     def get_overrides(self):
+        """Returns the make_overrides dict, computed once for the form class and its email and username field names.
+            The returned dict is shared by the instances of the form class, so it must not be modified.
+        """
+        key = (getattr(self, 'name_for_email', 'email'), getattr(self, 'name_for_user', 'username'))
+        return cached_layout(self, 'overrides', key, self.make_overrides)
+
+    def make_overrides(self):
         """Combines good_practice_attrs and any formfield_attrs_overrides into a dict based on field names. """
         overrides = self.good_practice_attrs()
         for name, attrs in getattr(self, 'formfield_attrs_overrides', {}).items():
@@ -651,7 +720,6 @@ class FormOverrideMixIn:
         return fields
 
     def _html_output(self, *args, **kwargs):
-        print("************************** OVERRIDES FOR _HTML_OUTPUT *************************************")
         self.fields = self.prep_fields()
         return super()._html_output(*args, **kwargs)
 
@@ -679,7 +747,6 @@ class OverrideCountryMixIn(FormOverrideMixIn):
         }
 
     def __init__(self, *args, **kwargs):
-        print("================= OverrideCountryMixIn(FormOverrideMixIn).__init__ ============================")
         country_name = self.country_field_name
         country_field = self.base_fields.get(country_name, None)
         address_display_version = 'local'
@@ -709,17 +776,14 @@ class OverrideCountryMixIn(FormOverrideMixIn):
             elif computed_field_names:
                 self.remove_field_names = getattr(self, 'remove_field_names', [])
                 self.remove_field_names.extend(computed_field_names)
-            print("-------------------------------------------------------------")
         # else: Either this form does not have an address, or they don't what the switch functionality.
-        log = f"Displayed - {display}. "
-        log += "Indicated, and will show, foreign addres. " if country_flag else "will show local address. "
-        print(log)
+        logger.debug("Displayed - %s. %s", display,
+                     "Indicated, and will show, foreign address. " if country_flag else "will show local address. ")
         super().__init__(*args, **kwargs)
         name = 'country_display'
         value = self.data.get(name, None)
         if value and address_display_version != value:
             self.set_alt_data(name=name, field=self.fields[name], value=address_display_version)
-        print("------------- FINISH OverrideCountryMixIn(FormOverrideMixIn).__init__ FINISH ------------------")
 
     def condition_alt_country(self):
         """Returns a boolean if the alt_field_info['alt_country'] field info should be applied. """
@@ -730,7 +794,6 @@ class OverrideCountryMixIn(FormOverrideMixIn):
 
     def prep_country_fields(self, opts, field_rows, remaining_fields, *args, **kwargs):
         """Used either in prep_fields or make_fieldsets for row containing country switch and field (if present). """
-        print("==================== OverrideCountryMixIn.prep_country_fields ==========================")
         if not self.country_optional:
             return (opts, field_rows, remaining_fields, *args, kwargs)
         field_rows = field_rows or []
@@ -745,18 +808,14 @@ class OverrideCountryMixIn(FormOverrideMixIn):
         return (opts, field_rows, remaining_fields, *args, kwargs)
 
     def clean_country_flag(self):
-        print("================== Clean Other Country ================================")
         country_flag = self.cleaned_data.get('country_flag', None)
         if country_flag:
             field = self.fields.get(self.country_field_name, None)
             if not field and hasattr(self, 'computed_fields'):
                 field = self.computed_fields.get(self.country_field_name, None)
-            print("Country Flag, Initial Field value, Cleaned Data value: ")
-            print(country_flag)
-            print(field.initial)
             value = self.cleaned_data.get(self.country_field_name, None)
-            pprint(value)
-            print("---------------------------------------------------------------")
+            logger.debug("Country Flag: %s, Initial Field value: %s, Cleaned Data value: %s",
+                         country_flag, field.initial, value)
             if field.initial == self.cleaned_data.get(self.country_field_name, None):
                 raise forms.ValidationError("You can input your address. ")
         return country_flag
@@ -814,63 +873,95 @@ class FormFieldsetMixIn:
         return (opts, field_rows, remaining_fields, *args, kwargs)
 
     def determine_label_width(self, field_rows):
-        """Returns a attr_dict and list of names of fields whose labels should apply these attributes. """
+        """Returns a attr_dict and list of names of fields whose labels should apply these attributes.
+            Computed once for the form class and the names, widget classes, and labels of the single field rows.
+        """
         if isinstance(field_rows, dict):  # such as self.fields
-            single_field_rows = [{name: field} for name, field in field_rows]
+            single_field_rows = [{name: field} for name, field in field_rows.items()]
         else:
             single_field_rows = [row for row in field_rows if len(row) == 1]
-        visual_group, styled_labels, label_attrs_dict = [], [], {}
         if len(single_field_rows) < 2 or not getattr(self, 'adjust_label_width', True):
-            return label_attrs_dict, styled_labels
-        for field_dict in single_field_rows:
-            name = list(field_dict.keys())[0]
-            field = list(field_dict.values())[0]
-            klass = field.widget.__class__
+            return {}, []
+        label_fields = tuple((name, field.widget.__class__, str(field.label))
+                             for field_dict in single_field_rows for name, field in field_dict.items())
+        label_attrs_dict, styled_labels = cached_layout(
+            self, 'label_width', label_fields, lambda: self.compute_label_width(label_fields))
+        return dict(label_attrs_dict), list(styled_labels)
+
+    def compute_label_width(self, label_fields):
+        """Returns the label attr_dict and names for the (name, widget class, label) of each single field row. """
+        visual_group, styled_labels, label_attrs_dict = [], [], {}
+        for name, klass, label in label_fields:
             if issubclass(klass, self.label_width_widgets) and \
                not issubclass(klass, getattr(self, 'label_exclude_widgets', [])):
-                visual_group.append((name, field, ))
+                visual_group.append((name, label, ))
         if len(visual_group) > 1:
-            max_label_length = max(len(field.label) for name, field in visual_group)
+            max_label_length = max(len(label) for name, label in visual_group)
             width = (max_label_length + 1) // 2  # * 0.85 ch
             if width > self.max_label_width:
-                max_word_length = max(len(w) for name, field in visual_group for w in field.label.split())
+                max_word_length = max(len(w) for name, label in visual_group for w in label.split())
                 width = max_word_length // 2
                 if width > self.max_label_width:
                     message = "The max_label_width of {} is not enough for the fields: {} ".format(
-                        self.max_label_width, visual_group.keys())
+                        self.max_label_width, [name for name, label in visual_group])
                     raise ImproperlyConfigured(_(message))
             style_text = 'width: {}rem; display: inline-block'.format(width)
             label_attrs_dict = {'style': style_text}
-            styled_labels = [name for name, field in visual_group]
-        return label_attrs_dict, styled_labels
+            styled_labels = [name for name, label in visual_group]
+        return label_attrs_dict, tuple(styled_labels)
+
+    def resolve_field_name(self, name):
+        """A fieldsets name starting with '_' may be specially coded as the form attribute holding the field name. """
+        if name.startswith('_') and hasattr(self, name[1:]):
+            name = getattr(self, name[1:], '')
+        return name
+
+    def compile_fieldsets(self):
+        """Returns the fieldsets layout and the set of names it assigns, computed once for the form class.
+            The specially coded field names are resolved, so the layout is also cached for the names they resolve to.
+        """
+        fieldsets = getattr(self, 'fieldsets', ((None, {'fields': [], 'position': None}), ))
+        coded_names = cached_layout(self, 'coded_names', None, lambda: tuple(
+            name for name in flatten([flatten(opts.get('fields', [])) for label, opts in fieldsets])
+            if name.startswith('_')))
+        key = tuple(self.resolve_field_name(name) for name in coded_names)
+        return cached_layout(self, 'fieldsets', key, lambda: self.make_layout(fieldsets))
+
+    def make_layout(self, fieldsets):
+        """Returns a tuple of (label, opts) fieldsets, each opts with 'name_rows' of resolved field names per row. """
+        layout = []
+        for fieldset_label, opts in fieldsets:
+            if 'fields' not in opts or 'position' not in opts:
+                raise ImproperlyConfigured(_("There must be 'fields' and 'position' in each fieldset. "))
+            rows = ([ea] if isinstance(ea, str) else ea for ea in opts['fields'])
+            name_rows = tuple(tuple(self.resolve_field_name(name) for name in row) for row in rows)
+            layout.append((fieldset_label, {**opts, 'fields': tuple(opts['fields']), 'name_rows': name_rows}))
+        assigned_field_names = frozenset(flatten([flatten(opts['fields']) for fieldset_label, opts in fieldsets]))
+        return tuple(layout), assigned_field_names
 
     def make_fieldsets(self, *fs_args, **kwargs):
-        """Updates the dictionaries of each fieldset with 'rows' of field dicts, and a flattend 'field_names' list. """
-        print("======================= FormFieldsetMixIn.make_fieldsets =================================")
+        """Updates the dictionaries of each fieldset with 'rows' of field dicts, and a flattend 'field_names' list.
+            These are copies of the compile_fieldsets layout, so only the current form fields and data are processed.
+        """
         if hasattr(self, 'prep_fields'):
             self.prep_fields()
         if hasattr(self, 'assign_focus_field'):
             self.named_focus = self.assign_focus_field(name=self.named_focus, fields=self.fields_focus)
         remaining_fields = self.fields.copy()
-        fieldsets = list(getattr(self, 'fieldsets', ((None, {'fields': [], 'position': None}), )))
-        assigned_field_names = flatten([flatten(opts['fields']) for fieldset_label, opts in fieldsets])
+        layout, assigned_field_names = self.compile_fieldsets()
+        fieldsets = [(label, {**opts, 'fields': list(opts['fields'])}) for label, opts in layout]
         unassigned_field_names = [name for name in remaining_fields if name not in assigned_field_names]
-        opts = {'modifiers': 'prep_remaining', 'position': 'remaining', 'fields': unassigned_field_names}
+        opts = {'modifiers': 'prep_remaining', 'position': 'remaining', 'fields': unassigned_field_names,
+                'name_rows': [(name, ) for name in unassigned_field_names]}
         fieldsets.append((None, opts))
         top_errors = self.non_field_errors().copy()  # If data not submitted, this will trigger full_clean method.
         max_position, form_column_count, hidden_fields, remove_idx = 0, 0, [], []
         for index, fieldset in enumerate(fieldsets):
             fieldset_label, opts = fieldset
-            if 'fields' not in opts or 'position' not in opts:
-                raise ImproperlyConfigured(_("There must be 'fields' and 'position' in each fieldset. "))
             field_rows = []
-            for ea in opts['fields']:
-                row = [ea] if isinstance(ea, str) else ea
+            for row in opts.pop('name_rows'):
                 existing_fields = {}
                 for name in row:
-                    # It may be a specially coded input
-                    if name.startswith('_') and hasattr(self, name[1:]):
-                        name = getattr(self, name[1:], '')
                     if name not in remaining_fields:
                         continue  # Skip it if a field name is not in fields, or already used.
                     field = remaining_fields.pop(name)
@@ -904,7 +995,7 @@ class FormFieldsetMixIn:
             fieldsets.pop(index)
         max_position += 1
         if len(remaining_fields):
-            pprint(remaining_fields)
+            logger.error("Unassigned fields in make_fieldsets: %s", remaining_fields)
             raise ImproperlyConfigured(_("Some unassigned fields, perhaps some added during make_fieldset. "))
         lookup = {'end': max_position + 2, 'remaining': max_position + 1, None: max_position}
         fieldsets = [(k, v) for k, v in sorted(fieldsets,
@@ -955,12 +1046,11 @@ class FormFieldsetMixIn:
         html_el = self._html_tag(row_tag, html_el, row_attr)
         return html_el
 
-    def form_main_rows(self, html_args, fieldsets, form_col_count):
-        """Returns a list of formatted content of each main form 'row'. Called after preparing fields and row_data. """
+    def form_main_rows(self, html_args, fieldsets, form_col_count, html_opts):
+        """Yields the formatted content of each main form 'row'. Called after preparing fields and fieldsets. """
         *args, as_type, all_fieldsets = html_args
-        output = []
         for fieldset_label, opts in fieldsets:
-            row_data = opts['row_data']
+            row_data = self.fieldset_rows(fieldset_label, opts, html_opts, form_col_count)
             if all_fieldsets or fieldset_label is not None:
                 fieldset_classes = opts.get('classes', [])
                 if not fieldset_label:
@@ -977,23 +1067,134 @@ class FormFieldsetMixIn:
                     col_attr = ''
                     row_attr = ' class="fieldset_row"'
                     fieldset_el = self.make_headless_row(html_args, fieldset_el, form_col_count, col_attr, row_attr)
-                output.append(fieldset_el)
+                yield fieldset_el
             else:
-                output.extend(row_data)
-        return output
+                yield from row_data
+
+    def fieldset_rows(self, fieldset_label, opts, html_opts, form_col_count):
+        """Yields the formatted content of each row of fields, after a row of their errors if on a separate row. """
+        help_tag = 'span'
+        label_width_attrs_dict, width_labels = {}, []
+        if html_opts['adjust_label_width']:
+            label_width_attrs_dict, width_labels = self.determine_label_width(opts['rows'])
+        col_count = opts['column_count'] if fieldset_label else form_col_count
+        row_tag, col_head_tag, col_tag, single_col_tag = html_opts['tags']
+        col_html, single_col_html = html_opts['col_formats']
+        allow_colspan, col_double = html_opts['allow_colspan'], html_opts['col_double']
+        for row in opts['rows']:
+            multi_field_row = False if len(row) == 1 else True
+            columns_data, error_data, html_row_attr = [], [], ''
+            for name, field in row.items():
+                field_attrs_dict = {}
+                bf = self[name]
+                bf_errors = self.error_class(bf.errors)
+                if html_opts['errors_on_separate_row'] and bf_errors:
+                    colspan = 1 if multi_field_row else col_count
+                    colspan *= 2 if col_double else 1
+                    attr = ''
+                    if colspan > 1 and allow_colspan:
+                        attr += ' colspan="{}"'.format(colspan)
+                    tag = col_tag if multi_field_row else single_col_tag
+                    err = str(bf_errors) if not tag else self._html_tag(tag, bf_errors, attr)
+                    error_data.append(err)
+                css_classes = bf.css_classes()  # a string of space seperated css classes.
+                # can add to css_classes, used to make 'class="..."' attribute if the row or column should need it.
+                if multi_field_row:
+                    css_classes = ' '.join(['nowrap', css_classes])
+                if bf.label:
+                    attrs = label_width_attrs_dict if name in width_labels else {}
+                    label = conditional_escape(bf.label)
+                    label = bf.label_tag(label, attrs) or ''
+                else:
+                    raise ImproperlyConfigured(_("Visible Bound Fields must have a non-empty label. "))
+                if field.help_text:
+                    help_text = '<br />' if html_opts['help_text_br'] else ''
+                    help_text += str(field.help_text)
+                    id_ = field.widget.attrs.get('id') or bf.auto_id
+                    field_html_id = field.widget.id_for_label(id_) if id_ else ''
+                    help_id = field_html_id or bf.html_name
+                    help_id += '-help'
+                    field_attrs_dict.update({'aria-describedby': help_id})
+                    help_attr = ' id="{}" class="help-text"'.format(help_id)
+                    help_text = self._html_tag(help_tag, help_text, help_attr)
+                else:
+                    help_text = ''
+                html_class_attr = ' class="%s"' % css_classes if css_classes else ''
+                html_row_attr = ''
+                html_head_attr = ' class="nowrap"' if multi_field_row else ''
+                html_col_attr = html_class_attr
+                if allow_colspan and not multi_field_row and col_count > 1:
+                    colspan = col_count * 2 - 1 if col_double else col_count
+                    html_col_attr += ' colspan="{}"'.format(colspan)
+                if field_attrs_dict:
+                    field_display = bf.as_widget(attrs=field_attrs_dict)
+                    if field.show_hidden_initial:
+                        field_display += bf.as_hidden(only_initial=True)
+                else:
+                    field_display = bf
+                format_kwargs = {
+                    'errors': bf_errors,
+                    'label': label,
+                    'field': field_display,
+                    'help_text': help_text,
+                    'html_head_attr': html_head_attr,
+                    'html_col_attr': html_col_attr,
+                    'field_name': bf.html_name,
+                }
+                if multi_field_row:
+                    columns_data.append(col_html % format_kwargs)
+                else:
+                    columns_data.append(single_col_html % format_kwargs)
+                    if not col_head_tag and not single_col_tag:
+                        html_row_attr += html_col_attr
+            yield from self.make_row(columns_data, error_data, row_tag, html_row_attr)
+
+    def insert_hidden_fields(self, html_args, rows, hidden_fields, column_count):
+        """Yields the rows, with any hidden fields inserted at the end of the last row, or in a new row after it. """
+        rows = iter(rows)
+        last_row = next(rows, None)
+        for row in rows:
+            yield last_row
+            last_row = row
+        if not hidden_fields:
+            if last_row is not None:
+                yield last_row
+            return
+        str_hidden = ''.join(hidden_fields)
+        if last_row is None:  # If there aren't any rows in the output, just output the hidden fields.
+            yield str_hidden
+            return
+        row_tag, col_head_tag, col_tag, single_col_tag, *args = html_args
+        # Insert the hidden fields before the trailing row_ender (e.g. '</td></tr>') of the last row.
+        row_ender = '' if not single_col_tag else '</' + single_col_tag + '>'
+        row_ender += '</' + row_tag + '>'
+        if last_row.endswith(row_ender):
+            yield last_row[:-len(row_ender)] + str_hidden + row_ender
+        else:  # We may not be able conscript the last row for our purposes, so insert a new empty row.
+            yield last_row
+            yield self.make_headless_row(html_args, str_hidden, column_count)
 
     def _html_output(self, row_tag, col_head_tag, col_tag, single_col_tag, col_head_data, col_data,
                      help_text_br, errors_on_separate_row, as_type=None, strict_columns=False):
-        """Overriding BaseForm._html_output. Output HTML. Used by as_table(), as_ul(), as_p(), etc. """
-        print("************************** FormFieldsMixIn _html_output *************************************")
-        help_tag = 'span'
+        """Overriding BaseForm._html_output. Output HTML. Used by as_table(), as_ul(), as_p(), etc.
+            The rows of each fieldset are generated as the output is joined, instead of collected in lists first.
+        """
         allow_colspan = not strict_columns and as_type == 'table'
         adjust_label_width = getattr(self, 'adjust_label_width', True) and hasattr(self, 'determine_label_width')
         if as_type == 'table':
             adjust_label_width = False
         all_fieldsets = True if as_type == 'fieldset' else False
         html_args = [row_tag, col_head_tag, col_tag, single_col_tag, as_type, all_fieldsets]
-        col_html, single_col_html = self.column_formats(col_head_tag, col_tag, single_col_tag, col_head_data, col_data)
+        formats = (col_head_tag, col_tag, single_col_tag, col_head_data, col_data)
+        html_opts = {
+            'tags': (row_tag, col_head_tag, col_tag, single_col_tag),
+            'col_formats': cached_layout(self, 'column_formats', formats, lambda: self.column_formats(*formats)),
+            'help_text_br': help_text_br,
+            'errors_on_separate_row': errors_on_separate_row,
+            'allow_colspan': allow_colspan,
+            'col_double': col_head_tag and as_type == 'table',
+            'adjust_label_width': adjust_label_width,
+        }
         fieldsets = getattr(self, '_fieldsets', None) or self.make_fieldsets()
         summary = getattr(self, '_fs_summary', None)
         if fieldsets[-1][0] == 'summary':
@@ -1001,110 +1202,16 @@ class FormFieldsetMixIn:
         data_labels = ('top_errors', 'hidden_fields', 'columns')
         assert isinstance(summary, dict) and all(ea in summary for ea in data_labels), "Malformed fieldsets summary. "
         form_col_count = 1 if all_fieldsets else summary['columns']
-        col_double = col_head_tag and as_type == 'table'
-
-        for fieldset_label, opts in fieldsets:
-            label_width_attrs_dict, width_labels = {}, []
-            if adjust_label_width:
-                label_width_attrs_dict, width_labels = self.determine_label_width(opts['rows'])
-            col_count = opts['column_count'] if fieldset_label else form_col_count
-            row_data = []
-            for row in opts['rows']:
-                multi_field_row = False if len(row) == 1 else True
-                columns_data, error_data, html_row_attr = [], [], ''
-                for name, field in row.items():
-                    field_attrs_dict = {}
-                    bf = self[name]
-                    bf_errors = self.error_class(bf.errors)
-                    if errors_on_separate_row and bf_errors:
-                        colspan = 1 if multi_field_row else col_count
-                        colspan *= 2 if col_double else 1
-                        attr = ''
-                        if colspan > 1 and allow_colspan:
-                            attr += ' colspan="{}"'.format(colspan)
-                        tag = col_tag if multi_field_row else single_col_tag
-                        err = str(bf_errors) if not tag else self._html_tag(tag, bf_errors, attr)
-                        error_data.append(err)
-                    css_classes = bf.css_classes()  # a string of space seperated css classes.
-                    # can add to css_classes, used to make 'class="..."' attribute if the row or column should need it.
-                    if multi_field_row:
-                        css_classes = ' '.join(['nowrap', css_classes])
-                    if bf.label:
-                        attrs = label_width_attrs_dict if name in width_labels else {}
-                        label = conditional_escape(bf.label)
-                        label = bf.label_tag(label, attrs) or ''
-                    else:
-                        raise ImproperlyConfigured(_("Visible Bound Fields must have a non-empty label. "))
-                    if field.help_text:
-                        help_text = '<br />' if help_text_br else ''
-                        help_text += str(field.help_text)
-                        id_ = field.widget.attrs.get('id') or bf.auto_id
-                        field_html_id = field.widget.id_for_label(id_) if id_ else ''
-                        help_id = field_html_id or bf.html_name
-                        help_id += '-help'
-                        field_attrs_dict.update({'aria-describedby': help_id})
-                        help_attr = ' id="{}" class="help-text"'.format(help_id)
-                        help_text = self._html_tag(help_tag, help_text, help_attr)
-                    else:
-                        help_text = ''
-                    html_class_attr = ' class="%s"' % css_classes if css_classes else ''
-                    html_row_attr = ''
-                    html_head_attr = ' class="nowrap"' if multi_field_row else ''
-                    html_col_attr = html_class_attr
-                    if allow_colspan and not multi_field_row and col_count > 1:
-                        colspan = col_count * 2 - 1 if col_double else col_count
-                        html_col_attr += ' colspan="{}"'.format(colspan)
-                    if field_attrs_dict:
-                        field_display = bf.as_widget(attrs=field_attrs_dict)
-                        if field.show_hidden_initial:
-                            field_display += bf.as_hidden(only_initial=True)
-                    else:
-                        field_display = bf
-                    format_kwargs = {
-                        'errors': bf_errors,
-                        'label': label,
-                        'field': field_display,
-                        'help_text': help_text,
-                        'html_head_attr': html_head_attr,
-                        'html_col_attr': html_col_attr,
-                        'field_name': bf.html_name,
-                    }
-                    if multi_field_row:
-                        columns_data.append(col_html % format_kwargs)
-                    else:
-                        columns_data.append(single_col_html % format_kwargs)
-                        if not col_head_tag and not single_col_tag:
-                            html_row_attr += html_col_attr
-                row_data.extend(self.make_row(columns_data, error_data, row_tag, html_row_attr))
-            # end iterating field rows
-            opts['row_data'] = row_data
-        # end iterating fieldsets
-        output = []
+        rows = self.form_main_rows(html_args, fieldsets, form_col_count, html_opts)
         top_errors = summary['top_errors']
         if top_errors:
             col_attr = ' id="top_errors"'
             row_attr = ''
             data = ' '.join(top_errors)
             error_row = self.make_headless_row(html_args, data, form_col_count, col_attr, row_attr)
-            output.append(error_row)
-        output.extend(self.form_main_rows(html_args, fieldsets, form_col_count))
-        hidden_fields = summary['hidden_fields']
-        if hidden_fields:  # Insert any hidden fields in the last row.
-            str_hidden = ''.join(hidden_fields)
-            if output:
-                last_row = output[-1]
-                # Chop off the trailing row_ender (e.g. '</td></tr>') and insert the hidden fields.
-                row_ender = '' if not single_col_tag else '</' + single_col_tag + '>'
-                row_ender += '</' + row_tag + '>'
-                if last_row.endswith(row_ender):
-                    output[-1] = last_row[:-len(row_ender)] + str_hidden + row_ender
-                else:  # We may not be able conscript the last row for our purposes, so insert a new empty row.
-                    last_row = self.make_headless_row(html_args, str_hidden, form_col_count)
-                    output.append(last_row)
-            else:  # If there aren't any rows in the output, just append the hidden fields.
-                output.append(str_hidden)
-        print("---------- RETURN CONTENT FROM FormFieldsetMixIn -------------------------")
-        return mark_safe('\n'.join(output))
+            rows = chain((error_row, ), rows)
+        rows = self.insert_hidden_fields(html_args, rows, summary['hidden_fields'], form_col_count)
+        return mark_safe('\n'.join(rows))
 
     def as_table(self):
         """Overwrite BaseForm.as_table. Return this form rendered as HTML <tr>s -- excluding the <table></table>. """
@@ -1,11 +1,17 @@
 from django.contrib.auth.models import AbstractUser, UserManager, Group
 from django.db import models
+from django.db.models.signals import pre_save
+from django.dispatch import receiver
+from django.db.models import Q, Case, When, Value, BooleanField
 from django.db.utils import IntegrityError
 from django.utils.functional import cached_property
 from django.core.exceptions import ValidationError
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from django_countries.fields import CountryField
+from .validators import fold_case
+import logging
+logger = logging.getLogger(__name__)
 
 # TODO: Move some of the student vs staff logic to Group
 teacher_group, created_teacher = Group.objects.get_or_create(name='teacher')
@@ -14,6 +20,53 @@ staff_group, created_staff = Group.objects.get_or_create(name='staff')
 groups_from_role = {'is_teacher': teacher_group, 'is_admin': admin_group, 'is_staff': staff_group}
 
 
+class IdentityMatch:
+    """The Users that may be the person with the given email and name, sorted by how they match, from one query.
+        Candidates are Users with the same email, or the same last name, compared by their casefolded fields. If
+        'possible_users' was given to 'UserHC.objects.match_identity', the 'possible' list has the ones it included.
+    """
+
+    def __init__(self, users, email='', first_name='', last_name=''):
+        self.users = list(users)
+        self.email = fold_case(email)
+        self.first_name = fold_case(first_name)
+        self.last_name = fold_case(last_name)
+        self.same_email = [u for u in self.users if self.email and u.email_folded == self.email]
+        self.same_name = [u for u in self.users if self.is_name(u)]
+        self.exact = [u for u in self.same_email if self.is_name(u)]
+        self.possible = [u for u in self.users if getattr(u, 'is_possible', False)]
+
+    def is_name(self, user):
+        """True if the user has the same first and last name, ignoring case. """
+        return user.first_name_folded == self.first_name and user.last_name_folded == self.last_name
+
+    def single(self, users, first=None, last=None):
+        """Returns the only one of the users containing the given names, ignoring case, otherwise None. """
+        found = [u for u in users if (first is None or first in u.first_name_folded)
+                 and (last is None or last in u.last_name_folded)]
+        return found[0] if len(found) == 1 else None
+
+    def find(self, possible=None):
+        """Returns the User that is the only match, by decreasing closeness of the name, first looking in possible.
+            Without a possible list, the 'possible' candidates are used. Returns None if there is no single match.
+        """
+        possible = self.possible if possible is None else possible
+        first, last = self.first_name, self.last_name
+        exact = [u for u in possible if self.is_name(u)]
+        friend = None
+        if possible:
+            friend = (exact[0] if len(exact) == 1 else None) \
+                or self.single(possible, first, last) \
+                or self.single(possible, last=last) \
+                or self.single(possible, first=first)
+        if not friend:
+            friend = (self.same_name[0] if len(self.same_name) == 1 else None) or self.single(self.users, first, last)
+        return friend
+
+    def __repr__(self):
+        return f"<IdentityMatch: {len(self.users)} user(s) | {len(self.exact)} exact >"
+
+
 class UserManagerHC(UserManager):
     """Adding & Modifying some features to the default UserManager.
         Inherits from: UserManager, BaseUserManager, models.Manager, ...
@@ -116,57 +169,52 @@ class UserManagerHC(UserManager):
             username = email
         return self.set_user(username, email, password, **extra_fields)
 
+    def match_identity(self, email=None, first_name=None, last_name=None, possible_users=None):
+        """Returns an IdentityMatch of the Users with the same email, or the same last name, ignoring case.
+            These are found in one query, using the indexes on the casefolded email and names. Users in the
+            optional possible_users QuerySet are also included, and marked as 'possible' candidates.
+        """
+        conditions = Q()
+        if email:
+            conditions |= Q(email_folded=fold_case(email.strip()))
+        if last_name:
+            conditions |= Q(last_name_folded=fold_case(last_name))
+        possible = Value(False, output_field=BooleanField())
+        if possible_users is not None:
+            conditions |= Q(pk__in=possible_users.values('pk'))
+            possible = Case(When(pk__in=possible_users.values('pk'), then=True), default=False,
+                            output_field=BooleanField())
+        users = []
+        if conditions:
+            users = self.annotate(is_possible=possible).filter(conditions).order_by('pk')
+        return IdentityMatch(users, email=email, first_name=first_name, last_name=last_name)
+
     def find_or_create_for_anon(self, email=None, **kwargs):
         """This is called when someone registers when they are not logged in. If they are a new customer, we want
             no friction, just create a user account. If they might be an existing user, we need to get them logged in.
         """
         email = self.normalize_email(email) if email else None
         first_name, last_name = kwargs.get('first_name'), kwargs.get('last_name')
-        q = UserHC.objects
-        found_email = q.filter(email=email).count() if email else 0
-        q = q.filter(last_name__iexact=last_name) if last_name else q
-        q = q.filter(first_name__iexact=first_name) if first_name else q
-        found_name = q.count() if first_name or last_name else 0
-        if found_email or found_name:
+        match = self.match_identity(email=email, first_name=first_name, last_name=last_name)
+        if match.same_email or match.same_name:
             # TODO: redirect to login, auto-filling appropriate fields. This should also work if they have no account.
-            print('---- Maybe they have had classes before? -----')
-            found = q.filter(email=email).first()
+            logger.debug("find_or_create_for_anon: Maybe they have had classes before? ")
+            found = match.exact[0] if match.exact else None
             return (found, 'existing')  # TODO: ?Update this to cause a redirect?
         else:
-            print('----- Creating a new user! -----')
-            return self.create_user(self, email=email, **kwargs)  # create a new user with this data
+            logger.debug("find_or_create_for_anon: Creating a new user. ")
+            return self.create_user(email=email, **kwargs)  # create a new user with this data
         # end find_or_create_for_anon
 
     def find_or_create_by_name(self, first_name=None, last_name=None, possible_users=None, **kwargs):
-        """This is called when a user signs up someone else """
-        # print("======== UserHC.objects.find_or_create_by_name =====")
-
-        def _get_single(q, **kwargs):
-            """Helper to get if there is only one. """
-            try:
-                obj = q.get(**kwargs)
-            except UserHC.MultipleObjectsReturned:
-                obj = None
-            except UserHC.DoesNotExist:
-                obj = None
-            return obj
-
-        friend = None
-        if possible_users:
-            if not isinstance(possible_users, models.QuerySet):
-                raise TypeError(_('Possible_users must be a QuerySet of Users'))
-
-            friend = _get_single(possible_users, first_name__iexact=first_name, last_name__iexact=last_name) \
-                or _get_single(possible_users, first_name__icontains=first_name, last_name__icontains=last_name) \
-                or _get_single(possible_users, last_name__icontains=last_name) \
-                or _get_single(possible_users, first_name__icontains=first_name) \
-                or None
-        if not friend:
-            friend = _get_single(UserHC.objects, first_name__iexact=first_name, last_name__iexact=last_name) \
-                or _get_single(UserHC.objects, first_name__icontains=first_name, last_name__icontains=last_name) \
-                or None
+        """This is called when a user signs up someone else. Looks first in possible_users, then all Users. """
+        if possible_users is not None and not isinstance(possible_users, models.QuerySet):
+            raise TypeError(_('Possible_users must be a QuerySet of Users'))
+        match = self.match_identity(first_name=first_name, last_name=last_name, possible_users=possible_users)
+        friend = match.find()
         # TODO: Should there be some kind of confirmation page if friend found?
-        return friend if friend else self.create_user(self, **kwargs)  # original call should have email in kwargs.
+        kwargs.update(first_name=first_name, last_name=last_name)
+        return friend if friend else self.create_user(**kwargs)  # original call should have email in kwargs.
 
 
 class UserHC(AbstractUser):
@@ -196,11 +244,20 @@ class UserHC(AbstractUser):
                                         )
     # billing_country_code = models.CharField(_('country'), default=settings.DEFAULT_COUNTRY, max_length=2, blank=True,)
     billing_country_code = CountryField(_('country'), default=settings.DEFAULT_COUNTRY, max_length=2, blank=True,)
+    # Casefolded copies, set when saved, so case-insensitive lookups can use plain indexes. See FOLDED_FIELDS.
+    # These are set by the pre_save signal, including for loaded fixtures, but not by QuerySet.update or bulk_update.
+    email_folded = models.CharField(max_length=191, blank=True, editable=False, db_index=True, )
+    username_folded = models.CharField(max_length=150, blank=True, editable=False, db_index=True, )
+    first_name_folded = models.CharField(max_length=150, blank=True, editable=False, )
+    last_name_folded = models.CharField(max_length=150, blank=True, editable=False, )
     # # # user.student or user.staff holds the linked profile for this user.
     objects = UserManagerHC()
+    FOLDED_FIELDS = {'email': 'email_folded', 'username': 'username_folded',
+                     'first_name': 'first_name_folded', 'last_name': 'last_name_folded', }
 
     class Meta(AbstractUser.Meta):
         swappable = 'AUTH_USER_MODEL'
+        indexes = [models.Index(fields=['last_name_folded', 'first_name_folded'], name='users_name_folded_idx'), ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -212,6 +269,13 @@ class UserHC(AbstractUser):
         self._meta.get_field(username).help_text = _("Only needed if user does not have a unique email. ")
         self._meta.get_field(username).verbose_name = _("Email or Login")
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Keeps the loaded values, so a save can tell which of them changed. """
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
     @property
     def full_name(self):
         return self.get_full_name() or _("Name Not Found")
@@ -243,10 +307,21 @@ class UserHC(AbstractUser):
         username = '_'.join(name_gen).casefold()
         return self.normalize_username(username)
 
+    def set_folded(self):
+        """Sets the casefolded copy of each of the FOLDED_FIELDS. Called before each save, but needed before a
+            QuerySet.update or bulk_update, which do not send the pre_save signal. Those must include the folded fields.
+        """
+        for name, folded in self.FOLDED_FIELDS.items():
+            setattr(self, folded, fold_case(getattr(self, name)))
+
     def save(self, *args, **kwargs):
         if not self.username:
             self.username = self.make_username()
         self.is_staff = True if any([self.is_teacher, self.is_admin, self.is_superuser]) else False
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            folded = (self.FOLDED_FIELDS[name] for name in update_fields if name in self.FOLDED_FIELDS)
+            kwargs['update_fields'] = set(update_fields).union(folded)
         # TODO: Deal with username (email) being checked as existing even when we want a new user
         super().save(*args, **kwargs)
         for role, group in groups_from_role.items():
@@ -282,3 +357,11 @@ class StudentUser(UserHC):
         proxy = True
         verbose_name = 'Student User'
         verbose_name_plural = 'Student Users'
+
+
+@receiver(pre_save, sender=UserHC)
+@receiver(pre_save, sender=StaffUser)
+@receiver(pre_save, sender=StudentUser)
+def set_folded_fields(sender, instance, **kwargs):
+    """Also done for raw saves, as when loading fixtures, which do not call the UserHC save method. """
+    instance.set_folded()
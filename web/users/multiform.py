@@ -1,8 +1,11 @@
 """
 Not yet implemented classes and factories for FormSets of mixed forms and models.
 """
-from django.forms import ModelForm, ModelChoiceField, modelform_factory, BaseFormSet,  DEFAULT_MIN_NUM, DEFAULT_MAX_NUM
+from django.forms import ModelForm, ModelChoiceField, modelform_factory, BaseFormSet
+from django.forms.formsets import DEFAULT_MIN_NUM, DEFAULT_MAX_NUM
 from django.core.exceptions import ImproperlyConfigured, ValidationError, NON_FIELD_ERRORS
+from django.db import connection, connections, router, transaction
+from django.db.models import Q
 from django.forms.widgets import HiddenInput
 from django.utils.text import get_text_list
 from django.utils.translation import gettext, gettext_lazy as _
@@ -11,6 +14,10 @@ from django.utils.translation import gettext, gettext_lazy as _
 class BaseMultiFormSet(BaseFormSet):
     """A collection of instances of various Form classes. """
 
+    def get_form_class(self, i):
+        """The Form class for the i-th form. The form classes are repeated, in order, for any further forms. """
+        return self.form[i % len(self.form)]
+
     def _construct_form(self, i, **kwargs):
         """Instantiate and return the i-th form instance in a formset."""
         defaults = {
@@ -35,7 +42,7 @@ class BaseMultiFormSet(BaseFormSet):
         if i >= self.initial_form_count() and i >= self.min_num:
             defaults['empty_permitted'] = True
         defaults.update(kwargs)
-        form = self.form[i](**defaults)
+        form = self.get_form_class(i)(**defaults)
         self.add_fields(form, i)
         return form
 
@@ -82,6 +89,10 @@ class BaseMultiModelFormSet(BaseMultiFormSet):
 
     # Set of fields that must be unique among forms of this set.
     unique_fields = set()
+    # Save with bulk_update and bulk_create, which skip the model save method and signals. Only set for models whose
+    # save work is done by prepare_bulk_save, or not needed.
+    bulk_save = False
+    bulk_batch_size = 500
 
     def __init__(self, data=None, files=None, auto_id='id_%s', prefix=None,
                  queryset=None, *, initial=None, **kwargs):
@@ -95,10 +106,27 @@ class BaseMultiModelFormSet(BaseMultiFormSet):
             return len(self.get_queryset())
         return super().initial_form_count()
 
-    def _existing_object(self, pk):
+    def _existing_object(self, pk, model=None):
+        """The existing object for the pk. Those of all the initial forms are loaded with one query per model. """
         if not hasattr(self, '_object_dict'):
-            self._object_dict = {o.pk: o for o in self.get_queryset()}
-        return self._object_dict.get(pk)
+            self._object_dict = {}
+            for obj_model, pks in self.submitted_pks().items():
+                objs = self.get_queryset(obj_model).filter(pk__in=pks)
+                self._object_dict.update(((obj_model, obj.pk), obj) for obj in objs)
+        return self._object_dict.get((model or self.model, pk))
+
+    def submitted_pks(self):
+        """A dict of each model and the set of valid primary keys submitted for its initial forms. """
+        pks = {}
+        for i in range(self.initial_form_count()):
+            model = self.get_form_class(i)._meta.model
+            pk_key = '%s-%s' % (self.add_prefix(i), model._meta.pk.name)
+            try:
+                pk = self._get_to_python(model._meta.pk)(self.data[pk_key])
+            except (KeyError, ValidationError):
+                continue
+            pks.setdefault(model, set()).add(pk)
+        return pks
 
     def _get_to_python(self, field):
         """
@@ -110,10 +138,11 @@ class BaseMultiModelFormSet(BaseMultiFormSet):
         return field.to_python
 
     def _construct_form(self, i, **kwargs):
+        model = self.get_form_class(i)._meta.model
         pk_required = i < self.initial_form_count()
         if pk_required:
             if self.is_bound:
-                pk_key = '%s-%s' % (self.add_prefix(i), self.model._meta.pk.name)
+                pk_key = '%s-%s' % (self.add_prefix(i), model._meta.pk.name)
                 try:
                     pk = self.data[pk_key]
                 except KeyError:
@@ -121,7 +150,7 @@ class BaseMultiModelFormSet(BaseMultiFormSet):
                     # with POST data.
                     pass
                 else:
-                    to_python = self._get_to_python(self.model._meta.pk)
+                    to_python = self._get_to_python(model._meta.pk)
                     try:
                         pk = to_python(pk)
                     except ValidationError:
@@ -129,7 +158,7 @@ class BaseMultiModelFormSet(BaseMultiFormSet):
                         # user may have tampered with POST data.
                         pass
                     else:
-                        kwargs['instance'] = self._existing_object(pk)
+                        kwargs['instance'] = self._existing_object(pk, model)
             else:
                 kwargs['instance'] = self.get_queryset()[i]
         elif self.initial_extra:
@@ -140,27 +169,33 @@ class BaseMultiModelFormSet(BaseMultiFormSet):
                 pass
         form = super()._construct_form(i, **kwargs)
         if pk_required:
-            form.fields[self.model._meta.pk.name].required = True
+            form.fields[model._meta.pk.name].required = True
+        # The formset validate_unique checks all the forms together, instead of a query for each form.
+        form.validate_unique = lambda: None
         return form
 
-    def get_queryset(self):
-        if not hasattr(self, '_queryset'):
-            if self.queryset is not None:
+    def get_queryset(self, model=None):
+        """The ordered existing objects of the model, which defaults to that of the queryset, or else the formset. """
+        model = model or getattr(self.queryset, 'model', self.model)
+        if not hasattr(self, '_querysets'):
+            self._querysets = {}
+        if model not in self._querysets:
+            if self.queryset is not None and self.queryset.model is model:
                 qs = self.queryset
             else:
-                qs = self.model._default_manager.get_queryset()
+                qs = model._default_manager.get_queryset()
 
             # If the queryset isn't already ordered we need to add an
             # artificial ordering here to make sure that all formsets
             # constructed from this queryset have the same form order.
             if not qs.ordered:
-                qs = qs.order_by(self.model._meta.pk.name)
+                qs = qs.order_by(model._meta.pk.name)
 
             # Removed queryset limiting here. As per discussion re: #13023
             # on django-dev, max_num should not prevent existing
             # related objects/inlines from being displayed.
-            self._queryset = qs
-        return self._queryset
+            self._querysets[model] = qs
+        return self._querysets[model]
 
     def save_new(self, form, commit=True):
         """Save and return a new model instance for the given form."""
@@ -187,7 +222,9 @@ class BaseMultiModelFormSet(BaseMultiFormSet):
                 for form in self.saved_forms:
                     form.save_m2m()
             self.save_m2m = save_m2m
-        return self.save_existing_objects(commit) + self.save_new_objects(commit)
+            return self.save_existing_objects(commit) + self.save_new_objects(commit)
+        with transaction.atomic():
+            return self.save_existing_objects(commit) + self.save_new_objects(commit)
 
     save.alters_data = True
 
@@ -195,78 +232,133 @@ class BaseMultiModelFormSet(BaseMultiFormSet):
         self.validate_unique()
 
     def validate_unique(self):
-        # Collect unique_checks and date_checks to run from all the forms.
-        all_unique_checks = set()
-        all_date_checks = set()
+        """Check the unique constraints for all the valid forms, with one query for each model and constraint.
+            Values repeated within the forms are errors for the formset, and values of other saved objects are errors
+            for the forms, as the form validate_unique would give.
+        """
         forms_to_delete = self.deleted_forms
         valid_forms = [form for form in self.forms if form.is_valid() and form not in forms_to_delete]
+        unique_forms, date_forms, form_date_checks = {}, {}, []
         for form in valid_forms:
             exclude = form._get_validation_exclusions()
             unique_checks, date_checks = form.instance._get_unique_checks(exclude=exclude)
-            all_unique_checks.update(unique_checks)
-            all_date_checks.update(date_checks)
+            for check in unique_checks:
+                unique_forms.setdefault(check, []).append(form)
+            for check in date_checks:
+                date_forms.setdefault(check, []).append(form)
+            if date_checks:
+                form_date_checks.append((form, date_checks))
 
         errors = []
         # Do each of the unique checks (unique and unique_together)
-        for _unused_, unique_check in all_unique_checks:
-            seen_data = set()
-            for form in valid_forms:
-                # Get the data for the set of fields that must be unique among the forms.
-                row_data = (
-                    field if field in self.unique_fields else form.cleaned_data[field]
-                    for field in unique_check if field in form.cleaned_data
-                )
-                # Reduce Model instances to their primary key values
-                row_data = tuple(
-                    d._get_pk_val() if hasattr(d, '_get_pk_val')
-                    # Prevent "unhashable type: list" errors later on.
-                    else tuple(d) if isinstance(d, list)
-                    else d for d in row_data
-                )
-                if row_data and None not in row_data:
-                    # if we've already seen it then we have a uniqueness failure
-                    if row_data in seen_data:
-                        # poke error messages into the right places and mark
-                        # the form as invalid
-                        errors.append(self.get_unique_error_message(unique_check))
-                        form._errors[NON_FIELD_ERRORS] = self.error_class([self.get_form_error()])
-                        # remove the data from the cleaned_data dict since it was invalid
-                        for field in unique_check:
-                            if field in form.cleaned_data:
-                                del form.cleaned_data[field]
-                    # mark the data as seen
-                    seen_data.add(row_data)
+        for (model_class, unique_check), forms in unique_forms.items():
+            errors.extend(self.check_unique(model_class, unique_check, forms))
         # iterate over each of the date checks now
-        for date_check in all_date_checks:
-            seen_data = set()
-            _unused_, lookup, field, unique_for = date_check
-            for form in valid_forms:
-                # see if we have data for both fields
-                if (form.cleaned_data and form.cleaned_data[field] is not None and
-                        form.cleaned_data[unique_for] is not None):
-                    # if it's a date lookup we need to get the data for all the fields
-                    if lookup == 'date':
-                        date = form.cleaned_data[unique_for]
-                        date_data = (date.year, date.month, date.day)
-                    # otherwise it's just the attribute on the date/datetime
-                    # object
-                    else:
-                        date_data = (getattr(form.cleaned_data[unique_for], lookup),)
-                    data = (form.cleaned_data[field],) + date_data
-                    # if we've already seen it then we have a uniqueness failure
-                    if data in seen_data:
-                        # poke error messages into the right places and mark
-                        # the form as invalid
-                        errors.append(self.get_date_error_message(date_check))
-                        form._errors[NON_FIELD_ERRORS] = self.error_class([self.get_form_error()])
-                        # remove the data from the cleaned_data dict since it was invalid
-                        del form.cleaned_data[field]
-                    # mark the data as seen
-                    seen_data.add(data)
+        for date_check, forms in date_forms.items():
+            errors.extend(self.check_unique_for_date(date_check, forms))
+        # The saved values for unique_for_date are queried for each form, as the model does.
+        for form, date_checks in form_date_checks:
+            date_errors = form.instance._perform_date_checks(date_checks)
+            if date_errors:
+                form._update_errors(ValidationError(date_errors))
 
         if errors:
             raise ValidationError(errors)
 
+    def check_unique(self, model_class, unique_check, forms):
+        """Returns the formset errors for repeated values, and adds form errors for values other objects have. """
+        errors = []
+        seen_data = set()
+        lookups = {}
+        for form in forms:
+            # Get the data for the set of fields that must be unique among the forms.
+            row_data = (
+                field if field in self.unique_fields else form.cleaned_data[field]
+                for field in unique_check if field in form.cleaned_data
+            )
+            # Reduce Model instances to their primary key values
+            row_data = tuple(
+                d._get_pk_val() if hasattr(d, '_get_pk_val')
+                # Prevent "unhashable type: list" errors later on.
+                else tuple(d) if isinstance(d, list)
+                else d for d in row_data
+            )
+            if row_data and None not in row_data:
+                # if we've already seen it then we have a uniqueness failure
+                if row_data in seen_data:
+                    # poke error messages into the right places and mark
+                    # the form as invalid
+                    errors.append(self.get_unique_error_message(unique_check))
+                    form._errors[NON_FIELD_ERRORS] = self.error_class([self.get_form_error()])
+                    # remove the data from the cleaned_data dict since it was invalid
+                    for field in unique_check:
+                        if field in form.cleaned_data:
+                            del form.cleaned_data[field]
+                    continue
+                # mark the data as seen
+                seen_data.add(row_data)
+            lookup = self.get_unique_lookup(form.instance, model_class, unique_check)
+            if lookup:
+                lookups[form] = lookup
+        if not lookups:
+            return errors
+        condition = Q()
+        for lookup in lookups.values():
+            condition |= Q(**lookup)
+        saved = {}
+        for pk, *values in model_class._default_manager.filter(condition).values_list('pk', *unique_check):
+            saved.setdefault(tuple(values), set()).add(pk)
+        key = unique_check[0] if len(unique_check) == 1 else NON_FIELD_ERRORS
+        for form, lookup in lookups.items():
+            own_pk = None if form.instance._state.adding else form.instance._get_pk_val(model_class._meta)
+            if saved.get(tuple(lookup.values()), set()) - {own_pk}:
+                message = form.instance.unique_error_message(model_class, unique_check)
+                form._update_errors(ValidationError({key: [message]}))
+        return errors
+
+    def get_unique_lookup(self, instance, model_class, unique_check):
+        """The filter kwargs for other saved objects with the values of the instance, or None if not checked. """
+        lookup = {}
+        for field_name in unique_check:
+            field = model_class._meta.get_field(field_name)
+            value = getattr(instance, field.attname)
+            if value is None or (value == '' and connection.features.interprets_empty_strings_as_nulls):
+                return None
+            if field.primary_key and not instance._state.adding:
+                return None  # No need to check for unique primary key when editing.
+            lookup[str(field_name)] = value
+        return lookup
+
+    def check_unique_for_date(self, date_check, forms):
+        """Returns the formset errors for values repeated within the forms on the same date, or other date part. """
+        errors = []
+        seen_data = set()
+        _unused_, lookup, field, unique_for = date_check
+        for form in forms:
+            # see if we have data for both fields
+            if (form.cleaned_data and form.cleaned_data[field] is not None and
+                    form.cleaned_data[unique_for] is not None):
+                # if it's a date lookup we need to get the data for all the fields
+                if lookup == 'date':
+                    date = form.cleaned_data[unique_for]
+                    date_data = (date.year, date.month, date.day)
+                # otherwise it's just the attribute on the date/datetime
+                # object
+                else:
+                    date_data = (getattr(form.cleaned_data[unique_for], lookup),)
+                data = (form.cleaned_data[field],) + date_data
+                # if we've already seen it then we have a uniqueness failure
+                if data in seen_data:
+                    # poke error messages into the right places and mark
+                    # the form as invalid
+                    errors.append(self.get_date_error_message(date_check))
+                    form._errors[NON_FIELD_ERRORS] = self.error_class([self.get_form_error()])
+                    # remove the data from the cleaned_data dict since it was invalid
+                    del form.cleaned_data[field]
+                # mark the data as seen
+                seen_data.add(data)
+        return errors
+
     def get_unique_error_message(self, unique_check):
         if len(unique_check) == 1:
             return gettext("Please correct the duplicate data for %(field)s.") % {
@@ -297,6 +389,7 @@ class BaseMultiModelFormSet(BaseMultiFormSet):
             return []
 
         saved_instances = []
+        bulk_forms = []
         forms_to_delete = self.deleted_forms
         for form in self.initial_forms:
             obj = form.instance
@@ -311,13 +404,49 @@ class BaseMultiModelFormSet(BaseMultiFormSet):
                 self.delete_existing(obj, commit=commit)
             elif form.has_changed():
                 self.changed_objects.append((obj, form.changed_data))
+                if commit and self.bulk_save:
+                    saved_instances.append(form.save(commit=False))
+                    bulk_forms.append(form)
+                    continue
                 saved_instances.append(self.save_existing(form, obj, commit=commit))
                 if not commit:
                     self.saved_forms.append(form)
+        self.bulk_update_existing(bulk_forms)
         return saved_instances
 
+    def prepare_bulk_save(self, model, objs):
+        """Bulk saves skip the model save method, so set any values it computes on the objects before they are written.
+            Returns the names of the fields it sets, which are also written for the changed objects.
+        """
+        return ()
+
+    def bulk_update_existing(self, forms):
+        """Save the changed objects of the forms with a bulk_update for each model, then their many-to-many data.
+            All the form fields are written, as the model clean may have changed more than the changed_data.
+            The auto_now fields are set as the model save would have done.
+        """
+        by_model = {}
+        for form in forms:
+            by_model.setdefault(form.instance._meta.model, []).append(form)
+        for model, model_forms in by_model.items():
+            concrete = {field.name: field for field in model._meta.concrete_fields if not field.primary_key}
+            fields = {name for form in model_forms for name in form.fields if name in concrete}
+            if not fields:
+                continue
+            objs = [form.instance for form in model_forms]
+            auto_now = [field for field in concrete.values() if getattr(field, 'auto_now', False)]
+            for field in auto_now:
+                for obj in objs:
+                    field.pre_save(obj, add=False)
+                fields.add(field.name)
+            fields.update(self.prepare_bulk_save(model, objs))
+            model._default_manager.bulk_update(objs, sorted(fields), batch_size=self.bulk_batch_size)
+        for form in forms:
+            form.save_m2m()
+
     def save_new_objects(self, commit=True):
         self.new_objects = []
+        bulk_forms = []
         for form in self.extra_forms:
             if not form.has_changed():
                 continue
@@ -325,15 +454,37 @@ class BaseMultiModelFormSet(BaseMultiFormSet):
             # object.
             if self.can_delete and self._should_delete_form(form):
                 continue
+            if commit and self.can_bulk_create(form.instance._meta.model):
+                self.new_objects.append(form.save(commit=False))
+                bulk_forms.append(form)
+                continue
             self.new_objects.append(self.save_new(form, commit=commit))
             if not commit:
                 self.saved_forms.append(form)
+        self.bulk_create_new(bulk_forms)
         return self.new_objects
 
+    def can_bulk_create(self, model):
+        """Only some databases set the primary keys from bulk_create, which are needed for many-to-many data. """
+        features = connections[router.db_for_write(model)].features
+        return self.bulk_save and not model._meta.parents and features.can_return_rows_from_bulk_insert
+
+    def bulk_create_new(self, forms):
+        """Save the new objects of the forms with a bulk_create for each model, then their many-to-many data. """
+        by_model = {}
+        for form in forms:
+            by_model.setdefault(form.instance._meta.model, []).append(form.instance)
+        for model, objs in by_model.items():
+            self.prepare_bulk_save(model, objs)
+            model._default_manager.bulk_create(objs, batch_size=self.bulk_batch_size)
+        for form in forms:
+            form.save_m2m()
+
     def add_fields(self, form, index):
         """Add a hidden field for the object's primary key."""
         from django.db.models import AutoField, ForeignKey, OneToOneField
-        self._pk_field = pk = self.model._meta.pk
+        model = form._meta.model
+        self._pk_field = pk = model._meta.pk
         # If a pk isn't editable, then it won't be on the form, so we need to
         # add it here so we can tell which object is which when we get the
         # data back. Generally, pk.editable should be false, but for some
@@ -364,7 +515,7 @@ class BaseMultiModelFormSet(BaseMultiFormSet):
             if isinstance(pk, (ForeignKey, OneToOneField)):
                 qs = pk.remote_field.model._default_manager.get_queryset()
             else:
-                qs = self.model._default_manager.get_queryset()
+                qs = model._default_manager.get_queryset()
             qs = qs.using(form.instance._state.db)
             if form._meta.widgets:
                 widget = form._meta.widgets.get(self._pk_field.name, HiddenInput)
@@ -409,20 +560,23 @@ def multiformset_factory(form_classes, formset=BaseMultiFormSet, extra=1, can_or
     return type(form_class_names + '_FormSet', (formset,), attrs)
 
 
-def multimodelformset_factory(models, forms=None, formfield_callback=None,
+def multimodelformset_factory(models, forms=None, form=ModelForm, formfield_callback=None,
                               formset=BaseMultiModelFormSet, extra=1, can_delete=False,
                               can_order=False, max_num=None, fields=None, exclude=None,
                               widgets=None, validate_max=False, localized_fields=None,
                               labels=None, help_texts=None, error_messages=None,
                               min_num=None, validate_min=False, field_classes=None,
                               absolute_max=None, can_delete_extra=True):
-    """Return a FormSet class for the given list of Django model classes."""
+    """Return a FormSet class for the given list of Django model classes.
+        The form for each model is the one in 'forms' with a matching Meta model, otherwise a 'form' subclass.
+    """
     # TODO: Update to all multiple model classes.
 
+    base_form = form
     form_classes = []
     for model in models:
-        form = [form for form in forms if form.model == model] if forms else None
-        form = form[0] if form else ModelForm
+        form = [form for form in forms if form._meta.model == model] if forms else None
+        form = form[0] if form else base_form
         meta = getattr(form, 'Meta', None)
         if (getattr(meta, 'fields', fields) is None and
                 getattr(meta, 'exclude', exclude) is None):
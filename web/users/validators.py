@@ -1,8 +1,10 @@
 import re
 import unicodedata
+from functools import lru_cache
 from confusable_homoglyphs import confusables
 from django.core.exceptions import ValidationError
 from django.core.validators import EmailValidator, RegexValidator
+from django.db.models import Q
 from django.utils.deconstruct import deconstructible
 from django.utils.translation import gettext_lazy as _
 
@@ -84,8 +86,8 @@ SENSITIVE_FILENAMES = [  # Sensitive filenames.
     "crossdomain.xml",  # Flash cross-domain policy file.
     "favicon.ico",
     "humans.txt",
-    "index.html"  # Added by Chris L Chapman
-    "index.htm"  # Added by Chris L Chapman
+    "index.html",  # Added by Chris L Chapman
+    "index.htm",  # Added by Chris L Chapman
     "keybase.txt",  # Keybase ownership-verification URL.
     "robots.txt",
     ".htaccess",
@@ -157,14 +159,31 @@ DEFAULT_RESERVED_NAMES = (
     + SENSITIVE_FILENAMES
     + OTHER_SENSITIVE_NAMES
 )
+RESERVED_NAMES = frozenset(DEFAULT_RESERVED_NAMES)
+CONFUSABLES_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=CONFUSABLES_CACHE_SIZE)
+def is_dangerous(value):
+    """Memoized confusables.is_dangerous, for a value checked by several validators or forms.
+        Only ASCII characters are either Latin or Common script, so those values can not be mixed-script.
+    """
+    if value.isascii():
+        return False
+    return bool(confusables.is_dangerous(value))
+
+
+def fold_case(value):
+    """The normalized and casefolded value, as used for case-insensitive comparisons and the UserHC folded fields. """
+    return unicodedata.normalize("NFKC", value or '').casefold()
 
 
 @deconstructible
 class ReservedNameValidator:
     """Disallow reserved names from form field values. """
 
-    def __init__(self, reserved_names=DEFAULT_RESERVED_NAMES):
-        self.reserved_names = reserved_names
+    def __init__(self, reserved_names=RESERVED_NAMES):
+        self.reserved_names = frozenset(reserved_names)
 
     def __call__(self, value):
         if not isinstance(value, str):
@@ -173,30 +192,37 @@ class ReservedNameValidator:
             raise ValidationError(RESERVED_NAME, code="invalid")
 
     def __eq__(self, other):
+        if not isinstance(other, ReservedNameValidator):
+            return NotImplemented
         return self.reserved_names == other.reserved_names
 
 
 @deconstructible
 class CaseInsensitiveUnique:
-    """Check the value is unique, including ensuring it is case-insensitive unique. """
+    """Check the value is unique, including ensuring it is case-insensitive unique.
+        If the model has a casefolded copy of the field, listed in its FOLDED_FIELDS, the indexed copy is queried.
+    """
 
-    def __init__(self, model, field_name, error_message):
+    def __init__(self, model, field_name, error_message, lookup=None):
         self.model = model
         self.field_name = field_name
         self.error_message = error_message
+        self.lookup = lookup
 
     def __call__(self, value):
         if not isinstance(value, str):
             raise ValidationError(_("Expected a string"), code="unique")
-        value = unicodedata.normalize("NFKC", value)
-        if hasattr(value, "casefold"):
-            value = value.casefold()  # pragma: no cover
-        if self.model._default_manager.filter(
-            **{"{}__iexact".format(self.field_name): value}
-        ).exists():
+        lookup = self.lookup or UniqueValues(self.model)
+        if lookup.is_used(self.field_name, value):
             raise ValidationError(self.error_message, code="unique")
 
+    def using(self, lookup):
+        """Returns a copy of this validator that checks with the given UniqueValues, such as the one for a form. """
+        return self.__class__(self.model, self.field_name, self.error_message, lookup=lookup)
+
     def __eq__(self, other):
+        if not isinstance(other, CaseInsensitiveUnique):
+            return NotImplemented
         return (
             self.model == other.model
             and self.field_name == other.field_name
@@ -204,6 +230,67 @@ class CaseInsensitiveUnique:
         )
 
 
+class UniqueValues:
+    """Case-insensitive checks for values already used by other records of the model.
+        The candidate values added before the first check are all looked up together, in one query of the indexed
+        FOLDED_FIELDS copies, and any other value is queried on its own. Values of the given instance, such as the
+        user being updated, are its own and never checked.
+    """
+
+    def __init__(self, model, instance=None):
+        self.model = model
+        self.instance = instance if getattr(instance, 'pk', None) is not None else None
+        self.candidates = {}
+        self._used = None
+
+    def is_instance_value(self, field_name, value):
+        """Returns True if the casefolded value is the one the instance already has. """
+        return self.instance is not None and fold_case(getattr(self.instance, field_name, None)) == value
+
+    def add(self, field_name, *values):
+        """Include the values for the field in the one query, except any that are empty or the instance values. """
+        values = {fold_case(value) for value in values if isinstance(value, str)}
+        values = {value for value in values if value and not self.is_instance_value(field_name, value)}
+        if values:
+            self.candidates.setdefault(field_name, set()).update(values)
+            self._used = None
+
+    def get_queryset(self):
+        """All the records of the model, except the instance. """
+        queryset = self.model._default_manager.all()
+        if self.instance is not None:
+            queryset = queryset.exclude(pk=self.instance.pk)
+        return queryset
+
+    @property
+    def used(self):
+        """A dict of field names and the set of their candidate values already used, from one query. """
+        if self._used is None:
+            folded = getattr(self.model, 'FOLDED_FIELDS', {})
+            fields = {name: folded[name] for name in self.candidates if name in folded}
+            self._used = {name: set() for name in fields}
+            if fields:
+                condition = Q()
+                for name, folded_name in fields.items():
+                    condition |= Q(**{folded_name + '__in': self.candidates[name]})
+                for row in self.get_queryset().filter(condition).values_list(*fields.values()):
+                    for name, value in zip(fields, row):
+                        if value in self.candidates[name]:
+                            self._used[name].add(value)
+        return self._used
+
+    def is_used(self, field_name, value):
+        """Returns True if another record has this value for the field, compared case-insensitively. """
+        value = fold_case(value)
+        if self.is_instance_value(field_name, value):
+            return False
+        if value in self.candidates.get(field_name, ()) and field_name in self.used:
+            return value in self.used[field_name]
+        folded = getattr(self.model, 'FOLDED_FIELDS', {}).get(field_name)
+        lookup = {folded: value} if folded else {"{}__iexact".format(field_name): value}
+        return self.get_queryset().filter(**lookup).exists()
+
+
 @deconstructible
 class HTML5EmailValidator(RegexValidator):
     """Use the HTML5 email address rules. """
@@ -215,7 +302,7 @@ def validate_confusables(value):
     """Avoid mixed-script containing one or more characters in Unicode Visually Confusable Characters file. """
     if not isinstance(value, str):
         return
-    if confusables.is_dangerous(value):
+    if is_dangerous(value):
         raise ValidationError(CONFUSABLE, code="invalid")
 
 
@@ -233,5 +320,30 @@ def validate_confusables_email(value):
     if value.count("@") != 1:
         return
     local_part, domain = value.split("@")
-    if confusables.is_dangerous(local_part) or confusables.is_dangerous(domain):
+    if is_dangerous(local_part) or is_dangerous(domain):
         raise ValidationError(CONFUSABLE_EMAIL, code="invalid")
+
+
+USERNAME_CHECKS = (ReservedNameValidator(), validate_confusables)
+EMAIL_CHECKS = (HTML5EmailValidator(), validate_confusables_email)
+
+
+def validate_critical(username=None, email=None, reserved_names=None):
+    """Runs the username and email checks in one pass, raising a ValidationError with errors for each failed field.
+        The username is checked for reserved names, the default ones if not given, and confusables. The email is
+        checked for format and confusables.
+    """
+    username_checks = USERNAME_CHECKS
+    if reserved_names is not None:
+        username_checks = (ReservedNameValidator(reserved_names), validate_confusables)
+    errors = {}
+    for name, value, checks in (('username', username, username_checks), ('email', email, EMAIL_CHECKS)):
+        if value is None:
+            continue
+        for validator in checks:
+            try:
+                validator(value)
+            except ValidationError as e:
+                errors.setdefault(name, []).append(e)
+    if errors:
+        raise ValidationError(errors)
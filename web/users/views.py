@@ -6,7 +6,8 @@ from .models import UserHC
 # from django_registration.views import RegistrationView as BaseRegistrationView
 from django_registration.backends.one_step.views import RegistrationView
 from .forms import CustomRegistrationForm, CustomUserCreationForm, CustomUserChangeForm
-from pprint import pprint  # TODO: Remove after debug
+import logging
+logger = logging.getLogger(__name__)
 
 
 @method_decorator(csrf_protect, name='dispatch')
@@ -15,10 +16,7 @@ class CustomRegistrationView(RegistrationView):
     success_url = reverse_lazy('profile_page')
 
     def register(self, form):
-        print("===================== CustomRegistrationView.register ============================")
-        pprint(form)
-        print("----------------------------------------------------------------------------------")
-        pprint(self)
+        logger.debug("CustomRegistrationView.register with form: %r", form)
         return super().register(form)
 
 